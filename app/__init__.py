@@ -1,6 +1,7 @@
 from flask import Flask, request, send_from_directory, send_file
 from app.config import Config
 from app.utils.error_handlers import register_error_handlers
+from app.utils.json_provider import register_json_provider
 from app.services.redis_service import init_redis
 from app.services.vectorstore_service import init_vectorstore
 from app.services.openai_service import init_openai
@@ -15,6 +16,7 @@ def create_app(config_class=Config):
     """Factory pattern para crear la aplicación Flask"""
     app = Flask(__name__)
     app.config.from_object(config_class)
+    register_json_provider(app)
     
     # Configurar logging
     logging.basicConfig(
@@ -44,7 +46,7 @@ def create_app(config_class=Config):
                     from app.services.vector_auto_recovery import get_auto_recovery_instance
                     auto_recovery = get_auto_recovery_instance()
                     
-                    if auto_recovery:
+                    if auto_recovery and not auto_recovery.is_known_healthy():
                         # Verificación no-bloqueante del estado del índice
                         health = auto_recovery.verify_index_health()
                         
@@ -150,7 +152,7 @@ def startup_checks(app):
     try:
         with app.app_context():
             from app.services.redis_service import get_redis_client
-            from app.services.openai_service import OpenAIService
+            from app.services.openai_service import get_openai_service
             from app.services.vectorstore_service import VectorstoreService
             
             # Validar Redis
@@ -158,7 +160,7 @@ def startup_checks(app):
             redis_client.ping()
             
             # Validar OpenAI
-            openai_service = OpenAIService()
+            openai_service = get_openai_service()
             openai_service.test_connection()
             
             # Validar Vectorstore
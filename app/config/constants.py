@@ -8,7 +8,7 @@ BOT_INACTIVE_STATUSES = ["pending", "resolved", "snoozed"]
 REDIS_PREFIXES = {
     "conversation": "conversation:",
     "document": "document:",
-    "bot_status": "bot_status:",
+    "bot_status": "bot_active:",
     "processed_message": "processed_message:",
     "chat_history": "chat_history:",
     "cache": "cache:",
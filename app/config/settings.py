@@ -14,11 +14,14 @@ class Config:
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
     MODEL_NAME = os.getenv('MODEL_NAME', 'gpt-4o-mini')  # UNIFIED: Same as monolith
     EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'text-embedding-3-small')
+    EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', 512))
+    EMBEDDING_CACHE_TTL = int(os.getenv('EMBEDDING_CACHE_TTL', 3600))  # ingest-scoped: covers retried uploads
     MAX_TOKENS = int(os.getenv('MAX_TOKENS', 1500))
     TEMPERATURE = float(os.getenv('TEMPERATURE', 0.7))
     
     # Redis
     REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379')
+    REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', 50))
     
     # Chatwoot
     CHATWOOT_API_KEY = os.getenv('CHATWOOT_API_KEY')
@@ -30,6 +33,9 @@ class Config:
     MAX_CONTEXT_MESSAGES = int(os.getenv('MAX_CONTEXT_MESSAGES', 10))
     SIMILARITY_THRESHOLD = float(os.getenv('SIMILARITY_THRESHOLD', 0.7))
     MAX_RETRIEVED_DOCS = int(os.getenv('MAX_RETRIEVED_DOCS', 3))
+    VECTOR_INDEX_ALGORITHM = os.getenv('VECTOR_INDEX_ALGORITHM', 'HNSW')  # FLAT for exact KNN
+    VECTOR_DATATYPE = os.getenv('VECTOR_DATATYPE', 'FLOAT16')  # New indexes only; needs RediSearch 2.10+
+    WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 32))
     
     # Logging
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
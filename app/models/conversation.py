@@ -3,11 +3,21 @@ from langchain_community.chat_message_histories import RedisChatMessageHistory
 from langchain_core.messages import HumanMessage, AIMessage
 import logging
 import json
+import functools
 import time
 from typing import Dict, List, Any, Optional
 
 logger = logging.getLogger(__name__)
 
+
+@functools.lru_cache(maxsize=10000)
+def _standardize_user_id(contact_id: str) -> str:
+    """contact_id -> user_id mapping, stable across requests so it is cached process-wide"""
+    if not contact_id.startswith("chatwoot_contact_"):
+        return f"chatwoot_contact_{contact_id}"
+    return contact_id
+
+
 class ConversationManager:
     """Gestión modularizada de conversaciones"""
     
@@ -19,9 +29,7 @@ class ConversationManager:
     
     def _create_user_id(self, contact_id: str) -> str:
         """Generate standardized user ID"""
-        if not contact_id.startswith("chatwoot_contact_"):
-            return f"chatwoot_contact_{contact_id}"
-        return contact_id
+        return _standardize_user_id(contact_id)
     
     def get_chat_history(self, user_id: str, format_type: str = "dict"):
         """Get chat history in specified format"""
@@ -1,8 +1,8 @@
 from app.services.redis_service import get_redis_client
+from app.utils.helpers import generate_doc_id
 from datetime import datetime
 
-import hashlib
-import json
+import orjson
 import logging
 import time  # Missing import
 from typing import List, Dict, Any, Optional, Tuple
@@ -19,36 +19,45 @@ class DocumentManager:
     def add_document(self, content: str, metadata: Dict[str, Any], 
                     vectorstore_service) -> Tuple[str, int]:
         """Add a single document"""
+        doc_id, texts, chunk_metadatas = self._prepare_document(content, metadata, vectorstore_service)
+        
+        # Add to vectorstore
+        vectorstore_service.add_texts(texts, chunk_metadatas)
+        
+        self._save_document(doc_id, content, metadata, len(texts))
+        return doc_id, len(texts)
+    
+    def _prepare_document(self, content: str, metadata: Dict[str, Any],
+                          vectorstore_service, chunks=None) -> Tuple[str, List[str], List[Dict[str, Any]]]:
+        """Generate doc_id and chunks (with doc metadata) for a document"""
         # Generate doc_id
-        doc_id = hashlib.md5(content.encode()).hexdigest()
+        doc_id = generate_doc_id(content)
         metadata['doc_id'] = doc_id
         
-        # Create chunks
-        texts, chunk_metadatas = vectorstore_service.create_chunks(content)
+        # Create chunks (unless already split in bulk)
+        texts, chunk_metadatas = chunks if chunks is not None else vectorstore_service.create_chunks(content)
         
         # Add doc_id to all chunk metadata
         for i, chunk_meta in enumerate(chunk_metadatas):
             chunk_meta.update(metadata)
             chunk_meta['chunk_index'] = i
         
-        # Add to vectorstore
-        vectorstore_service.add_texts(texts, chunk_metadatas)
-        
-        # Save document in Redis
+        return doc_id, texts, chunk_metadatas
+    
+    def _save_document(self, doc_id: str, content: str, metadata: Dict[str, Any], chunk_count: int):
+        """Save the document hash and register the change"""
         doc_key = f"document:{doc_id}"
         doc_data = {
             'content': content,
-            'metadata': json.dumps(metadata),
+            'metadata': orjson.dumps(metadata).decode(),
             'created_at': datetime.utcnow().isoformat(),
-            'chunk_count': str(len(texts))
+            'chunk_count': str(chunk_count)
         }
         
         self.redis_client.hset(doc_key, mapping=doc_data)
         
         # Track change
         self.change_tracker.register_document_change(doc_id, 'added')
-        
-        return doc_id, len(texts)
     
     def bulk_add_documents(self, documents: List[Dict[str, Any]], 
                           vectorstore_service) -> Dict[str, Any]:
@@ -58,21 +67,60 @@ class DocumentManager:
         errors = []
         added_doc_ids = []
         
+        # Validate, then split every document in one call (parallel for large batches)
+        valid = []
         for i, doc_data in enumerate(documents):
             try:
                 content = doc_data.get('content', '').strip()
-                metadata = doc_data.get('metadata', {})
-                
                 if not content:
                     raise ValueError("Content cannot be empty")
+                valid.append((i, content, doc_data.get('metadata', {})))
+            except Exception as e:
+                errors.append(f"Document {i}: {str(e)}")
+        
+        all_chunks = vectorstore_service.create_chunks_many([content for _, content, _ in valid])
+        
+        # Prepare every document first so all chunks are embedded in shared batches
+        prepared = []
+        all_texts = []
+        all_metadatas = []
+        for (i, content, metadata), chunks in zip(valid, all_chunks):
+            try:
+                doc_id, texts, chunk_metadatas = self._prepare_document(content, metadata, vectorstore_service, chunks)
+                prepared.append((i, doc_id, content, metadata, len(texts)))
+                all_texts.extend(texts)
+                all_metadatas.extend(chunk_metadatas)
                 
-                doc_id, num_chunks = self.add_document(content, metadata, vectorstore_service)
+            except Exception as e:
+                errors.append(f"Document {i}: {str(e)}")
+                continue
+        
+        try:
+            all_keys = vectorstore_service.add_texts_batched(all_texts, all_metadatas) if all_texts else []
+        except Exception as e:
+            errors.extend(f"Document {i}: {str(e)}" for i, *_ in prepared)
+            prepared = []
+        
+        # A failed batch only fails the documents with chunks in it
+        offset = 0
+        for i, doc_id, content, metadata, num_chunks in prepared:
+            doc_keys = all_keys[offset:offset + num_chunks]
+            doc_metadatas = all_metadatas[offset:offset + num_chunks]
+            offset += num_chunks
+            try:
+                if None in doc_keys:
+                    raise RuntimeError(f"could not store {doc_keys.count(None)} of {num_chunks} chunks")
+                self._save_document(doc_id, content, metadata, num_chunks)
                 
                 added_docs += 1
                 total_chunks += num_chunks
                 added_doc_ids.append(doc_id)
                 
             except Exception as e:
+                # Don't leave chunks behind for a document that wasn't saved
+                landed = [(key, meta) for key, meta in zip(doc_keys, doc_metadatas) if key is not None]
+                if landed:
+                    vectorstore_service.discard_texts([key for key, _ in landed], [meta for _, meta in landed])
                 errors.append(f"Document {i}: {str(e)}")
                 continue
         
@@ -96,7 +144,7 @@ class DocumentManager:
         
         # Find and delete vectors
         vectors = vectorstore_service.find_vectors_by_doc_id(doc_id)
-        vectors_deleted = vectorstore_service.delete_vectors(vectors)
+        vectors_deleted = vectorstore_service.delete_vectors(vectors, doc_ids=[doc_id])
         
         # Delete document
         self.redis_client.delete(doc_key)
@@ -127,7 +175,7 @@ class DocumentManager:
                 if doc_data:
                     doc_id = key.split(':', 1)[1]
                     content = doc_data.get('content', '')
-                    metadata = json.loads(doc_data.get('metadata', '{}'))
+                    metadata = orjson.loads(doc_data.get('metadata', '{}'))
                     
                     documents.append({
                         "id": doc_id,
@@ -151,33 +199,26 @@ class DocumentManager:
     def cleanup_orphaned_vectors(self, vectorstore_service, dry_run: bool = True) -> Dict[str, Any]:
         """Clean up orphaned vectors"""
         # Get all documents
-        doc_keys = self.redis_client.keys("document:*")
-        existing_doc_ids = set()
-        
-        for key in doc_keys:
-            doc_id = key.split(':', 1)[1]
-            existing_doc_ids.add(doc_id)
-        
-        # Get all vectors
-        vector_pattern = f"{vectorstore_service.index_name}:*"
-        vector_keys = self.redis_client.keys(vector_pattern)
+        existing_doc_ids = {
+            key.split(':', 1)[1] for key in self.redis_client.scan_iter(match="document:*", count=1000)
+        }
         
+        # Walk all vectors (SCAN + pipelined field reads)
+        total_vectors = 0
         orphaned_vectors = []
         
-        for vector_key in vector_keys:
+        for vector_key, doc_id_direct, metadata_str in vectorstore_service.iter_vector_fields():
+            total_vectors += 1
             try:
                 doc_id = None
                 
                 # Check direct field
-                doc_id_direct = self.redis_client.hget(vector_key, 'doc_id')
                 if doc_id_direct:
                     doc_id = doc_id_direct
-                else:
+                elif metadata_str:
                     # Check metadata
-                    metadata_str = self.redis_client.hget(vector_key, 'metadata')
-                    if metadata_str:
-                        metadata = json.loads(metadata_str)
-                        doc_id = metadata.get('doc_id')
+                    metadata = orjson.loads(metadata_str)
+                    doc_id = metadata.get('doc_id')
                 
                 if doc_id and doc_id not in existing_doc_ids:
                     orphaned_vectors.append({
@@ -193,10 +234,12 @@ class DocumentManager:
         deleted_count = 0
         if not dry_run and orphaned_vectors:
             keys_to_delete = [v["vector_key"] for v in orphaned_vectors]
-            deleted_count = vectorstore_service.delete_vectors(keys_to_delete)
+            deleted_count = vectorstore_service.delete_vectors(
+                keys_to_delete, doc_ids={v["doc_id"] for v in orphaned_vectors}
+            )
         
         return {
-            "total_vectors": len(vector_keys),
+            "total_vectors": total_vectors,
             "total_documents": len(existing_doc_ids),
             "orphaned_vectors_found": len(orphaned_vectors),
             "orphaned_vectors_deleted": deleted_count,
@@ -206,24 +249,22 @@ class DocumentManager:
     
     def get_diagnostics(self, vectorstore_service) -> Dict[str, Any]:
         """Get system diagnostics"""
-        doc_keys = self.redis_client.keys("document:*")
-        vector_keys = self.redis_client.keys(f"{vectorstore_service.index_name}:*")
+        doc_keys = list(self.redis_client.scan_iter(match="document:*", count=1000))
         
+        total_vectors = 0
         doc_id_counts = {}
         vectors_without_doc_id = 0
         
-        for vector_key in vector_keys:
+        for vector_key, doc_id_direct, metadata_str in vectorstore_service.iter_vector_fields():
+            total_vectors += 1
             try:
                 doc_id = None
                 
-                doc_id_direct = self.redis_client.hget(vector_key, 'doc_id')
                 if doc_id_direct:
                     doc_id = doc_id_direct
-                else:
-                    metadata_str = self.redis_client.hget(vector_key, 'metadata')
-                    if metadata_str:
-                        metadata = json.loads(metadata_str)
-                        doc_id = metadata.get('doc_id')
+                elif metadata_str:
+                    metadata = orjson.loads(metadata_str)
+                    doc_id = metadata.get('doc_id')
                 
                 if doc_id:
                     doc_id_counts[doc_id] = doc_id_counts.get(doc_id, 0) + 1
@@ -242,7 +283,7 @@ class DocumentManager:
         
         return {
             "total_documents": len(doc_keys),
-            "total_vectors": len(vector_keys),
+            "total_vectors": total_vectors,
             "vectors_without_doc_id": vectors_without_doc_id,
             "documents_with_vectors": len(doc_id_counts),
             "orphaned_documents": len(orphaned_docs),
@@ -286,7 +327,7 @@ class DocumentChangeTracker:
            }
            
            change_key = f"doc_change:{doc_id}:{int(time.time())}"
-           self.redis_client.setex(change_key, 3600, json.dumps(change_data))
+           self.redis_client.setex(change_key, 3600, orjson.dumps(change_data))
            
            self.increment_version()
            
@@ -1,7 +1,8 @@
 from flask import Blueprint, request, jsonify, current_app
 from app.services.vectorstore_service import VectorstoreService
 from app.services.redis_service import get_redis_client
-from app.services.multiagent_system import MultiAgentSystem
+from app.services.multiagent_system import get_multiagent_system
+from app.services.chatwoot_service import count_active_bots, count_processed_messages
 from app.utils.decorators import handle_errors, require_api_key
 from app.utils.helpers import create_success_response, create_error_response
 import logging
@@ -26,7 +27,7 @@ def force_vectorstore_recovery():
         logger.info("Manual recovery initiated...")
         
         # Limpiar cache
-        auto_recovery.health_cache = {"last_check": 0, "status": None}
+        auto_recovery.clear_health_cache()
         
         success = auto_recovery.reconstruct_index_from_stored_data()
         
@@ -107,7 +108,7 @@ def reset_system():
         redis_client = get_redis_client()
         
         # Clear caches
-        patterns = ["processed_message:*", "bot_status:*", "cache:*"]
+        patterns = ["processed_message:*", "bot_active:*", "bot_status:*", "media_ctx:*", "cache:*"]
         cleared_count = 0
         
         for pattern in patterns:
@@ -121,7 +122,7 @@ def reset_system():
             from app.services.vector_auto_recovery import get_auto_recovery_instance
             auto_recovery = get_auto_recovery_instance()
             if auto_recovery:
-                auto_recovery.health_cache = {"last_check": 0, "status": None}
+                auto_recovery.clear_health_cache()
                 logger.info("Auto-recovery cache cleared")
         except Exception as e:
             logger.warning(f"Could not clear auto-recovery cache: {e}")
@@ -149,22 +150,14 @@ def get_system_status():
         # Count various entities
         conversation_count = len(redis_client.keys("conversation:*"))
         document_count = len(redis_client.keys("document:*"))
-        bot_status_keys = redis_client.keys("bot_status:*")
-        processed_message_count = len(redis_client.keys("processed_message:*"))
-        
-        # Count active bots
-        active_bots = 0
-        for key in bot_status_keys:
-            try:
-                status_data = redis_client.hgetall(key)
-                if status_data.get('active') == 'True':
-                    active_bots += 1
-            except:
-                continue
+        processed_message_count = count_processed_messages(redis_client)
+        
+        # Count active bots (one MGET over the bot_active:* flags)
+        total_bot_statuses, active_bots = count_active_bots(redis_client)
         
         # Get multi-agent stats
         try:
-            multiagent = MultiAgentSystem()
+            multiagent = get_multiagent_system()
             multiagent_stats = multiagent.get_system_stats()
         except Exception as e:
             multiagent_stats = {"error": f"Could not get multiagent stats: {e}"}
@@ -189,7 +182,7 @@ def get_system_status():
             "statistics": {
                 "total_conversations": conversation_count,
                 "active_bots": active_bots,
-                "total_bot_statuses": len(bot_status_keys),
+                "total_bot_statuses": total_bot_statuses,
                 "processed_messages": processed_message_count,
                 "total_documents": document_count
             },
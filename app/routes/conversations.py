@@ -1,9 +1,10 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, stream_with_context
 from app.models.conversation import ConversationManager
 from app.utils.decorators import handle_errors
 from app.utils.helpers import create_success_response, create_error_response
 import logging
 import time  # Missing import
+import orjson
 
 logger = logging.getLogger(__name__)
 
@@ -73,9 +74,9 @@ def test_conversation(user_id):
         if not message:
             return create_error_response("Message cannot be empty", 400)
         
-        from app.services.multiagent_system import MultiAgentSystem
+        from app.services.multiagent_system import get_multiagent_system
         manager = ConversationManager()
-        multiagent = MultiAgentSystem()
+        multiagent = get_multiagent_system()
         
         response, agent_used = multiagent.get_response(message, user_id, manager)
         
@@ -90,3 +91,33 @@ def test_conversation(user_id):
     except Exception as e:
         logger.error(f"Error testing conversation: {e}")
         return create_error_response("Failed to test conversation", 500)
+
+@bp.route('/<user_id>/stream', methods=['POST'])
+@handle_errors
+def stream_conversation(user_id):
+    """Test conversation streaming the reply as Server-Sent Events"""
+    data = request.get_json()
+    message = str(data.get('message', '')).strip() if isinstance(data, dict) else ''
+    if not message:
+        return create_error_response("Message is required", 400)
+    
+    from app.services.multiagent_system import get_multiagent_system
+    manager = ConversationManager()
+    multiagent = get_multiagent_system()
+    
+    def events():
+        try:
+            for chunk in multiagent.stream_response(message, user_id, manager):
+                yield b"data: " + orjson.dumps({"chunk": chunk}) + b"\n\n"
+        except Exception as e:
+            # Headers are already sent: report the failure in-band instead of truncating the stream
+            logger.error(f"Error streaming conversation: {e}")
+            yield b"event: error\ndata: " + orjson.dumps({"message": "Failed to stream response"}) + b"\n\n"
+            return
+        yield b"event: done\ndata: " + orjson.dumps({"timestamp": time.time()}) + b"\n\n"
+    
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
@@ -82,6 +82,39 @@ def search_documents():
         logger.error(f"Error searching documents: {e}")
         return create_error_response("Failed to search documents", 500)
 
+@bp.route('/search/batch', methods=['POST'])
+@handle_errors
+def batch_search_documents():
+    """Run several semantic searches in one request"""
+    try:
+        data = request.get_json()
+        if not data or not isinstance(data.get('queries'), list):
+            return create_error_response("Queries array is required", 400)
+        
+        queries = [q.strip() for q in data['queries'] if isinstance(q, str) and q.strip()]
+        if not queries:
+            return create_error_response("Queries cannot be empty", 400)
+        
+        if len(queries) > 50:
+            return create_error_response("Maximum 50 queries per batch", 400)
+        
+        k = min(data.get('k', 3), 20)
+        
+        vectorstore_service = VectorstoreService()
+        results = vectorstore_service.batch_search(queries, k)
+        
+        return create_success_response({
+            "queries_count": len(queries),
+            "results": [
+                {"query": query, "results_count": len(hits), "results": hits}
+                for query, hits in zip(queries, results)
+            ]
+        })
+        
+    except Exception as e:
+        logger.error(f"Error in batch search: {e}")
+        return create_error_response("Failed to search documents", 500)
+
 @bp.route('/bulk', methods=['POST'])
 @handle_errors
 def bulk_add_documents():
@@ -1,9 +1,9 @@
 from flask import Blueprint, jsonify, current_app
 from app.services.redis_service import get_redis_client
 from app.services.vectorstore_service import VectorstoreService
-from app.services.openai_service import OpenAIService
+from app.services.openai_service import get_openai_service
 from app.models.conversation import ConversationManager
-from app.services.multiagent_system import MultiAgentSystem
+from app.services.multiagent_system import get_multiagent_system
 from app.utils.decorators import handle_errors
 import time
 import logging
@@ -22,7 +22,7 @@ def health_check():
         redis_client = get_redis_client()
         conversation_count = len(redis_client.keys("conversation:*"))
         document_count = len(redis_client.keys("document:*"))
-        bot_status_count = len(redis_client.keys("bot_status:*"))
+        bot_status_count = len(redis_client.keys("bot_active:*"))
         
         healthy = all("error" not in str(status) for status in components.values())
         
@@ -79,7 +79,7 @@ def vectorstore_health():
 def multiagent_health():
     """Multi-agent system health check"""
     try:
-        multiagent = MultiAgentSystem()
+        multiagent = get_multiagent_system()
         health = multiagent.health_check()
         
         return jsonify(health), 200
@@ -101,7 +101,7 @@ def check_component_health():
     
     # Check OpenAI
     try:
-        openai_service = OpenAIService()
+        openai_service = get_openai_service()
         openai_service.test_connection()
         components["openai"] = "connected"
     except Exception as e:
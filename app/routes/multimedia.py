@@ -1,17 +1,22 @@
 from flask import Blueprint, request, jsonify, send_file
-from app.services.openai_service import OpenAIService
-from app.services.multiagent_system import MultiAgentSystem
+from app.services.openai_service import get_openai_service
+from app.services.multiagent_system import get_multiagent_system
 from app.models.conversation import ConversationManager
 from app.utils.decorators import handle_errors
-from app.utils.helpers import create_success_response, create_error_response
+from app.utils.helpers import create_success_response, create_error_response, audio_upload_extension
 import logging
-import tempfile
-import os
+import io
 
 logger = logging.getLogger(__name__)
 
 bp = Blueprint('multimedia', __name__)
 
+def _audio_upload_buffer(upload) -> io.BytesIO:
+    """Uploaded audio as an in-memory file; Whisper only needs the name for the format"""
+    buffer = io.BytesIO(upload.read())
+    buffer.name = f"audio{audio_upload_extension(upload.mimetype or '', upload.filename or '')}"
+    return buffer
+
 @bp.route('/process-voice', methods=['POST'])
 @handle_errors
 def process_voice_message():
@@ -26,44 +31,32 @@ def process_voice_message():
         if not user_id:
             return create_error_response("User ID is required", 400)
         
-        # Save file temporarily
-        temp_path = None
-        try:
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.mp3') as temp_file:
-                audio_file.save(temp_file.name)
-                temp_path = temp_file.name
-            
-            # Transcribe audio
-            openai_service = OpenAIService()
-            transcript = openai_service.transcribe_audio(temp_path)
-            
-            # Process with multi-agent system
-            manager = ConversationManager()
-            multiagent = MultiAgentSystem()
-            
-            response, agent_used = multiagent.get_response(
-                user_id=user_id,
-                question="",
-                conversation_manager=manager,
-                media_type="voice",
-                media_context=transcript
-            )
-            
-            # Convert response to audio if requested
-            if request.form.get('return_audio', 'false').lower() == 'true':
-                audio_response_path = openai_service.text_to_speech(response)
-                return send_file(audio_response_path, mimetype="audio/mpeg")
-            
-            return create_success_response({
-                "transcript": transcript,
-                "response": response,
-                "agent_used": agent_used
-            })
-            
-        finally:
-            # Cleanup temp file
-            if temp_path and os.path.exists(temp_path):
-                os.unlink(temp_path)
+        # Transcribe audio
+        openai_service = get_openai_service()
+        transcript = openai_service.transcribe_audio(_audio_upload_buffer(audio_file))
+        
+        # Process with multi-agent system
+        manager = ConversationManager()
+        multiagent = get_multiagent_system()
+        
+        response, agent_used = multiagent.get_response(
+            user_id=user_id,
+            question="",
+            conversation_manager=manager,
+            media_type="voice",
+            media_context=transcript
+        )
+        
+        # Convert response to audio if requested
+        if request.form.get('return_audio', 'false').lower() == 'true':
+            audio_response = io.BytesIO(openai_service.text_to_speech_bytes(response))
+            return send_file(audio_response, mimetype="audio/mpeg")
+        
+        return create_success_response({
+            "transcript": transcript,
+            "response": response,
+            "agent_used": agent_used
+        })
         
     except Exception as e:
         logger.error(f"Error processing voice message: {e}")
@@ -85,12 +78,12 @@ def process_image_message():
             return create_error_response("User ID is required", 400)
         
         # Analyze image
-        openai_service = OpenAIService()
+        openai_service = get_openai_service()
         image_description = openai_service.analyze_image(image_file)
         
         # Process with multi-agent system
         manager = ConversationManager()
-        multiagent = MultiAgentSystem()
+        multiagent = get_multiagent_system()
         
         response, agent_used = multiagent.get_response(
             user_id=user_id,
@@ -121,28 +114,19 @@ def test_multimedia_processing():
         if media_type == 'voice' and 'audio' in request.files:
             audio_file = request.files['audio']
             
-            # Save temporarily
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.mp3') as temp_file:
-                audio_file.save(temp_file.name)
-                temp_path = temp_file.name
+            openai_service = get_openai_service()
+            transcript = openai_service.transcribe_audio(_audio_upload_buffer(audio_file))
             
-            try:
-                openai_service = OpenAIService()
-                transcript = openai_service.transcribe_audio(temp_path)
-                
-                return create_success_response({
-                    "media_type": "voice",
-                    "transcript": transcript,
-                    "processing_success": True
-                })
-            finally:
-                if os.path.exists(temp_path):
-                    os.unlink(temp_path)
+            return create_success_response({
+                "media_type": "voice",
+                "transcript": transcript,
+                "processing_success": True
+            })
         
         elif media_type == 'image' and 'image' in request.files:
             image_file = request.files['image']
             
-            openai_service = OpenAIService()
+            openai_service = get_openai_service()
             description = openai_service.analyze_image(image_file)
             
             return create_success_response({
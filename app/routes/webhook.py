@@ -1,10 +1,9 @@
 from flask import Blueprint, request, jsonify
-from app.services.chatwoot_service import ChatwootService
-from app.services.multiagent_system import MultiAgentSystem
-from app.models.conversation import ConversationManager
+from app.services.chatwoot_service import ChatwootService, enqueue_incoming_message
 from app.utils.validators import validate_webhook_data
 from app.utils.decorators import handle_errors
 import logging
+import orjson
 
 logger = logging.getLogger(__name__)
 
@@ -22,18 +21,17 @@ class WebhookError(Exception):
 def chatwoot_webhook():
     """Handle Chatwoot webhook events"""
     try:
-        data = request.get_json()
+        try:
+            data = orjson.loads(request.get_data())
+        except orjson.JSONDecodeError:
+            data = None
         event_type = validate_webhook_data(data)
         
         logger.info(f"🔔 WEBHOOK RECEIVED - Event: {event_type}")
         
-        chatwoot_service = ChatwootService()
-        conversation_manager = ConversationManager()
-        multiagent = MultiAgentSystem()
-        
         # Handle conversation updates
         if event_type == "conversation_updated":
-            success = chatwoot_service.handle_conversation_updated(data)
+            success = ChatwootService().handle_conversation_updated(data)
             status_code = 200 if success else 400
             return jsonify({"status": "conversation_updated_processed", "success": success}), status_code
         
@@ -42,15 +40,14 @@ def chatwoot_webhook():
             logger.info(f"⏭️ Ignoring event type: {event_type}")
             return jsonify({"status": "ignored_event_type", "event": event_type}), 200
         
-        # AGREGADO: Debug completo para imágenes (EXACTLY like monolith)
-        if data.get('attachments'):
-            chatwoot_service.debug_webhook_data(data)
-        
-        # Process incoming message
-        result = chatwoot_service.process_incoming_message(data, conversation_manager, multiagent)
+        # Outgoing/agent messages never reach Redis or the service layer
+        message_type = data.get("message_type")
+        if message_type != "incoming":
+            logger.info(f"🤖 Ignoring message type: {message_type}")
+            return jsonify({"status": "non_incoming_message", "ignored": True}), 200
         
-        if result.get("ignored"):
-            return jsonify(result), 200
+        # Validate + dedupe inline, reply pipeline in background; ACK Chatwoot right away
+        result = enqueue_incoming_message(data)
         
         return jsonify(result), 200
         
@@ -1,42 +1,361 @@
 from app.services.redis_service import get_redis_client
 from app.models.conversation import ConversationManager
-from app.services.multiagent_system import MultiAgentSystem
-from app.services.openai_service import OpenAIService
+from app.services.multiagent_system import MultiAgentSystem, get_multiagent_system
+from app.services.openai_service import get_openai_service
+from app.config.constants import (
+    BOT_ACTIVE_STATUSES, BOT_INACTIVE_STATUSES,
+    SUPPORTED_IMAGE_TYPES, SUPPORTED_AUDIO_TYPES
+)
+from app.utils.helpers import audio_upload_extension
 from flask import current_app
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import httpx
+import asyncio
+import threading
 import logging
-import json
-import time
-import tempfile
-import os
-import base64
+import re
+import orjson
+import functools
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from io import BytesIO
-from typing import Dict, Any, Optional, Tuple
+from urllib.parse import urljoin
+from typing import Dict, Any, List, Optional, Tuple, Union
 
 logger = logging.getLogger(__name__)
 
+MEDIA_PROCESSING_TIMEOUT = 25
+MEDIA_CHUNK_SIZE = 65536
+MEDIA_CACHE_TTL = 86400  # transcriptions/analyses keyed by attachment URL
+
+# Pooled keep-alive session for media downloads from Chatwoot
+_http_session = requests.Session()
+_http_adapter = HTTPAdapter(
+    pool_connections=20,
+    pool_maxsize=100,
+    max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=[429, 500, 502, 503, 504])
+)
+_http_session.mount('https://', _http_adapter)
+_http_session.mount('http://', _http_adapter)
+_AUDIO_DOWNLOAD_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (compatible; ChatbotAudioTranscriber/1.0)',
+    'Accept': 'audio/*,*/*;q=0.9'
+}
+_IMAGE_DOWNLOAD_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (compatible; ChatbotImageAnalyzer/1.0)'
+}
+
+# Background event loop + pooled async HTTP client for outbound Chatwoot calls
+_async_loop: Optional[asyncio.AbstractEventLoop] = None
+_async_http: Optional[httpx.AsyncClient] = None
+_async_lock = threading.Lock()
+SEND_MESSAGE_TIMEOUT = 30
+SEND_MESSAGE_MAX_RETRIES = 3
+
+# Pre-built responses for the common skip paths (treat as read-only)
+_ACTIVE_ONLY_FOR = tuple(sorted(BOT_ACTIVE_STATUSES))
+_NON_INCOMING_RESULT = {"status": "non_incoming_message", "ignored": True}
+_ALREADY_PROCESSED_RESULT = {"status": "already_processed", "ignored": True}
+_EMPTY_MESSAGE_RESULT = {"status": "empty", "ignored": True}
+
+# Webhook work runs off the request thread so Chatwoot gets an immediate ACK
+_webhook_pool: Optional[ThreadPoolExecutor] = None
+_webhook_lock = threading.Lock()
+
+BOT_STATUS_TTL = 86400  # 24 hours
+BOT_STATUS_REFRESH_BELOW = BOT_STATUS_TTL // 2  # unchanged statuses only refresh TTL past this point
+
+# Returns the previous flag; skips the write when the flag is unchanged and the TTL is fresh
+_BOT_STATUS_LUA = """
+local old = redis.call('GET', KEYS[1])
+if old == ARGV[1] and redis.call('TTL', KEYS[1]) > tonumber(ARGV[2]) then
+    return old
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3])
+return old
+"""
+
+PROCESSED_MESSAGE_TTL = 3600  # 1 hour
+
+# Sent when the background pipeline fails after the webhook was ACKed
+PIPELINE_ERROR_REPLY = "Disculpa, tuvimos un problema procesando tu mensaje. ¿Podrías enviarlo de nuevo? 😊"
+
+
+def _processed_message_key(conversation_id, message_id) -> str:
+    return f"processed_message:{conversation_id}:{message_id}"
+
+
+def _queue_message_claim(pipe, conversation_id, message_id):
+    """Queue the exact claim (SET NX EX) of a message id on a pipeline"""
+    pipe.set(_processed_message_key(conversation_id, message_id), "1", nx=True, ex=PROCESSED_MESSAGE_TTL)
+
+
+def _claim_was_new(claim_results: List[Any]) -> bool:
+    """Interpret the results of _queue_message_claim (None: the key already existed)"""
+    return bool(claim_results[0])
+
+
+def count_processed_messages(redis_client) -> int:
+    """Number of messages claimed within PROCESSED_MESSAGE_TTL"""
+    return sum(1 for _ in redis_client.scan_iter(match="processed_message:*", count=1000))
+
+
+def _get_async_loop() -> asyncio.AbstractEventLoop:
+    """Get (or start) the background event loop shared by async HTTP calls"""
+    global _async_loop
+    with _async_lock:
+        if _async_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="chatwoot-async", daemon=True).start()
+            _async_loop = loop
+    return _async_loop
+
+
+def _get_async_http() -> httpx.AsyncClient:
+    """Get the shared keep-alive AsyncClient (must be called from the event loop)"""
+    global _async_http
+    if _async_http is None:
+        _async_http = httpx.AsyncClient(
+            http2=True,
+            timeout=httpx.Timeout(SEND_MESSAGE_TIMEOUT, connect=3),
+            limits=httpx.Limits(max_keepalive_connections=50, max_connections=100)
+        )
+    return _async_http
+
+
+@dataclass
+class IncomingMessage:
+    """Validated message_created payload, ready for the background pipeline"""
+    conversation_id: int
+    conversation_status: Optional[str]
+    message_id: Optional[int]
+    content: str
+    attachments: List[Dict[str, Any]]
+    contact_id: str
+    extraction_method: str
+
+
+def _get_webhook_pool(app) -> ThreadPoolExecutor:
+    """Get (or create) the worker pool that runs queued webhook messages"""
+    global _webhook_pool
+    with _webhook_lock:
+        if _webhook_pool is None:
+            _webhook_pool = ThreadPoolExecutor(
+                max_workers=app.config.get('WEBHOOK_WORKERS', 32),
+                thread_name_prefix="chatwoot-webhook"
+            )
+    return _webhook_pool
+
+
+def process_incoming_message_task(app, message: IncomingMessage):
+    """Background task: run the reply pipeline for a prepared message inside an app context"""
+    with app.app_context():
+        chatwoot_service = ChatwootService()
+        try:
+            result = chatwoot_service.run_message_pipeline(
+                message, ConversationManager(), get_multiagent_system()
+            )
+            logger.info("📬 Queued message %s finished: %s", message.message_id, result.get('status'))
+        except Exception:
+            logger.exception("💥 Error procesando mensaje (ID: %s)", message.message_id)
+            # The webhook was already ACKed, so Chatwoot won't redeliver: tell the user instead
+            chatwoot_service.send_message(message.conversation_id, PIPELINE_ERROR_REPLY)
+
+
+def enqueue_incoming_message(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Validate and dedupe a message_created webhook, then queue the heavy work"""
+    chatwoot_service = ChatwootService()
+    if data.get('attachments'):
+        chatwoot_service.debug_webhook_data(data)
+
+    # Redeliveries are answered here via the dedup claim and never take a worker slot
+    message, skip_result = chatwoot_service.prepare_incoming_message(data)
+    if skip_result is not None:
+        return skip_result
+
+    app = current_app._get_current_object()
+    _get_webhook_pool(app).submit(process_incoming_message_task, app, message)
+    return {"status": "queued", "message_id": message.message_id,
+            "conversation_id": message.conversation_id}
+
+
+def _media_cache_key(url: str) -> str:
+    return f"media_ctx:{hashlib.sha256(url.encode()).hexdigest()}"
+
+
+def _plain_content_length(headers) -> int:
+    """Content-Length when the body is not content-encoded (so it is the final size), else 0"""
+    if headers.get('content-encoding', 'identity') != 'identity':
+        return 0
+    try:
+        return int(headers.get('content-length') or 0)
+    except ValueError:
+        return 0
+
+
+def _read_response_body(response) -> bytes:
+    """Read a streamed requests response, using one readinto() when the size is known"""
+    size = _plain_content_length(response.headers)
+    if not size:
+        return b"".join(response.iter_content(chunk_size=MEDIA_CHUNK_SIZE))
+
+    buf = bytearray(size)
+    view = memoryview(buf)
+    n = 0
+    while n < size:
+        read = response.raw.readinto(view[n:])
+        if not read:
+            break
+        n += read
+    return bytes(view[:n])
+
+
+async def _download_media_async(url: str, headers: Dict[str, str], timeout: float) -> Tuple[bytes, str]:
+    """Stream a media file through the shared AsyncClient; returns (body, content-type)"""
+    async with _get_async_http().stream("GET", url, headers=headers, timeout=timeout,
+                                        follow_redirects=True) as response:
+        response.raise_for_status()
+        content_type = response.headers.get('content-type', '').lower()
+        size = _plain_content_length(response.headers)
+        if size:
+            # Known length: fill a preallocated buffer instead of growing one
+            buf = bytearray(size)
+            view = memoryview(buf)
+            n = 0
+            overflow = bytearray()
+            async for chunk in response.aiter_raw(MEDIA_CHUNK_SIZE):
+                if overflow or n + len(chunk) > size:
+                    # Body longer than Content-Length claimed: keep the rest in a growable buffer
+                    overflow.extend(chunk)
+                    continue
+                view[n:n + len(chunk)] = chunk
+                n += len(chunk)
+            return bytes(view[:n]) + bytes(overflow), content_type
+
+        buf = bytearray()
+        async for chunk in response.aiter_bytes(MEDIA_CHUNK_SIZE):
+            buf.extend(chunk)
+        return bytes(buf), content_type
+
+
+def _first_key(d: Dict[str, Any], keys: Tuple[str, ...], default=None):
+    """Return the first truthy value among keys in d"""
+    for k in keys:
+        v = d.get(k)
+        if v:
+            return v
+    return default
+
+
+_ATTACHMENT_URL_KEYS = ("data_url", "url", "thumb_url")
+_EXT_TO_TYPE = {
+    **{ext: "image" for ext in SUPPORTED_IMAGE_TYPES},
+    **{ext: "audio" for ext in SUPPORTED_AUDIO_TYPES},
+}
+# Attachment types the media pipeline handles
+_MEDIA_TYPES = frozenset({"image", "audio"})
+
+
+def _type_from_file_type(attachment: Dict[str, Any]) -> Optional[str]:
+    """Attachment type from Chatwoot's file_type field"""
+    file_type = attachment.get("file_type")
+    return file_type.lower() if file_type else None
+
+
+def _type_from_extension(attachment: Dict[str, Any]) -> Optional[str]:
+    """Attachment type inferred from the file extension"""
+    return _EXT_TO_TYPE.get((attachment.get("extension") or "").lower().lstrip('.'))
+
+# Priority order for contact extraction: (method name, key path)
+_CONTACT_PATHS = (
+    ("conversation.contact_inbox.contact_id", ("conversation", "contact_inbox", "contact_id")),
+    ("conversation.meta.sender.id", ("conversation", "meta", "sender", "id")),
+    ("root.sender.id", ("sender", "id")),
+)
+
+
+def _walk(d: Any, path: Tuple[str, ...]):
+    """Resolve a nested key path, returning None on any missing/non-dict step"""
+    for p in path:
+        if not isinstance(d, dict):
+            return None
+        d = d.get(p)
+        if d is None:
+            return None
+    return d
+
+
+_CONTACT_ID_MATCH = re.compile(r"(?:\d+|contact_.*)", re.DOTALL).fullmatch
+
+
+def _valid_contact_id(value: Any) -> Optional[str]:
+    """Normalize a candidate contact id; None unless it is numeric or contact_-prefixed"""
+    if not value:
+        return None
+    contact_id = str(value).strip()
+    return contact_id if _CONTACT_ID_MATCH(contact_id) else None
+
+
+@dataclass
+class ConversationPrecheck:
+    """Result of the combined bot-status/dedup round-trip at webhook entry"""
+    is_active: bool
+    is_duplicate: bool
+    status_changed: bool
+
+
+def _bot_active_key(conversation_id) -> str:
+    return f"bot_active:{conversation_id}"
+
+
+def count_active_bots(redis_client) -> Tuple[int, int]:
+    """Return (tracked conversations, conversations with the bot active)"""
+    keys = redis_client.keys("bot_active:*")
+    if not keys:
+        return 0, 0
+    return len(keys), sum(1 for flag in redis_client.mget(keys) if flag == "1")
+
+
+@functools.lru_cache(maxsize=8)
+def _chatwoot_config(app) -> Tuple[str, str, str]:
+    """Chatwoot settings resolved once per Flask app"""
+    config = app.config
+    return config['CHATWOOT_API_KEY'], config['CHATWOOT_BASE_URL'], config['ACCOUNT_ID']
+
+
 class ChatwootService:
     """Service for handling Chatwoot interactions with integrated multimedia processing"""
 
     def __init__(self):
-        self.api_key = current_app.config['CHATWOOT_API_KEY']
-        self.base_url = current_app.config['CHATWOOT_BASE_URL']
-        self.account_id = current_app.config['ACCOUNT_ID']
+        self.api_key, self.base_url, self.account_id = _chatwoot_config(current_app._get_current_object())
+        self._base = self.base_url.rstrip('/') + '/'
+        self._send_url = f"{self._base}api/v1/accounts/{self.account_id}/conversations/%s/messages"
+        self._typing_url = f"{self._base}api/v1/accounts/{self.account_id}/conversations/%s/toggle_typing_status"
+        self._headers = {
+            "api_access_token": self.api_key,
+            "Content-Type": "application/json"
+        }
         self.redis_client = get_redis_client()
-        self.bot_active_statuses = ["open"]
-        self.bot_inactive_statuses = ["pending", "resolved", "snoozed"]
+        self.bot_active_statuses = frozenset(BOT_ACTIVE_STATUSES)
+        self.bot_inactive_statuses = frozenset(BOT_INACTIVE_STATUSES)
         
         # Initialize OpenAI service for multimedia processing
-        self.openai_service = OpenAIService()
+        self.openai_service = get_openai_service()
 
-    def send_message(self, conversation_id: int, message_content: str) -> bool:
-        """Send message to Chatwoot conversation"""
-        url = f"{self.base_url}/api/v1/accounts/{self.account_id}/conversations/{conversation_id}/messages"
+    async def send_message_async(self, conversation_id: int, message_content: Union[str, List[str]]) -> bool:
+        """Send message to Chatwoot conversation without blocking a worker thread"""
+        # Multi-part replies are coalesced into a single Chatwoot message
+        if isinstance(message_content, (list, tuple)):
+            message_content = "\n\n".join(part.strip() for part in message_content if part and part.strip())
 
-        headers = {
-            "api_access_token": self.api_key,
-            "Content-Type": "application/json"
-        }
+        if not message_content or not message_content.strip():
+            logger.debug("Skipping empty message for conversation %s", conversation_id)
+            return True
+
+        url = self._send_url % conversation_id
 
         payload = {
             "content": message_content,
@@ -45,112 +364,144 @@ class ChatwootService:
         }
 
         try:
-            response = requests.post(
-                url,
-                json=payload,
-                headers=headers,
-                timeout=30,
-                verify=True
-            )
+            response = await _get_async_http().post(url, content=orjson.dumps(payload), headers=self._headers)
 
-            logger.info(f"Chatwoot API Response Status: {response.status_code}")
+            logger.info("Chatwoot API Response Status: %s", response.status_code)
 
             if response.status_code == 200:
-                logger.info(f"✅ Message sent to conversation {conversation_id}")
+                logger.info("✅ Message sent to conversation %s", conversation_id)
                 return True
             else:
-                logger.error(f"❌ Failed to send message: {response.status_code} - {response.text}")
+                logger.error("❌ Failed to send message: %s - %s", response.status_code, response.text)
                 return False
 
         except Exception as e:
-            logger.error(f"❌ Error sending message to Chatwoot: {e}")
+            logger.error("❌ Error sending message to Chatwoot: %s", e)
             return False
 
-    def should_bot_respond(self, conversation_id: int, conversation_status: str) -> bool:
-        """Determine if bot should respond based on conversation status"""
-        self.update_bot_status(conversation_id, conversation_status)
-        is_active = conversation_status in self.bot_active_statuses
+    async def _retry_send_async(self, conversation_id: int, message_content: str):
+        """Retry a failed send with exponential backoff"""
+        for attempt in range(1, SEND_MESSAGE_MAX_RETRIES + 1):
+            delay = 2 ** attempt
+            logger.warning("🔁 Retrying send to conversation %s in %ss (attempt %d/%d)",
+                           conversation_id, delay, attempt, SEND_MESSAGE_MAX_RETRIES)
+            await asyncio.sleep(delay)
+            if await self.send_message_async(conversation_id, message_content):
+                logger.info("✅ Message sent to conversation %s after %d retries", conversation_id, attempt)
+                return
+
+        logger.error("❌ Failed to send response to conversation %s after %d retries",
+                     conversation_id, SEND_MESSAGE_MAX_RETRIES)
+
+    async def _toggle_typing_async(self, conversation_id, typing_on: bool):
+        """Best-effort typing indicator; failures are only logged"""
+        try:
+            await _get_async_http().post(
+                self._typing_url % conversation_id,
+                content=orjson.dumps({"typing_status": "on" if typing_on else "off"}),
+                headers=self._headers,
+                timeout=5
+            )
+        except Exception as e:
+            logger.debug("Typing indicator failed for conversation %s: %s", conversation_id, e)
+
+    def toggle_typing(self, conversation_id, typing_on: bool):
+        """Fire-and-forget typing indicator on the background loop"""
+        asyncio.run_coroutine_threadsafe(self._toggle_typing_async(conversation_id, typing_on), _get_async_loop())
+
+    def send_message(self, conversation_id: int, message_content: Union[str, List[str]]) -> bool:
+        """Send message to Chatwoot conversation (sync wrapper over send_message_async)"""
+        future = asyncio.run_coroutine_threadsafe(
+            self.send_message_async(conversation_id, message_content),
+            _get_async_loop()
+        )
+        try:
+            return future.result(timeout=SEND_MESSAGE_TIMEOUT + 5)
+        except Exception as e:
+            future.cancel()
+            logger.error("❌ Error sending message to Chatwoot: %s", e)
+            return False
 
+    def _log_bot_decision(self, conversation_id: int, conversation_status: str, is_active: bool):
         if is_active:
-            logger.info(f"✅ Bot WILL respond to conversation {conversation_id} (status: {conversation_status})")
+            logger.info("✅ Bot WILL respond to conversation %s (status: %s)", conversation_id, conversation_status)
+        elif conversation_status == "pending":
+            logger.info("⏸️ Bot will NOT respond to conversation %s (status: pending - INACTIVE)", conversation_id)
         else:
-            if conversation_status == "pending":
-                logger.info(f"⏸️ Bot will NOT respond to conversation {conversation_id} (status: pending - INACTIVE)")
-            else:
-                logger.info(f"🚫 Bot will NOT respond to conversation {conversation_id} (status: {conversation_status})")
-
-        return is_active
-
-    def update_bot_status(self, conversation_id: int, conversation_status: str):
-        """Update bot status for a specific conversation in Redis"""
+            logger.info("🚫 Bot will NOT respond to conversation %s (status: %s)", conversation_id, conversation_status)
+
+    def _queue_status_update(self, pipe, conversation_id: int, conversation_status: str, is_active: bool):
+        """Queue the conditional bot-active write; its pipeline result is the previous flag"""
+        # Plain EVAL: redis-py adds a SCRIPT EXISTS round-trip to pipelines holding Script objects,
+        # while Redis still caches the compiled script by SHA
+        pipe.eval(_BOT_STATUS_LUA, 1, _bot_active_key(conversation_id),
+                  "1" if is_active else "0", BOT_STATUS_REFRESH_BELOW, BOT_STATUS_TTL)
+
+    def _log_status_transition(self, conversation_id: int, conversation_status: str,
+                               is_active: bool, old_flag: Optional[str]) -> bool:
+        status_changed = old_flag != ("1" if is_active else "0")
+        if status_changed:
+            status_text = "ACTIVO" if is_active else "INACTIVO"
+            logger.info("🔄 Conversation %s: Bot %s (status: %s)", conversation_id, status_text, conversation_status)
+        return status_changed
+
+    def _precheck_conversation(self, conversation_id: int, conversation_status: str,
+                               message_id: Optional[int]) -> ConversationPrecheck:
+        """Update bot status and claim the message for processing in a single Redis round-trip"""
         is_active = conversation_status in self.bot_active_statuses
-
-        status_key = f"bot_status:{conversation_id}"
-        status_data = {
-            'active': str(is_active),
-            'status': conversation_status,
-            'updated_at': str(time.time())
-        }
+        # Inactive conversations never reach processing, so only claim the message when active
+        claim_message = is_active and bool(message_id)
 
         try:
-            old_status = self.redis_client.hget(status_key, 'active')
-            self.redis_client.hset(status_key, mapping=status_data)
-            self.redis_client.expire(status_key, 86400)  # 24 hours TTL
+            # No per-process status cache: other workers may have changed the flag. An unchanged
+            # status is a server-side no-op in _BOT_STATUS_LUA.
+            pipe = self.redis_client.pipeline(transaction=False)
+            self._queue_status_update(pipe, conversation_id, conversation_status, is_active)
+            if claim_message:
+                _queue_message_claim(pipe, conversation_id, message_id)
+            results = pipe.execute()
+        except Exception as e:
+            logger.error("Error in conversation precheck: %s", e)
+            self._log_bot_decision(conversation_id, conversation_status, is_active)
+            return ConversationPrecheck(is_active=is_active, is_duplicate=False, status_changed=False)
 
-            if old_status != str(is_active):
-                status_text = "ACTIVO" if is_active else "INACTIVO"
-                logger.info(f"🔄 Conversation {conversation_id}: Bot {status_text} (status: {conversation_status})")
+        status_changed = self._log_status_transition(conversation_id, conversation_status, is_active, results[0])
+        self._log_bot_decision(conversation_id, conversation_status, is_active)
 
-        except Exception as e:
-            logger.error(f"Error updating bot status in Redis: {e}")
+        is_duplicate = claim_message and not _claim_was_new(results[1:])
+        if is_duplicate:
+            logger.info("🔄 Message %s already processed, skipping", message_id)
 
-    def is_message_already_processed(self, message_id: int, conversation_id: int) -> bool:
-        """Check if message has already been processed"""
-        if not message_id:
-            return False
+        return ConversationPrecheck(is_active=is_active, is_duplicate=is_duplicate,
+                                    status_changed=status_changed)
 
-        key = f"processed_message:{conversation_id}:{message_id}"
+    def update_bot_status(self, conversation_id: int, conversation_status: str):
+        """Update bot status for a specific conversation in Redis"""
+        # Always reach Redis: a status cached in this process can be stale after another worker's
+        # write, and _BOT_STATUS_LUA already makes an unchanged status a server-side no-op
+        is_active = conversation_status in self.bot_active_statuses
 
         try:
-            if self.redis_client.exists(key):
-                logger.info(f"🔄 Message {message_id} already processed, skipping")
-                return True
-
-            self.redis_client.set(key, "1", ex=3600)  # 1 hour TTL
-            logger.info(f"✅ Message {message_id} marked as processed")
-            return False
+            pipe = self.redis_client.pipeline(transaction=False)
+            self._queue_status_update(pipe, conversation_id, conversation_status, is_active)
+            old_flag, = pipe.execute()
+            self._log_status_transition(conversation_id, conversation_status, is_active, old_flag)
 
         except Exception as e:
-            logger.error(f"Error checking processed message: {e}")
-            return False
+            logger.error("Error updating bot status in Redis: %s", e)
 
     def extract_contact_id(self, data: Dict[str, Any]) -> Tuple[Optional[str], str, bool]:
         """Extract contact_id with unified priority system and validation"""
-        conversation_data = data.get("conversation", {})
-
-        # Priority order for contact extraction
-        extraction_methods = [
-            ("conversation.contact_inbox.contact_id",
-             lambda: conversation_data.get("contact_inbox", {}).get("contact_id")),
-            ("conversation.meta.sender.id",
-             lambda: conversation_data.get("meta", {}).get("sender", {}).get("id")),
-            ("root.sender.id",
-             lambda: data.get("sender", {}).get("id") if data.get("sender", {}).get("type") != "agent" else None)
-        ]
-
-        for method_name, extractor in extraction_methods:
-            try:
-                contact_id = extractor()
-                if contact_id and str(contact_id).strip():
-                    # Validate contact_id format
-                    contact_id = str(contact_id).strip()
-                    if contact_id.isdigit() or contact_id.startswith("contact_"):
-                        logger.info(f"✅ Contact ID extracted: {contact_id} (method: {method_name})")
-                        return contact_id, method_name, True
-            except Exception as e:
-                logger.warning(f"Error in extraction method {method_name}: {e}")
+        for method_name, path in _CONTACT_PATHS:
+            # Root sender only counts when it is not an agent
+            if path[0] == "sender" and _walk(data, ("sender", "type")) == "agent":
                 continue
 
+            contact_id = _valid_contact_id(_walk(data, path))
+            if contact_id:
+                logger.info("✅ Contact ID extracted: %s (method: %s)", contact_id, method_name)
+                return contact_id, method_name, True
+
         logger.error("❌ No valid contact_id found in webhook data")
         return None, "none", False
 
@@ -164,15 +515,15 @@ class ChatwootService:
 
             conversation_status = data.get("status")
             if not conversation_status:
-                logger.warning(f"⚠️ No status found in conversation_updated for {conversation_id}")
+                logger.warning("⚠️ No status found in conversation_updated for %s", conversation_id)
                 return False
 
-            logger.info(f"📋 Conversation {conversation_id} updated to status: {conversation_status}")
+            logger.info("📋 Conversation %s updated to status: %s", conversation_id, conversation_status)
             self.update_bot_status(conversation_id, conversation_status)
             return True
 
         except Exception as e:
-            logger.error(f"Error handling conversation_updated: {e}")
+            logger.error("Error handling conversation_updated: %s", e)
             return False
 
     # INTEGRATED MULTIMEDIA PROCESSING METHODS
@@ -180,124 +531,86 @@ class ChatwootService:
     def transcribe_audio_from_url(self, audio_url: str) -> str:
         """Transcribe audio from URL with robust error handling (EXACTLY like monolith)"""
         try:
-            logger.info(f"🔽 Downloading audio from: {audio_url}")
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (compatible; ChatbotAudioTranscriber/1.0)',
-                'Accept': 'audio/*,*/*;q=0.9'
-            }
-            
-            response = requests.get(audio_url, headers=headers, timeout=60, stream=True)
+            logger.info("🔽 Downloading audio from: %s", audio_url)
+            response = _http_session.get(audio_url, headers=_AUDIO_DOWNLOAD_HEADERS, timeout=60, stream=True)
             response.raise_for_status()
             
-            # Verify content-type if available
             content_type = response.headers.get('content-type', '').lower()
-            logger.info(f"📄 Audio content-type: {content_type}")
+            logger.info("📄 Audio content-type: %s", content_type)
             
-            # Determine extension based on content-type or URL
-            extension = '.ogg'  # Default for Chatwoot
-            if 'mp3' in content_type or audio_url.endswith('.mp3'):
-                extension = '.mp3'
-            elif 'wav' in content_type or audio_url.endswith('.wav'):
-                extension = '.wav'
-            elif 'm4a' in content_type or audio_url.endswith('.m4a'):
-                extension = '.m4a'
-            
-            # Create temporary file with correct extension
-            with tempfile.NamedTemporaryFile(delete=False, suffix=extension) as temp_file:
-                for chunk in response.iter_content(chunk_size=8192):
-                    temp_file.write(chunk)
-                temp_path = temp_file.name
-            
-            logger.info(f"📁 Audio saved to temp file: {temp_path} (size: {os.path.getsize(temp_path)} bytes)")
-            
-            try:
-                result = self.openai_service.transcribe_audio(temp_path)
-                logger.info(f"🎵 Transcription successful: {len(result)} characters")
-                return result
-                
-            finally:
-                # Clean up temporary file
-                try:
-                    os.unlink(temp_path)
-                    logger.info(f"🗑️ Temporary file deleted: {temp_path}")
-                except Exception as cleanup_error:
-                    logger.warning(f"⚠️ Could not delete temp file {temp_path}: {cleanup_error}")
+            return self._transcribe_audio_bytes(
+                _read_response_body(response), audio_upload_extension(content_type, audio_url)
+            )
             
         except requests.exceptions.RequestException as e:
-            logger.error(f"❌ Error downloading audio: {e}")
+            logger.error("❌ Error downloading audio: %s", e)
             raise Exception(f"Error downloading audio: {str(e)}")
         except Exception as e:
-            logger.error(f"❌ Error in audio transcription from URL: {e}")
+            logger.error("❌ Error in audio transcription from URL: %s", e)
             raise
 
+    def _transcribe_audio_bytes(self, data: bytes, extension: str) -> str:
+        """Transcribe downloaded audio straight from memory"""
+        buf = BytesIO(data)
+        # Whisper infers the format from the upload filename
+        buf.name = f"audio{extension}"
+        
+        logger.info("📁 Audio buffered in memory (size: %s bytes)", len(data))
+        
+        result = self.openai_service.transcribe_audio(buf)
+        logger.info("🎵 Transcription successful: %s characters", len(result))
+        return result
+
     def analyze_image_from_url(self, image_url: str) -> str:
         """Analyze image from URL using GPT-4 Vision (EXACTLY like monolith)"""
         try:
-            logger.info(f"🔽 Downloading image from: {image_url}")
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (compatible; ChatbotImageAnalyzer/1.0)'
-            }
-            response = requests.get(image_url, headers=headers, timeout=30)
+            logger.info("🔽 Downloading image from: %s", image_url)
+            response = _http_session.get(image_url, headers=_IMAGE_DOWNLOAD_HEADERS, timeout=30)
             response.raise_for_status()
             
-            # Verify it's an image
-            content_type = response.headers.get('content-type', '').lower()
-            if not any(img_type in content_type for img_type in ['image/', 'jpeg', 'png', 'gif', 'webp']):
-                logger.warning(f"⚠️ Content type might not be image: {content_type}")
-            
-            # Create file in memory
-            image_file = BytesIO(response.content)
-            
-            # Analyze using OpenAI service
-            return self.openai_service.analyze_image(image_file)
+            return self._analyze_image_bytes(response.content, response.headers.get('content-type', '').lower())
             
         except requests.exceptions.RequestException as e:
-            logger.error(f"❌ Error downloading image: {e}")
+            logger.error("❌ Error downloading image: %s", e)
             raise Exception(f"Error downloading image: {str(e)}")
         except Exception as e:
-            logger.error(f"❌ Error in image analysis from URL: {e}")
+            logger.error("❌ Error in image analysis from URL: %s", e)
             raise
 
-    def process_attachment(self, attachment: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    def _analyze_image_bytes(self, image_data: bytes, content_type: str) -> str:
+        """Analyze downloaded image bytes with the OpenAI service"""
+        # Verify it's an image
+        if not any(img_type in content_type for img_type in ['image/', 'jpeg', 'png', 'gif', 'webp']):
+            logger.warning("⚠️ Content type might not be image: %s", content_type)
+        
+        return self.openai_service.analyze_image(image_data)
+
+    def process_attachment(self, attachment: Dict[str, Any], media_only: bool = False) -> Optional[Dict[str, Any]]:
         """Process Chatwoot attachment with complete parity to monolith"""
         try:
-            logger.info(f"Processing Chatwoot attachment: {attachment}")
+            logger.debug("Processing Chatwoot attachment: %r", attachment)
     
-            # Extract type with multiple methods (EXACTLY like monolith)
-            attachment_type = None
+            # file_type is what Chatwoot usually sends; fall back to the extension
+            attachment_type = _type_from_file_type(attachment) or _type_from_extension(attachment)
+            logger.debug("Attachment type resolved: %s", attachment_type)
     
-            # Method 1: file_type (most common in Chatwoot)
-            if attachment.get("file_type"):
-                attachment_type = attachment["file_type"].lower()
-                logger.info(f"Type from 'file_type': {attachment_type}")
-    
-            # Method 2: extension (MISSING in original modular - NOW ADDED)
-            elif attachment.get("extension"):
-                ext = attachment["extension"].lower().lstrip('.')
-                if ext in ['jpg', 'jpeg', 'png', 'gif', 'webp']:
-                    attachment_type = "image"
-                elif ext in ['mp3', 'wav', 'ogg', 'm4a', 'aac']:
-                    attachment_type = "audio"
-                logger.info(f"Type inferred from extension '{ext}': {attachment_type}")
+            if media_only and attachment_type not in _MEDIA_TYPES:
+                logger.info("⏭️ Skipping attachment type: %s", attachment_type)
+                return None
     
             # Extract URL with correct priority (EXACTLY like monolith)
-            url = attachment.get("data_url") or attachment.get("url") or attachment.get("thumb_url")
+            url = _first_key(attachment, _ATTACHMENT_URL_KEYS)
     
             if not url:
-                logger.warning(f"No URL found in attachment")
+                logger.warning("No URL found in attachment")
                 return None
     
-            # FIXED: Construct full URL if necessary (MISSING in original modular)
-            if not url.startswith("http"):
-                # Remove initial slash to avoid double slash
-                if url.startswith("/"):
-                    url = url[1:]
-                url = f"{self.base_url}/{url}"  # self.base_url is CHATWOOT_BASE_URL
-                logger.info(f"Full URL constructed: {url}")
+            # Relative paths resolve against the Chatwoot base; absolute URLs pass through unchanged
+            url = urljoin(self._base, url.lstrip('/'))
     
             # Validate that URL is accessible
-            if not url.startswith("http"):
-                logger.warning(f"Invalid URL format: {url}")
+            if not url.startswith(("http://", "https://")):
+                logger.warning("Invalid URL format: %s", url)
                 return None
     
             return {
@@ -310,142 +623,237 @@ class ChatwootService:
             }
     
         except Exception as e:
-            logger.error(f"Error processing Chatwoot attachment: {e}")
+            logger.error("Error processing Chatwoot attachment: %s", e)
             return None
 
-    def debug_webhook_data(self, data: Dict[str, Any]):
-        """Complete debugging function exactly like monolith"""
-        logger.info("🔍 === WEBHOOK DEBUG INFO ===")
-        logger.info(f"Event: {data.get('event')}")
-        logger.info(f"Message ID: {data.get('id')}")
-        logger.info(f"Message Type: {data.get('message_type')}")
-        logger.info(f"Content: '{data.get('content')}'")
-        logger.info(f"Content Length: {len(data.get('content', ''))}")
-
-        attachments = data.get('attachments', [])
-        logger.info(f"Attachments Count: {len(attachments)}")
+    def _iter_media_attachments(self, attachments: List[Dict[str, Any]]):
+        """Lazily yield processed image/audio attachments, skipping everything else"""
+        for attachment in attachments:
+            try:
+                logger.debug("🔍 Processing attachment: %r", attachment)
+                processed = self.process_attachment(attachment, media_only=True)
+            except Exception as e:
+                logger.error("❌ Error processing attachment %s: %s", attachment, e)
+                continue
+            if processed and processed["url"]:
+                yield processed
+
+    async def _process_media_async(self, media_type: str, url: str) -> str:
+        """Download media and run the OpenAI call on the event loop (AsyncOpenAI)"""
+        if media_type == "audio":
+            logger.info("🎵 Transcribing audio: %s", url)
+            data, content_type = await _download_media_async(url, _AUDIO_DOWNLOAD_HEADERS, 60)
+            logger.info("📄 Audio content-type: %s", content_type)
+            buf = BytesIO(data)
+            # Whisper infers the format from the upload filename
+            buf.name = f"audio{audio_upload_extension(content_type, url)}"
+            result = await self.openai_service.atranscribe_audio(buf)
+            logger.info("🎵 Audio transcribed: %s...", result[:100])
+            return result
+
+        logger.info("🖼️ Analyzing image: %s", url)
+        data, content_type = await _download_media_async(url, _IMAGE_DOWNLOAD_HEADERS, 30)
+        if not any(img_type in content_type for img_type in ['image/', 'jpeg', 'png', 'gif', 'webp']):
+            logger.warning("⚠️ Content type might not be image: %s", content_type)
+        result = await self.openai_service.aanalyze_image(data)
+        logger.info("🖼️ Image analyzed: %s...", result[:100])
+        return result
+
+    async def _process_media_batch_async(self, media_jobs: List[Tuple[str, str]]) -> List[Any]:
+        """Process media attachments concurrently; returns a result or exception per job"""
+        tasks = [
+            asyncio.wait_for(
+                self._process_media_async(media_type, url),
+                timeout=MEDIA_PROCESSING_TIMEOUT
+            )
+            for media_type, url in media_jobs
+        ]
+        return await asyncio.gather(*tasks, return_exceptions=True)
 
-        for i, att in enumerate(attachments):
-            logger.info(f"  Attachment {i}:")
-            logger.info(f"    Keys: {list(att.keys())}")
-            logger.info(f"    Type: {att.get('type')}")
-            logger.info(f"    File Type: {att.get('file_type')}")
-            logger.info(f"    URL: {att.get('url')}")
-            logger.info(f"    Data URL: {att.get('data_url')}")
-            logger.info(f"    Thumb URL: {att.get('thumb_url')}")
-
-        logger.info("🔍 === END DEBUG INFO ===")
-
-    def process_incoming_message(self, data: Dict[str, Any],
-                                 conversation_manager: ConversationManager,
-                                 multiagent: MultiAgentSystem) -> Dict[str, Any]:
-        """Process incoming message with comprehensive validation and error handling"""
+    def _process_media_jobs(self, media_jobs: List[Tuple[str, str]]) -> str:
+        """Resolve media context from the Redis cache, processing only the misses"""
+        cache_keys = [_media_cache_key(url) for _, url in media_jobs]
         try:
-            # Validate message type
-            message_type = data.get("message_type")
-            if message_type != "incoming":
-                logger.info(f"🤖 Ignoring message type: {message_type}")
-                return {"status": "non_incoming_message", "ignored": True}
-
-            # Extract and validate conversation data
-            conversation_data = data.get("conversation", {})
-            if not conversation_data:
-                raise ValueError("Missing conversation data")
-
-            conversation_id = conversation_data.get("id")
-            conversation_status = conversation_data.get("status")
-
-            if not conversation_id:
-                raise ValueError("Missing conversation ID")
+            results = self.redis_client.mget(cache_keys)
+        except Exception as e:
+            logger.warning("Media cache lookup failed: %s", e)
+            results = [None] * len(media_jobs)
 
-            # Validate conversation_id format
-            if not str(conversation_id).strip() or not str(conversation_id).isdigit():
-                raise ValueError("Invalid conversation ID format")
+        misses = [i for i, cached in enumerate(results) if cached is None]
+        if len(misses) < len(media_jobs):
+            logger.info("🗃️ Media cache hits: %d/%d", len(media_jobs) - len(misses), len(media_jobs))
 
-            # Check if bot should respond
-            if not self.should_bot_respond(conversation_id, conversation_status):
-                return {
-                    "status": "bot_inactive",
-                    "message": f"Bot is inactive for status: {conversation_status}",
-                    "active_only_for": self.bot_active_statuses
-                }
+        if misses:
+            fresh = self._run_async(
+                self._process_media_batch_async([media_jobs[i] for i in misses]),
+                timeout=MEDIA_PROCESSING_TIMEOUT + 5
+            )
+            pipe = self.redis_client.pipeline(transaction=False)
+            for i, result in zip(misses, fresh):
+                results[i] = result
+                if not isinstance(result, BaseException):
+                    pipe.set(cache_keys[i], result, ex=MEDIA_CACHE_TTL)
+            try:
+                pipe.execute()
+            except Exception as e:
+                logger.warning("Media cache write failed: %s", e)
+
+        successes = []
+        failures = []
+        for (media_type, _), result in zip(media_jobs, results):
+            label = "transcription" if media_type == "audio" else "analysis"
+            if isinstance(result, asyncio.TimeoutError):
+                logger.error("❌ %s %s timed out after %ss", media_type, label, MEDIA_PROCESSING_TIMEOUT)
+                failures.append(f"[{media_type.capitalize()} file - {label} timed out]")
+            elif isinstance(result, BaseException):
+                logger.error("❌ %s %s failed: %s", media_type, label, result)
+                failures.append(f"[{media_type.capitalize()} file - {label} failed: {result}]")
+            else:
+                successes.append(result)
 
-            # Extract and validate message content
-            content = data.get("content", "").strip()
-            message_id = data.get("id")
+        # Failure placeholders only matter when nothing could be processed
+        return "\n\n".join(successes or failures)
 
-            # MEJORADO: Extraer attachments con debugging
-            attachments = data.get("attachments", [])
-            logger.info(f"📎 Attachments received: {len(attachments)}")
-            for i, att in enumerate(attachments):
-                logger.info(f"📎 Attachment {i}: {att}")
+    @staticmethod
+    def _run_async(coro, timeout: float):
+        """Run a coroutine on the shared background loop and wait for its result"""
+        return asyncio.run_coroutine_threadsafe(coro, _get_async_loop()).result(timeout=timeout)
 
-            # Check for duplicate processing
-            if message_id and self.is_message_already_processed(message_id, conversation_id):
-                return {"status": "already_processed", "ignored": True}
+    def debug_webhook_data(self, data: Dict[str, Any]):
+        """Complete debugging function exactly like monolith (only emitted at DEBUG level)"""
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
 
-            # Extract contact information with improved validation
-            contact_id, extraction_method, is_valid = self.extract_contact_id(data)
-            if not is_valid or not contact_id:
-                raise ValueError("Could not extract valid contact_id from webhook data")
+        attachments = data.get('attachments', [])
+        lines = [
+            "🔍 === WEBHOOK DEBUG INFO ===",
+            f"Event: {data.get('event')}",
+            f"Message ID: {data.get('id')}",
+            f"Message Type: {data.get('message_type')}",
+            f"Content: '{data.get('content')}'",
+            f"Content Length: {len(data.get('content') or '')}",
+            f"Attachments Count: {len(attachments)}",
+        ]
+        for i, att in enumerate(attachments):
+            lines += [
+                f"  Attachment {i}:",
+                f"    Keys: {list(att)}",
+                f"    Type: {att.get('type')}",
+                f"    File Type: {att.get('file_type')}",
+                f"    URL: {att.get('url')}",
+                f"    Data URL: {att.get('data_url')}",
+                f"    Thumb URL: {att.get('thumb_url')}",
+            ]
+        lines.append("🔍 === END DEBUG INFO ===")
+
+        # One handler write for the whole dump
+        logger.debug("\n".join(lines))
+
+    def prepare_incoming_message(self, data: Dict[str, Any]) -> Tuple[Optional[IncomingMessage], Optional[Dict[str, Any]]]:
+        """Validate, dedupe and extract the contact; returns (message, None) or (None, skip result)"""
+        # Validate message type
+        message_type = data.get("message_type")
+        if message_type != "incoming":
+            logger.info("🤖 Ignoring message type: %s", message_type)
+            return None, _NON_INCOMING_RESULT
+
+        # Nothing to answer: skip before any Redis/contact work
+        content = (data.get("content") or "").strip()
+        attachments = data.get("attachments") or []
+        if not content and not attachments:
+            logger.info("⏭️ Ignoring empty message %s", data.get("id"))
+            return None, _EMPTY_MESSAGE_RESULT
+
+        # Extract and validate conversation data
+        conversation_data = data.get("conversation")
+        if not conversation_data or not isinstance(conversation_data, dict):
+            raise ValueError("Missing conversation data")
+
+        conversation_id = conversation_data.get("id")
+        conversation_status = conversation_data.get("status")
+
+        if not conversation_id:
+            raise ValueError("Missing conversation ID")
+
+        # Validate conversation_id once; Chatwoot sends it as an int. Only exact ints or digit
+        # strings pass: int() would turn True into 1 and truncate 12.9 to 12
+        if isinstance(conversation_id, str) and conversation_id.isascii() and conversation_id.isdigit():
+            conversation_id = int(conversation_id)
+        if type(conversation_id) is not int or conversation_id <= 0:
+            raise ValueError("Invalid conversation ID format")
+
+        message_id = data.get("id")
+
+        # Bot status update + duplicate check in one Redis round-trip
+        precheck = self._precheck_conversation(conversation_id, conversation_status, message_id)
+        if not precheck.is_active:
+            return None, {
+                "status": "bot_inactive",
+                "message": f"Bot is inactive for status: {conversation_status}",
+                "active_only_for": _ACTIVE_ONLY_FOR
+            }
 
-            # Generate standardized user_id
-            user_id = conversation_manager._create_user_id(contact_id)
+        # MEJORADO: Extraer attachments con debugging
+        logger.info("📎 Attachments received: %s", len(attachments))
+        if attachments and logger.isEnabledFor(logging.DEBUG):
+            logger.debug("\n".join(f"📎 Attachment {i}: {att!r}" for i, att in enumerate(attachments)))
+
+        if precheck.is_duplicate:
+            return None, _ALREADY_PROCESSED_RESULT
+
+        # Extract contact information with improved validation
+        contact_id, extraction_method, is_valid = self.extract_contact_id(data)
+        if not is_valid or not contact_id:
+            raise ValueError("Could not extract valid contact_id from webhook data")
+
+        return IncomingMessage(
+            conversation_id=conversation_id,
+            conversation_status=conversation_status,
+            message_id=message_id,
+            content=content,
+            attachments=attachments,
+            contact_id=contact_id,
+            extraction_method=extraction_method
+        ), None
+
+    def run_message_pipeline(self, message: IncomingMessage,
+                             conversation_manager: ConversationManager,
+                             multiagent: MultiAgentSystem) -> Dict[str, Any]:
+        """Media processing, multi-agent reply and Chatwoot send for a prepared message"""
+        conversation_id = message.conversation_id
+        conversation_status = message.conversation_status
+        message_id = message.message_id
+        content = message.content
+        attachments = message.attachments
+        contact_id = message.contact_id
+        extraction_method = message.extraction_method
+
+        # Generate standardized user_id
+        user_id = conversation_manager._create_user_id(contact_id)
+
+        # Typing indicator overlaps with media downloads and the LLM call
+        self.toggle_typing(conversation_id, True)
 
-            logger.info(f"🔄 Processing message from conversation {conversation_id}")
-            logger.info(f"👤 User: {user_id} (contact: {contact_id}, method: {extraction_method})")
-            logger.info(f"💬 Message: {content[:100]}...")
+        try:
+            logger.info("🔄 Processing message from conversation %s", conversation_id)
+            logger.info("👤 User: %s (contact: %s, method: %s)", user_id, contact_id, extraction_method)
+            logger.info("💬 Message: %s...", content[:100])
 
-            # ENHANCED: Process multimedia attachments using integrated methods
+            # ENHANCED: Process multimedia attachments concurrently using integrated methods
             media_context = None
             media_type = "text"
             processed_attachment = None
+            media_jobs = []
 
-            for attachment in attachments:
-                try:
-                    logger.info(f"🔍 Processing attachment: {attachment}")
-                    processed_attachment = self.process_attachment(attachment)
-                    
-                    if not processed_attachment:
-                        continue
-                    
-                    attachment_type = processed_attachment.get("type")
-                    url = processed_attachment.get("url")
-                    
-                    if not attachment_type or not url:
-                        continue
-
-                    # Process according to type using integrated methods
-                    if attachment_type in ["image", "audio"]:
-                        media_type = attachment_type
-                        
-                        logger.info(f"🎯 Processing {media_type}: {url}")
-
-                        if media_type == "audio":
-                            try:
-                                logger.info(f"🎵 Transcribing audio: {url}")
-                                media_context = self.transcribe_audio_from_url(url)
-                                logger.info(f"🎵 Audio transcribed: {media_context[:100]}...")
-                            except Exception as audio_error:
-                                logger.error(f"❌ Audio transcription failed: {audio_error}")
-                                media_context = f"[Audio file - transcription failed: {str(audio_error)}]"
-
-                        elif media_type == "image":
-                            try:
-                                logger.info(f"🖼️ Analyzing image: {url}")
-                                media_context = self.analyze_image_from_url(url)
-                                logger.info(f"🖼️ Image analyzed: {media_context[:100]}...")
-                            except Exception as image_error:
-                                logger.error(f"❌ Image analysis failed: {image_error}")
-                                media_context = f"[Image file - analysis failed: {str(image_error)}]"
-
-                        break  # Process only the first valid attachment
-                    else:
-                        logger.info(f"⏭️ Skipping attachment type: {attachment_type}")
-
-                except Exception as e:
-                    logger.error(f"❌ Error processing attachment {attachment}: {e}")
-                    continue
+            for processed in self._iter_media_attachments(attachments):
+                if processed_attachment is None:
+                    processed_attachment = processed
+                    media_type = processed["type"]
+                logger.info("🎯 Processing %s: %s", processed["type"], processed["url"])
+                media_jobs.append((processed["type"], processed["url"]))
+
+            if media_jobs:
+                media_context = self._process_media_jobs(media_jobs)
 
             # ENHANCED: Validate processable content
             if not content and not media_context:
@@ -457,12 +865,12 @@ class ChatwootService:
                     "media_type": media_type,
                     "processed_attachment": processed_attachment
                 }
-                logger.error(f"Debug info: {debug_info}")
+                logger.error("Debug info: %s", debug_info)
 
                 return {
                     "status": "success",
                     "message": "Empty message handled",
-                    "conversation_id": str(conversation_id),
+                    "conversation_id": conversation_id,
                     "debug_info": debug_info,
                     "assistant_reply": "Por favor, envía un mensaje con contenido para poder ayudarte. 😊"
                 }
@@ -470,10 +878,10 @@ class ChatwootService:
             # If only multimedia content without text, use analysis as message
             if not content and media_context:
                 content = media_context
-                logger.info(f"📝 Using media context as primary content: {media_context[:100]}...")
+                logger.info("📝 Using media context as primary content: %s...", media_context[:100])
 
             # Generate response with multimedia context
-            logger.info(f"🤖 Generating response with media_type: {media_type}")
+            logger.info("🤖 Generating response with media_type: %s", media_type)
             assistant_reply, agent_used = multiagent.get_response(
                 question=content,
                 user_id=user_id,
@@ -485,20 +893,23 @@ class ChatwootService:
             if not assistant_reply or not assistant_reply.strip():
                 assistant_reply = "Disculpa, no pude procesar tu mensaje. ¿Podrías intentar de nuevo? 😊"
 
-            logger.info(f"🤖 Assistant response: {assistant_reply[:100]}...")
-
-            # Send response to Chatwoot
-            success = self.send_message(conversation_id, assistant_reply)
+            logger.info("🤖 Assistant response: %s...", assistant_reply[:100])
 
-            if not success:
-                raise ValueError("Failed to send response to Chatwoot")
-
-            logger.info(f"✅ Successfully processed message for conversation {conversation_id}")
+            # Send response to Chatwoot; retries back off on the async loop, not in this worker
+            if self.send_message(conversation_id, assistant_reply):
+                logger.info("✅ Successfully processed message for conversation %s", conversation_id)
+                status, status_message = "success", "Response sent successfully"
+            else:
+                asyncio.run_coroutine_threadsafe(
+                    self._retry_send_async(conversation_id, assistant_reply),
+                    _get_async_loop()
+                )
+                status, status_message = "send_retrying", "Send failed, retrying in background"
 
             return {
-                "status": "success",
-                "message": "Response sent successfully",
-                "conversation_id": str(conversation_id),
+                "status": status,
+                "message": status_message,
+                "conversation_id": conversation_id,
                 "user_id": user_id,
                 "contact_id": contact_id,
                 "contact_extraction_method": extraction_method,
@@ -512,7 +923,6 @@ class ChatwootService:
                 "media_context_length": len(media_context) if media_context else 0,
                 "processed_attachment": processed_attachment
             }
-
-        except Exception as e:
-            logger.exception(f"💥 Error procesando mensaje (ID: {data.get('id', 'unknown')})")
-            raise
+        finally:
+            # Every exit (empty message, send failure, media/LLM errors) clears the indicator
+            self.toggle_typing(conversation_id, False)
@@ -1,109 +1,325 @@
-from app.services.openai_service import OpenAIService
-from app.services.vectorstore_service import VectorstoreService
+from app.services.openai_service import get_openai_service
+from app.services.vectorstore_service import VectorstoreService, get_index_generation
 from app.models.conversation import ConversationManager
 from app.config import Config
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.schema.runnable import RunnableLambda
+from langchain.schema.runnable import RunnableLambda, RunnablePassthrough
 from langchain.schema import BaseMessage, HumanMessage, AIMessage
 from langchain.schema.output_parser import StrOutputParser
 from flask import current_app
 import logging
-import json
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
+import re
 import time
+import hashlib
+import threading
+import atexit
+from concurrent.futures import Future, ThreadPoolExecutor
+from cachetools import TTLCache
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Tuple, Optional
+from operator import itemgetter
+from typing import List, Dict, Any, Tuple, Optional, Iterator
 
 logger = logging.getLogger(__name__)
 
-class MultiAgentSystem:
-    """Sistema multi-agente modularizado"""
-    
-    def __init__(self):
-        self.openai_service = OpenAIService()
-        self.vectorstore_service = VectorstoreService()
-        self.chat_model = self.openai_service.get_chat_model()
-        self.retriever = self.vectorstore_service.get_retriever()
-        self.conversation_manager = None  # Se inyecta cuando se usa
-        
-        # Configuración
-        self.voice_enabled = current_app.config.get('VOICE_ENABLED', False)
-        self.image_enabled = current_app.config.get('IMAGE_ENABLED', False)
-        self.schedule_service_url = current_app.config.get('SCHEDULE_SERVICE_URL', 'http://127.0.0.1:4040')
-        self.is_local_development = current_app.config.get('ENVIRONMENT') == 'local'
-        self.selenium_timeout = 30 if self.is_local_development else 60
-        
-        # Cache del estado de Selenium
-        self.selenium_service_available = False
-        self.selenium_status_last_check = 0
-        self.selenium_status_cache_duration = 30
-        
-        # Inicializar agentes
-        self.agents = self._initialize_agents()
-        
-        # Verificar servicio Selenium
-        self._initialize_local_selenium_connection()
+# Keep-alive session for the Selenium schedule microservice (shared across instances)
+_schedule_session = requests.Session()
+_schedule_adapter = HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    max_retries=Retry(total=2, backoff_factor=0.2)
+)
+_schedule_session.mount('http://', _schedule_adapter)
+_schedule_session.mount('https://', _schedule_adapter)
+
+# Best-effort side-channel POSTs (appointment notifications) never hold up the user's reply
+_notify_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="apt-notify")
+atexit.register(_notify_pool.shutdown, wait=True)
+
+# Lookups that overlap with a blocking microservice call on the request thread
+_lookup_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="apt-lookup")
+atexit.register(_lookup_pool.shutdown, wait=False)
+
+# Slots per date from /check-availability; bookings evict so users never see a slot they just took
+_availability_cache = TTLCache(maxsize=256, ttl=90)
+_availability_cache_lock = threading.Lock()
+
+
+def _cached_availability(date: str) -> Optional[Dict[str, Any]]:
+    with _availability_cache_lock:
+        return _availability_cache.get(date)
+
+
+def _store_availability(date: str, data: Optional[Dict[str, Any]]):
+    if data is not None:
+        with _availability_cache_lock:
+            _availability_cache[date] = data
+
+
+def _invalidate_availability(appointment_data: Dict[str, Any]):
+    date = (appointment_data or {}).get("date")
+    with _availability_cache_lock:
+        if date:
+            _availability_cache.pop(date, None)
+        else:
+            _availability_cache.clear()
+
+# Treatment durations resolved from RAG, per (index generation, treatment); a handful of entries.
+# The generation is shared through Redis, so a document change in any worker misses here too.
+_treatment_duration_cache = TTLCache(maxsize=64, ttl=3600)
+_treatment_duration_lock = threading.Lock()
+
+# Router decisions keyed by normalized question; repeated phrasings skip the router LLM call
+_route_cache = TTLCache(maxsize=2048, ttl=60)
+_route_cache_lock = threading.Lock()
+
+
+def _question_key(question: str) -> str:
+    return hashlib.blake2b(question.strip().lower().encode(), digest_size=8).hexdigest()
+
+# Unambiguous intents resolved without the router LLM; emergency is checked first
+_FAST_INTENT_PATTERNS = (
+    ('emergency', re.compile(r'\b(sangr\w+|dolor intenso|emergencia|reacci[oó]n al[eé]rgica|inflamaci[oó]n severa)\b', re.I)),
+    ('schedule', re.compile(r'\b(agendar|cita|reagendar|cancelar cita|disponibilidad)\b', re.I))
+)
+
+# Joined RAG context per (index generation, normalized question); shared by all agents
+# (the generation is Redis-backed, so writes in other workers invalidate it within ~2s)
+_rag_context_cache = TTLCache(maxsize=1024, ttl=300)
+_rag_context_lock = threading.Lock()
+
+
+_DATE_RE = re.compile(r'\b\d{1,2}[-/]\d{1,2}[-/]\d{4}\b')
+_DURATION_RE = re.compile(r'(\d+)\s*(?:minutos?|min)', re.I)
+
+# Ordered: the first treatment with a matching keyword wins
+_TREATMENT_KEYWORDS = (
+    ("limpieza facial", ("limpieza", "facial", "limpieza facial")),
+    ("masaje", ("masaje", "masajes", "relajante")),
+    ("microagujas", ("microagujas", "micro agujas", "microneedling")),
+    ("botox", ("botox", "toxina")),
+    ("rellenos", ("relleno", "rellenos", "ácido hialurónico")),
+    ("peeling", ("peeling", "exfoliación")),
+    ("radiofrecuencia", ("radiofrecuencia", "rf")),
+    ("depilación", ("depilación", "láser"))
+)
+_TREATMENT_PATTERNS = tuple(
+    (treatment, re.compile("|".join(map(re.escape, keywords)), re.I))
+    for treatment, keywords in _TREATMENT_KEYWORDS
+)
+
+def _keyword_re(*keywords: str):
+    """One case-insensitive pass for 'any keyword occurs as a substring'"""
+    return re.compile("|".join(map(re.escape, keywords)), re.I)
+
+_SCHEDULE_KW_RE = _keyword_re(
+    "agendar", "reservar", "programar", "cita", "appointment",
+    "agenda", "disponibilidad", "horario", "fecha", "hora"
+)
+_SCHEDULE_INTENT_RE = _keyword_re(
+    "agendar", "reservar", "programar", "cita", "appointment",
+    "agenda", "disponibilidad", "horario", "fecha", "hora",
+    "procede", "proceder", "confirmar cita"
+)
+_AVAILABILITY_ONLY_RE = _keyword_re(
+    "disponibilidad para", "horarios disponibles", "qué horarios",
+    "cuándo hay", "hay disponibilidad", "ver horarios"
+)
+_SCHEDULE_CONFIRM_RE = _keyword_re(
+    "agendar", "reservar", "procede", "proceder", "confirmar",
+    "quiero la cita", "agenda la cita"
+)
+_RAG_KW_RE = _keyword_re(
+    "precio", "costo", "inversión", "duración", "tiempo",
+    "tratamiento", "procedimiento", "servicio", "beneficio",
+    "horario", "disponibilidad", "agendar", "cita", "información"
+)
+def _digit_count(text: str) -> int:
+    # map() drives str.isdigit from C: one pass, no intermediate list
+    return sum(map(str.isdigit, text))
+
+_NAME_KW_RE = _keyword_re("nombre", "llamo", "soy")
+_DATE_KW_RE = _keyword_re("fecha", "día", "mañana", "hoy")
+# Relative days are whole words ("hoy" must not fire inside "hoyos"): tokenize once, test the set
+_WORD_RE = re.compile(r"[a-záéíóúüñ]+")
+_DAY_OFFSET_TOKENS = frozenset(("hoy", "mañana"))
+_DAY_AFTER_TOMORROW_RE = re.compile(r"\bpasado\s+mañana\b", re.I)
+_DURATION_HINT_RE = _keyword_re("duración", "tiempo")
+_SLOTS_POSITIVE_RE = _keyword_re("horarios disponibles", "disponible para", "- ")
+_SLOTS_NEGATIVE_RE = _keyword_re(
+    "no hay horarios disponibles",
+    "no hay disponibilidad",
+    "error consultando disponibilidad"
+)
+
+# Salvage the router's classification when its reply is not clean JSON (e.g. fenced)
+_ROUTER_INTENT_RE = re.compile(r'"intent"\s*:\s*"(EMERGENCY|SALES|SCHEDULE|SUPPORT)"')
+_ROUTER_CONFIDENCE_RE = re.compile(r'"confidence"\s*:\s*([0-9]*\.?[0-9]+)')
+
+# Agent signature phrases; the group index is the priority (lowest wins)
+_AGENT_SIGNATURE_RE = re.compile(
+    r"(Escalando tu caso de emergencia)|(¿Te gustaría agendar tu cita\?)"
+    r"|(Procesando tu solicitud de agenda)|(Te conectaré con un especialista)"
+)
+_AGENT_SIGNATURE_LABELS = ("emergency", "sales", "schedule", "support")
+
+# Upper bound on history any agent (or the Selenium service) sees, whatever the store keeps
+_MAX_HISTORY_MESSAGES = 16
+
+# Emergency/support/sales answers only need the recent turns; keeps their prompts small
+_SHORT_HISTORY_MESSAGES = 8
+
+
+def _recent_history(inputs: Dict[str, Any]) -> list:
+    return inputs["chat_history"][-_SHORT_HISTORY_MESSAGES:]
+
+
+def _history_text(chat_history: list) -> str:
+    return " ".join(msg.content if hasattr(msg, 'content') else str(msg) for msg in chat_history)
+
+# Every "HH:MM" of the day and its reverse map: slot times parse/format with one lookup
+_HHMM = tuple(f"{h:02d}:{m:02d}" for h in range(24) for m in range(60))
+_HHMM_TO_MINUTES = {hhmm: minutes for minutes, hhmm in enumerate(_HHMM)}
+
+_DEFAULT_TREATMENT_DURATIONS = {
+    "limpieza facial": 60,
+    "masaje": 60,
+    "microagujas": 90,
+    "botox": 30,
+    "rellenos": 45,
+    "peeling": 45,
+    "radiofrecuencia": 60,
+    "depilación": 30,
+    "tratamiento general": 60
+}
+
+
+class _SeleniumHealthMonitor:
+    """Polls the Selenium microservice /health from a daemon thread"""
     
-    def _initialize_agents(self):
-        """Initialize all specialized agents"""
-        return {
-            'router': self._create_router_agent(),
-            'emergency': self._create_emergency_agent(),
-            'sales': self._create_sales_agent(),
-            'support': self._create_support_agent(),
-            'schedule': self._create_enhanced_schedule_agent(),
-            'availability': self._create_availability_agent()
-        }
+    def __init__(self, url: str, interval: float = 30, timeout: float = 1):
+        self.url = url
+        self.interval = interval
+        self.timeout = timeout
+        self.available = False
+        self.last_check = 0
+        self._use_head = True
+        self.check()
+        threading.Thread(target=self._loop, name="selenium-health", daemon=True).start()
     
-    def _verify_selenium_service(self, force_check: bool = False) -> bool:
-        """Verificar disponibilidad del servicio Selenium local con cache inteligente"""
-        current_time = time.time()
-        
-        if not force_check and (current_time - self.selenium_status_last_check) < self.selenium_status_cache_duration:
-            return self.selenium_service_available
-        
+    def check(self) -> bool:
         try:
-            response = requests.get(
-                f"{self.schedule_service_url}/health",
-                timeout=3
-            )
-            
-            if response.status_code == 200:
-                self.selenium_service_available = True
-                self.selenium_status_last_check = current_time
-                return True
-            else:
-                self.selenium_service_available = False
-                self.selenium_status_last_check = current_time
-                return False
-                
+            # HEAD skips the body; services that don't allow it get GET from then on
+            if self._use_head:
+                response = _schedule_session.head(f"{self.url}/health", timeout=self.timeout)
+                if response.status_code == 405:
+                    self._use_head = False
+            if not self._use_head:
+                response = _schedule_session.get(f"{self.url}/health", timeout=self.timeout)
+            self.available = response.status_code == 200
         except Exception as e:
             logger.warning(f"Selenium service verification failed: {e}")
-            self.selenium_service_available = False
-            self.selenium_status_last_check = current_time
-            return False
+            self.available = False
+        self.last_check = time.time()
+        return self.available
     
-    def _initialize_local_selenium_connection(self):
-        """Inicializar y verificar conexión con microservicio local"""
-        try:
-            logger.info(f"Intentando conectar con microservicio de Selenium en: {self.schedule_service_url}")
-            
-            is_available = self._verify_selenium_service(force_check=True)
-            
-            if is_available:
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            self.check()
+
+
+_selenium_monitors: Dict[str, _SeleniumHealthMonitor] = {}
+_selenium_monitors_lock = threading.Lock()
+
+
+def _get_selenium_monitor(url: str) -> _SeleniumHealthMonitor:
+    with _selenium_monitors_lock:
+        monitor = _selenium_monitors.get(url)
+        if monitor is None:
+            logger.info(f"Intentando conectar con microservicio de Selenium en: {url}")
+            monitor = _selenium_monitors[url] = _SeleniumHealthMonitor(url)
+            if monitor.available:
                 logger.info("✅ Conexión exitosa con microservicio de Selenium local")
             else:
                 logger.warning("⚠️ Servicio de Selenium no disponible")
-                
-        except Exception as e:
-            logger.error(f"❌ Error inicializando conexión con Selenium: {e}")
-            self.selenium_service_available = False
+        return monitor
+
+class _SingleFlight:
+    """Collapse concurrent calls with the same key into one execution; followers share its result"""
     
-    def _create_router_agent(self):
-        """Agente Router: Clasifica la intención del usuario"""
-        router_prompt = ChatPromptTemplate.from_messages([
-            ("system", """Eres un clasificador de intenciones para Benova (centro estético).
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Any, Future] = {}
+    
+    def _join(self, key) -> Tuple[Future, bool]:
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                return future, False
+            future = self._calls[key] = Future()
+            return future, True
+    
+    def _settle(self, key, future: Future, result=None, error: BaseException = None):
+        with self._lock:
+            self._calls.pop(key, None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    
+    def do(self, key, fn):
+        future, leader = self._join(key)
+        if not leader:
+            return future.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            self._settle(key, future, error=e)
+            raise
+        self._settle(key, future, result)
+        return result
+
+
+# Router calls keyed by question; agent calls by (agent, user, question) since replies depend on history
+_inflight = _SingleFlight()
+
+
+class _LazyAgents(dict):
+    """Agent chains built on first lookup; turns that never schedule don't pay for those chains"""
+    
+    def __init__(self, factories: Dict[str, Any]):
+        super().__init__()
+        self._factories = factories
+    
+    def __missing__(self, name: str):
+        # A racing build is harmless; setdefault keeps whichever chain landed first
+        return self.setdefault(name, self._factories[name]())
+
+
+_multiagent_lock = threading.Lock()
+
+
+def get_multiagent_system() -> "MultiAgentSystem":
+    """Get the app-wide MultiAgentSystem, building its agents on first use"""
+    system = current_app.extensions.get('multiagent_system')
+    if system is None:
+        with _multiagent_lock:
+            system = current_app.extensions.get('multiagent_system')
+            if system is None:
+                system = current_app.extensions['multiagent_system'] = MultiAgentSystem()
+    return system
+
+# Prompts are immutable; built once per process and shared by every agent pipeline.
+# System messages are fully static so provider-side prompt caching can reuse the prefix;
+# per-turn data (RAG context, availability) goes in a trailing system message, history
+# through the placeholder and the question as the human message.
+_ROUTER_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """Eres un clasificador de intenciones para Benova (centro estético).
 
 ANALIZA el mensaje del usuario y clasifica la intención en UNA de estas categorías:
 
@@ -137,18 +353,12 @@ RESPONDE SOLO con el formato JSON:
     "confidence": 0.0-1.0,
     "keywords": ["palabra1", "palabra2"],
     "reasoning": "breve explicación"
-}}
+}}"""),
+    ("human", "{question}")
+])
 
-Mensaje del usuario: {question}"""),
-            ("human", "{question}")
-        ])
-        
-        return router_prompt | self.chat_model | StrOutputParser()
-    
-    def _create_emergency_agent(self):
-        """Agente de Emergencias: Maneja urgencias médicas"""
-        emergency_prompt = ChatPromptTemplate.from_messages([
-            ("system", """Eres María, especialista en emergencias médicas de Benova.
+_EMERGENCY_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """Eres María, especialista en emergencias médicas de Benova.
 
 SITUACIÓN DETECTADA: Posible emergencia médica.
 
@@ -162,28 +372,16 @@ TONO: Profesional, empático, tranquilizador pero urgente.
 EMOJIS: Máximo 3 por respuesta.
 LONGITUD: Máximo 3 oraciones.
 
-FINALIZA SIEMPRE con: "Escalando tu caso de emergencia ahora mismo. 🚨"
-
-Historial de conversación:
-{chat_history}
+FINALIZA SIEMPRE con: "Escalando tu caso de emergencia ahora mismo. 🚨\""""),
+    MessagesPlaceholder(variable_name="chat_history"),
+    ("human", "{question}")
+])
 
-Mensaje del usuario: {question}"""),
-            MessagesPlaceholder(variable_name="chat_history"),
-            ("human", "{question}")
-        ])
-        
-        return emergency_prompt | self.chat_model | StrOutputParser()
-    
-    def _create_sales_agent(self):
-        """Agente de Ventas: Especializado en información comercial"""
-        sales_prompt = ChatPromptTemplate.from_messages([
-            ("system", """Eres María, asesora comercial especializada de Benova.
+_SALES_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """Eres María, asesora comercial especializada de Benova.
 
 OBJETIVO: Proporcionar información comercial precisa y persuasiva.
 
-INFORMACIÓN DISPONIBLE:
-{context}
-
 ESTRUCTURA DE RESPUESTA:
 1. Saludo personalizado (si es nuevo cliente)
 2. Información del tratamiento solicitado
@@ -195,54 +393,14 @@ TONO: Cálido, profesional, persuasivo.
 EMOJIS: Máximo 3 por respuesta.
 LONGITUD: Máximo 5 oraciones.
 
-FINALIZA SIEMPRE con: "¿Te gustaría agendar tu cita? 📅"
+FINALIZA SIEMPRE con: "¿Te gustaría agendar tu cita? 📅\""""),
+    ("system", "INFORMACIÓN DISPONIBLE:\n{context}"),
+    MessagesPlaceholder(variable_name="chat_history"),
+    ("human", "{question}")
+])
 
-Historial de conversación:
-{chat_history}
-
-Pregunta del usuario: {question}"""),
-            MessagesPlaceholder(variable_name="chat_history"),
-            ("human", "{question}")
-        ])
-        
-        def get_sales_context(inputs):
-            """Obtener contexto RAG para ventas"""
-            try:
-                question = inputs.get("question", "")
-                self._log_retriever_usage(question, [])
-                
-                docs = self.retriever.invoke(question)
-                self._log_retriever_usage(question, docs)
-                
-                if not docs:
-                    return """Información básica de Benova:
-- Centro estético especializado
-- Tratamientos de belleza y bienestar
-- Atención personalizada
-- Profesionales certificados
-Para información específica de tratamientos, te conectaré con un especialista."""
-                
-                return "\n\n".join(doc.page_content for doc in docs)
-                
-            except Exception as e:
-                logger.error(f"Error retrieving sales context: {e}")
-                return "Información básica disponible. Te conectaré con un especialista para detalles específicos."
-        
-        return (
-            {
-                "context": get_sales_context,
-                "question": lambda x: x.get("question", ""),
-                "chat_history": lambda x: x.get("chat_history", [])
-            }
-            | sales_prompt
-            | self.chat_model
-            | StrOutputParser()
-        )
-    
-    def _create_support_agent(self):
-        """Agente de Soporte: Consultas generales y escalación"""
-        support_prompt = ChatPromptTemplate.from_messages([
-            ("system", """Eres María, especialista en soporte al cliente de Benova.
+_SUPPORT_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """Eres María, especialista en soporte al cliente de Benova.
 
 OBJETIVO: Resolver consultas generales y facilitar navegación.
 
@@ -252,9 +410,6 @@ TIPOS DE CONSULTA:
 - Escalación a especialistas
 - Consultas generales
 
-INFORMACIÓN DISPONIBLE:
-{context}
-
 PROTOCOLO:
 1. Respuesta directa a la consulta
 2. Información adicional relevante
@@ -264,54 +419,14 @@ TONO: Profesional, servicial, eficiente.
 LONGITUD: Máximo 4 oraciones.
 EMOJIS: Máximo 3 por respuesta.
 
-Si no puedes resolver completamente: "Te conectaré con un especialista para resolver tu consulta específica. 👩‍⚕️"
-
-Historial de conversación:
-{chat_history}
+Si no puedes resolver completamente: "Te conectaré con un especialista para resolver tu consulta específica. 👩‍⚕️\""""),
+    ("system", "INFORMACIÓN DISPONIBLE:\n{context}"),
+    MessagesPlaceholder(variable_name="chat_history"),
+    ("human", "{question}")
+])
 
-Consulta del usuario: {question}"""),
-            MessagesPlaceholder(variable_name="chat_history"),
-            ("human", "{question}")
-        ])
-        
-        def get_support_context(inputs):
-            """Obtener contexto RAG para soporte"""
-            try:
-                question = inputs.get("question", "")
-                self._log_retriever_usage(question, [])
-                
-                docs = self.retriever.invoke(question)
-                self._log_retriever_usage(question, docs)
-                
-                if not docs:
-                    return """Información general de Benova:
-- Horarios de atención
-- Información general del centro
-- Consultas sobre procesos
-- Información institucional
-Para información específica, te conectaré con un especialista."""
-                
-                return "\n\n".join(doc.page_content for doc in docs)
-                
-            except Exception as e:
-                logger.error(f"Error retrieving support context: {e}")
-                return "Información general disponible. Te conectaré con un especialista para consultas específicas."
-        
-        return (
-            {
-                "context": get_support_context,
-                "question": lambda x: x.get("question", ""),
-                "chat_history": lambda x: x.get("chat_history", [])
-            }
-            | support_prompt
-            | self.chat_model
-            | StrOutputParser()
-        )
-    
-    def _create_availability_agent(self):
-        """Agente que verifica disponibilidad MEJORADO con comunicación robusta"""
-        availability_prompt = ChatPromptTemplate.from_messages([
-            ("system", """Eres un agente de disponibilidad de Benova.
+_AVAILABILITY_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """Eres un agente de disponibilidad de Benova.
     
     ESTADO DEL SISTEMA:
     {selenium_status}
@@ -334,95 +449,14 @@ Para información específica, te conectaré con un especialista."""
     Si hay error del sistema: "Error consultando disponibilidad. Te conectaré con un especialista."
     
     Mensaje del usuario: {question}"""),
-            ("human", "{question}")
-        ])
-        
-        def get_availability_selenium_status(inputs):
-            """Obtener estado del sistema Selenium para availability"""
-            is_available = self._verify_selenium_service()
-            
-            if is_available:
-                return f"✅ Sistema de disponibilidad ACTIVO (Conectado a {self.schedule_service_url})"
-            else:
-                return f"⚠️ Sistema de disponibilidad NO DISPONIBLE (Verificar conexión: {self.schedule_service_url})"
-        
-        def process_availability(inputs):
-            """Procesar consulta de disponibilidad MEJORADA"""
-            try:
-                question = inputs.get("question", "")
-                chat_history = inputs.get("chat_history", [])
-                selenium_status = inputs.get("selenium_status", "")
-                
-                logger.info(f"=== AVAILABILITY AGENT - PROCESANDO ===")
-                logger.info(f"Pregunta: {question}")
-                logger.info(f"Estado Selenium: {selenium_status}")
-                
-                if not self._verify_selenium_service():
-                    logger.error("Servicio Selenium no disponible para availability agent")
-                    return "Error consultando disponibilidad. Te conectaré con un especialista para verificar horarios. 👩‍⚕️"
-                
-                date = self._extract_date_from_question(question, chat_history)
-                treatment = self._extract_treatment_from_question(question)
-                
-                if not date:
-                    return "Por favor especifica la fecha en formato DD-MM-YYYY para consultar disponibilidad."
-                
-                logger.info(f"Fecha extraída: {date}, Tratamiento: {treatment}")
-                
-                duration = self._get_treatment_duration(treatment)
-                logger.info(f"Duración del tratamiento: {duration} minutos")
-                
-                availability_data = self._call_check_availability(date)
-                
-                if not availability_data:
-                    logger.warning("No se obtuvieron datos de disponibilidad")
-                    return "Error consultando disponibilidad. Te conectaré con un especialista."
-                
-                if not availability_data.get("available_slots"):
-                    logger.info("No hay slots disponibles para la fecha solicitada")
-                    return f"No hay horarios disponibles para {date}."
-                
-                filtered_slots = self._filter_slots_by_duration(
-                    availability_data["available_slots"], 
-                    duration
-                )
-                
-                logger.info(f"Slots filtrados: {filtered_slots}")
-                
-                response = self._format_slots_response(filtered_slots, date, duration)
-                logger.info(f"=== AVAILABILITY AGENT - RESPUESTA GENERADA ===")
-                return response
-                
-            except Exception as e:
-                logger.error(f"Error en agente de disponibilidad: {e}")
-                logger.exception("Stack trace completo:")
-                return "Error consultando disponibilidad. Te conectaré con un especialista."
-    
-        return (
-            {
-                "selenium_status": get_availability_selenium_status,
-                "question": lambda x: x.get("question", ""),
-                "chat_history": lambda x: x.get("chat_history", [])
-            }
-            | RunnableLambda(process_availability)
-        )
-    
-    def _create_enhanced_schedule_agent(self):
-        """Agente de Schedule mejorado con integración de disponibilidad"""
-        schedule_prompt = ChatPromptTemplate.from_messages([
-            ("system", """Eres María, especialista en gestión de citas de Benova.
+    ("human", "{question}")
+])
+
+_SCHEDULE_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """Eres María, especialista en gestión de citas de Benova.
     
     OBJETIVO: Facilitar la gestión completa de citas y horarios usando herramientas avanzadas.
     
-    INFORMACIÓN DISPONIBLE:
-    {context}
-    
-    ESTADO DEL SISTEMA DE AGENDAMIENTO:
-    {selenium_status}
-    
-    DISPONIBILIDAD CONSULTADA:
-    {available_slots}
-    
     FUNCIONES PRINCIPALES:
     - Agendar nuevas citas (con automatización completa via Selenium LOCAL)
     - Modificar citas existentes
@@ -462,26 +496,241 @@ Para información específica, te conectaré con un especialista."""
     
     TONO: Profesional, eficiente, servicial.
     EMOJIS: Máximo 3 por respuesta.
-    LONGITUD: Máximo 6 oraciones.
+    LONGITUD: Máximo 6 oraciones."""),
+    ("system", """INFORMACIÓN DISPONIBLE:
+{context}
+
+ESTADO DEL SISTEMA DE AGENDAMIENTO:
+{selenium_status}
+
+DISPONIBILIDAD CONSULTADA:
+{available_slots}"""),
+    MessagesPlaceholder(variable_name="chat_history"),
+    ("human", "{question}")
+])
+
+
+class MultiAgentSystem:
+    """Sistema multi-agente modularizado"""
+    
+    def __init__(self):
+        self.openai_service = get_openai_service()
+        self.vectorstore_service = VectorstoreService()
+        self.chat_model = self.openai_service.get_chat_model()
+        self.retriever = self.vectorstore_service.get_retriever()
+        self.conversation_manager = None  # Se inyecta cuando se usa
+        
+        # Configuración
+        self.voice_enabled = current_app.config.get('VOICE_ENABLED', False)
+        self.image_enabled = current_app.config.get('IMAGE_ENABLED', False)
+        self.schedule_service_url = current_app.config.get('SCHEDULE_SERVICE_URL', 'http://127.0.0.1:4040')
+        self.is_local_development = current_app.config.get('ENVIRONMENT') == 'local'
+        self.selenium_timeout = 30 if self.is_local_development else 60
+        
+        # Estado de Selenium: lo refresca un hilo de fondo compartido por proceso
+        self._selenium_monitor = _get_selenium_monitor(self.schedule_service_url)
+        
+        # Inicializar agentes
+        self.agents = self._initialize_agents()
+    
+    @property
+    def selenium_service_available(self) -> bool:
+        return self._selenium_monitor.available
+    
+    @selenium_service_available.setter
+    def selenium_service_available(self, value: bool):
+        # Un fallo visto en una petición se comparte hasta el siguiente sondeo
+        self._selenium_monitor.available = value
     
-    Historial de conversación:
-    {chat_history}
+    def _initialize_agents(self):
+        """Register the specialized agents; each chain is built on first use"""
+        return _LazyAgents({
+            'router': self._create_router_agent,
+            'emergency': self._create_emergency_agent,
+            'sales': self._create_sales_agent,
+            'support': self._create_support_agent,
+            'schedule': self._create_enhanced_schedule_agent,
+            'availability': self._create_availability_agent
+        })
+    
+    def _verify_selenium_service(self, force_check: bool = False) -> bool:
+        """Verificar disponibilidad del servicio Selenium local (lectura del último sondeo)"""
+        if force_check:
+            return self._selenium_monitor.check()
+        return self._selenium_monitor.available
+    
+    def _initialize_local_selenium_connection(self):
+        """Inicializar y verificar conexión con microservicio local"""
+        logger.info(f"Intentando conectar con microservicio de Selenium en: {self.schedule_service_url}")
+        
+        if self._verify_selenium_service(force_check=True):
+            logger.info("✅ Conexión exitosa con microservicio de Selenium local")
+        else:
+            logger.warning("⚠️ Servicio de Selenium no disponible")
+    
+    def _create_router_agent(self):
+        """Agente Router: Clasifica la intención del usuario"""
+        # The router only reads the question; history never reaches its prompt
+        return (
+            {"question": itemgetter("question")}
+            | _ROUTER_PROMPT
+            | self.chat_model
+            | StrOutputParser()
+        )
+    
+    def _create_emergency_agent(self):
+        """Agente de Emergencias: Maneja urgencias médicas"""
+        return (
+            RunnablePassthrough.assign(chat_history=_recent_history)
+            | _EMERGENCY_PROMPT
+            | self.chat_model
+            | StrOutputParser()
+        )
     
-    Solicitud del usuario: {question}"""),
-            MessagesPlaceholder(variable_name="chat_history"),
-            ("human", "{question}")
-        ])
+    def _create_sales_agent(self):
+        """Agente de Ventas: Especializado en información comercial"""
+        def get_sales_context(inputs):
+            """Obtener contexto RAG para ventas"""
+            try:
+                context = self._rag_context(inputs["question"])
+                
+                if not context:
+                    return """Información básica de Benova:
+- Centro estético especializado
+- Tratamientos de belleza y bienestar
+- Atención personalizada
+- Profesionales certificados
+Para información específica de tratamientos, te conectaré con un especialista."""
+                
+                return context
+                
+            except Exception as e:
+                logger.error(f"Error retrieving sales context: {e}")
+                return "Información básica disponible. Te conectaré con un especialista para detalles específicos."
         
+        return (
+            RunnablePassthrough.assign(context=get_sales_context, chat_history=_recent_history)
+            | _SALES_PROMPT
+            | self.chat_model
+            | StrOutputParser()
+        )
+    
+    def _create_support_agent(self):
+        """Agente de Soporte: Consultas generales y escalación"""
+        def get_support_context(inputs):
+            """Obtener contexto RAG para soporte"""
+            try:
+                context = self._rag_context(inputs["question"])
+                
+                if not context:
+                    return """Información general de Benova:
+- Horarios de atención
+- Información general del centro
+- Consultas sobre procesos
+- Información institucional
+Para información específica, te conectaré con un especialista."""
+                
+                return context
+                
+            except Exception as e:
+                logger.error(f"Error retrieving support context: {e}")
+                return "Información general disponible. Te conectaré con un especialista para consultas específicas."
+        
+        return (
+            RunnablePassthrough.assign(context=get_support_context, chat_history=_recent_history)
+            | _SUPPORT_PROMPT
+            | self.chat_model
+            | StrOutputParser()
+        )
+    
+    def _create_availability_agent(self):
+        """Agente que verifica disponibilidad MEJORADO con comunicación robusta"""
+        def get_availability_selenium_status(inputs):
+            """Obtener estado del sistema Selenium para availability"""
+            is_available = self._verify_selenium_service()
+            
+            if is_available:
+                return f"✅ Sistema de disponibilidad ACTIVO (Conectado a {self.schedule_service_url})"
+            else:
+                return f"⚠️ Sistema de disponibilidad NO DISPONIBLE (Verificar conexión: {self.schedule_service_url})"
+        
+        def parse_availability_request(inputs):
+            """Validar la consulta; devuelve (respuesta_temprana, fecha, tratamiento)"""
+            question = inputs.get("question", "")
+            history_text = inputs.get("chat_history_text", "")
+            selenium_status = inputs.get("selenium_status", "")
+            
+            logger.info(f"=== AVAILABILITY AGENT - PROCESANDO ===")
+            logger.info(f"Pregunta: {question}")
+            logger.info(f"Estado Selenium: {selenium_status}")
+            
+            if not self._verify_selenium_service():
+                logger.error("Servicio Selenium no disponible para availability agent")
+                return "Error consultando disponibilidad. Te conectaré con un especialista para verificar horarios. 👩‍⚕️", None, None
+            
+            date = self._extract_date_from_question(question, history_text)
+            treatment = self._extract_treatment_from_question(question)
+            
+            if not date:
+                return "Por favor especifica la fecha en formato DD-MM-YYYY para consultar disponibilidad.", None, None
+            
+            logger.info(f"Fecha extraída: {date}, Tratamiento: {treatment}")
+            return None, date, treatment
+        
+        def format_availability(date, duration, availability_data):
+            """Construir la respuesta a partir de los slots del microservicio"""
+            logger.info(f"Duración del tratamiento: {duration} minutos")
+            
+            if not availability_data:
+                logger.warning("No se obtuvieron datos de disponibilidad")
+                return "Error consultando disponibilidad. Te conectaré con un especialista."
+            
+            if not availability_data.get("available_slots"):
+                logger.info("No hay slots disponibles para la fecha solicitada")
+                return f"No hay horarios disponibles para {date}."
+            
+            filtered_slots = self._filter_slots_by_duration(
+                availability_data["available_slots"], 
+                duration
+            )
+            
+            logger.info(f"Slots filtrados: {filtered_slots}")
+            
+            response = self._format_slots_response(filtered_slots, date, duration)
+            logger.info(f"=== AVAILABILITY AGENT - RESPUESTA GENERADA ===")
+            return response
+        
+        def process_availability(inputs):
+            """Procesar consulta de disponibilidad MEJORADA"""
+            try:
+                early_reply, date, treatment = parse_availability_request(inputs)
+                if early_reply:
+                    return early_reply
+                
+                # The duration RAG lookup overlaps with the microservice call instead of preceding it
+                app = current_app._get_current_object()
+                duration_future = _lookup_pool.submit(self._treatment_duration_in_context, app, treatment)
+                availability_data = self._call_check_availability(date)
+                return format_availability(date, duration_future.result(), availability_data)
+                
+            except Exception as e:
+                logger.error(f"Error en agente de disponibilidad: {e}")
+                logger.exception("Stack trace completo:")
+                return "Error consultando disponibilidad. Te conectaré con un especialista."
+        
+        return (
+            RunnablePassthrough.assign(selenium_status=get_availability_selenium_status)
+            | RunnableLambda(process_availability)
+        )
+    
+    def _create_enhanced_schedule_agent(self):
+        """Agente de Schedule mejorado con integración de disponibilidad"""
         def get_schedule_context(inputs):
             """Obtener contexto RAG para agenda"""
             try:
-                question = inputs.get("question", "")
-                self._log_retriever_usage(question, [])
-                
-                docs = self.retriever.invoke(question)
-                self._log_retriever_usage(question, docs)
+                context = self._rag_context(inputs["question"])
                 
-                if not docs:
+                if not context:
                     return """Información básica de agenda Benova:
     - Horarios de atención: Lunes a Viernes 8:00 AM - 6:00 PM, Sábados 8:00 AM - 4:00 PM
     - Servicios agendables: Consultas médicas, Tratamientos estéticos, Procedimientos de belleza
@@ -490,7 +739,7 @@ Para información específica, te conectaré con un especialista."""
     - Sistema de agendamiento automático con Selenium LOCAL disponible
     - Datos requeridos: Nombre, cédula, teléfono, fecha y hora deseada"""
                 
-                return "\n\n".join(doc.page_content for doc in docs)
+                return context
                 
             except Exception as e:
                 logger.error(f"Error retrieving schedule context: {e}")
@@ -503,27 +752,38 @@ Para información específica, te conectaré con un especialista."""
             else:
                 return "⚠️ Sistema de agendamiento automático NO DISPONIBLE (Verificar conexión local)"
         
+        def get_available_slots(inputs):
+            """Consultar disponibilidad (corre en paralelo con el contexto RAG)"""
+            question = inputs["question"]
+            if not self._contains_schedule_intent(question):
+                return ""
+            
+            logger.info("Detectado intent de agendamiento - verificando disponibilidad")
+            try:
+                available_slots = self.agents['availability'].invoke({"question": question})
+                logger.info(f"Disponibilidad obtenida: {available_slots}")
+                return available_slots
+            except Exception as e:
+                logger.error(f"Error verificando disponibilidad: {e}")
+                return "Error consultando disponibilidad. Verificaré manualmente."
+        
         def process_schedule_with_selenium(inputs):
             """Procesar solicitud de agenda con integración de disponibilidad MEJORADA"""
             try:
-                question = inputs.get("question", "")
-                user_id = inputs.get("user_id", "default_user")
-                chat_history = inputs.get("chat_history", [])
-                context = inputs.get("context", "")
-                selenium_status = inputs.get("selenium_status", "")
+                question = inputs["question"]
+                user_id = inputs["user_id"]
+                chat_history = inputs["chat_history"]
+                context = inputs["context"]
+                selenium_status = inputs["selenium_status"]
                 
                 logger.info(f"Procesando solicitud de agenda: {question}")
                 
-                available_slots = ""
-                if self._contains_schedule_intent(question):
-                    logger.info("Detectado intent de agendamiento - verificando disponibilidad")
-                    try:
-                        availability_response = self.agents['availability'].invoke({"question": question})
-                        available_slots = availability_response
-                        logger.info(f"Disponibilidad obtenida: {available_slots}")
-                    except Exception as e:
-                        logger.error(f"Error verificando disponibilidad: {e}")
-                        available_slots = "Error consultando disponibilidad. Verificaré manualmente."
+                available_slots = inputs["available_slots"]
+                
+                # Pure "what slots are there?" turns: the availability answer is the reply
+                if available_slots and self._is_just_availability_check(question):
+                    logger.info("Consulta solo de disponibilidad - se omite la respuesta de agenda")
+                    return available_slots
                 
                 base_inputs = {
                     "question": question,
@@ -534,11 +794,11 @@ Para información específica, te conectaré con un especialista."""
                 }
                 
                 logger.info("Generando respuesta base con disponibilidad")
-                base_response = (schedule_prompt | self.chat_model | StrOutputParser()).invoke(base_inputs)
+                base_response = (_SCHEDULE_PROMPT | self.chat_model | StrOutputParser()).invoke(base_inputs)
                 
                 should_proceed_selenium = (
                     self._contains_schedule_intent(question) and 
-                    self._should_use_selenium(question, chat_history) and
+                    self._should_use_selenium(question, inputs["chat_history"]) and
                     self._has_available_slots_confirmation(available_slots) and
                     not self._is_just_availability_check(question)
                 )
@@ -563,20 +823,18 @@ Para información específica, te conectaré con un especialista."""
                 return "Error procesando tu solicitud. Conectando con especialista... 📋"
         
         return (
-            {
-                "context": get_schedule_context,
-                "selenium_status": get_selenium_status,
-                "question": lambda x: x.get("question", ""),
-                "chat_history": lambda x: x.get("chat_history", []),
-                "user_id": lambda x: x.get("user_id", "default_user")
-            }
+            # assign() runs its branches in parallel: RAG context and availability are fetched concurrently
+            RunnablePassthrough.assign(
+                context=get_schedule_context,
+                available_slots=get_available_slots,
+                selenium_status=get_selenium_status
+            )
             | RunnableLambda(process_schedule_with_selenium)
         )
     
-    def get_response(self, question: str, user_id: str, conversation_manager: ConversationManager,
-                     media_type: str = "text", media_context: str = None) -> Tuple[str, str]:
-        """Método principal para obtener respuesta del sistema multi-agente"""
-        self.conversation_manager = conversation_manager
+    def _build_inputs(self, question: str, user_id: str, conversation_manager: ConversationManager,
+                      media_type: str, media_context: Optional[str]):
+        """Shared pre-processing for get_response/stream_response; returns (inputs, early_reply)"""
         
         if media_type == "image" and media_context:
             processed_question = f"Contexto visual: {media_context}\n\nPregunta: {question}"
@@ -586,92 +844,162 @@ Para información específica, te conectaré con un especialista."""
             processed_question = question
         
         if not processed_question or not processed_question.strip():
-            return "Por favor, envía un mensaje específico para poder ayudarte. 😊", "support"
+            return None, ("Por favor, envía un mensaje específico para poder ayudarte. 😊", "support")
         
         if not user_id or not user_id.strip():
-            return "Error interno: ID de usuario inválido.", "error"
+            return None, ("Error interno: ID de usuario inválido.", "error")
+        
+        # Fetched once per turn and bounded; every agent reads (a slice of) this same list
+        chat_history = conversation_manager.get_chat_history(user_id, format_type="messages") or []
+        chat_history = chat_history[-_MAX_HISTORY_MESSAGES:]
+        
+        # Every key the agent chains read is set here, so they index it directly
+        inputs = {
+            "question": processed_question.strip(), 
+            "chat_history": chat_history,
+            # Joined once here; date/patient-info scans reuse it instead of re-stringifying
+            "chat_history_text": _history_text(chat_history),
+            "user_id": user_id
+        }
+        
+        logger.info(f"🔍 CONSULTA INICIADA - User: {user_id}, Pregunta: {processed_question[:100]}...")
+        if self._might_need_rag(processed_question):
+            logger.info("   → Posible consulta RAG detectada")
         
+        return inputs, None
+    
+    def _finish_response(self, inputs: Dict[str, Any], response: str,
+                         conversation_manager: ConversationManager) -> Tuple[str, str]:
+        """Persist the exchange and resolve which agent answered"""
+        user_id = inputs["user_id"]
+        agent_used = self._determine_agent_used(response)
+        
+        logger.info(f"🤖 RESPUESTA GENERADA - Agente: {agent_used}")
+        logger.info(f"   → Longitud respuesta: {len(response)} caracteres")
+        
+        conversation_manager.add_message(user_id, "user", inputs["question"])
+        conversation_manager.add_message(user_id, "assistant", response)
+        
+        logger.info(f"Multi-agent response generated for user {user_id} using {agent_used}")
+        
+        return response, agent_used
+    
+    def get_response(self, question: str, user_id: str, conversation_manager: ConversationManager,
+                     media_type: str = "text", media_context: str = None) -> Tuple[str, str]:
+        """Método principal para obtener respuesta del sistema multi-agente"""
         try:
-            chat_history = conversation_manager.get_chat_history(user_id, format_type="messages")
-            
-            inputs = {
-                "question": processed_question.strip(), 
-                "chat_history": chat_history,
-                "user_id": user_id
-            }
-            
-            might_need_rag = self._might_need_rag(processed_question)
-            
-            logger.info(f"🔍 CONSULTA INICIADA - User: {user_id}, Pregunta: {processed_question[:100]}...")
-            if might_need_rag:
-                logger.info("   → Posible consulta RAG detectada")
+            inputs, early_reply = self._build_inputs(question, user_id, conversation_manager,
+                                                     media_type, media_context)
+            if early_reply:
+                return early_reply
             
             response = self._orchestrate(inputs)
+            return self._finish_response(inputs, response, conversation_manager)
             
-            logger.info(f"🤖 RESPUESTA GENERADA - Agente: {self._determine_agent_used(response)}")
-            logger.info(f"   → Longitud respuesta: {len(response)} caracteres")
-            
-            conversation_manager.add_message(user_id, "user", processed_question)
-            conversation_manager.add_message(user_id, "assistant", response)
+        except Exception as e:
+            logger.exception(f"Error en sistema multi-agente (User: {user_id})")
+            return "Disculpa, tuve un problema técnico. Por favor intenta de nuevo. 🔧", "error"
+    
+    def stream_response(self, question: str, user_id: str, conversation_manager: ConversationManager,
+                        media_type: str = "text", media_context: str = None) -> Iterator[str]:
+        """Streaming variant of get_response: yields reply chunks as the selected agent produces them"""
+        try:
+            inputs, early_reply = self._build_inputs(question, user_id, conversation_manager,
+                                                     media_type, media_context)
+            if early_reply:
+                yield early_reply[0]
+                return
             
-            agent_used = self._determine_agent_used(response)
+            agent_name = self._select_agent(inputs)
             
-            logger.info(f"Multi-agent response generated for user {user_id} using {agent_used}")
+            # Chains ending in prompt | model | parser stream tokens; lambda-backed agents yield once
+            parts = []
+            for chunk in self.agents[agent_name].stream(inputs):
+                parts.append(chunk)
+                yield chunk
             
-            return response, agent_used
+            self._finish_response(inputs, "".join(parts), conversation_manager)
             
         except Exception as e:
-            logger.exception(f"Error en sistema multi-agente (User: {user_id})")
-            return "Disculpa, tuve un problema técnico. Por favor intenta de nuevo. 🔧", "error"
+            logger.exception(f"Error en streaming multi-agente (User: {user_id})")
+            yield "Disculpa, tuve un problema técnico. Por favor intenta de nuevo. 🔧"
     
-    def _orchestrate(self, inputs):
-        """Orquestador principal que coordina los agentes"""
+    def _route(self, router_response: str) -> str:
+        """Map the router's JSON classification to an agent name"""
         try:
-            router_response = self.agents['router'].invoke(inputs)
+            classification = orjson.loads(router_response)
+            intent = classification.get("intent", "SUPPORT")
+            confidence = classification.get("confidence", 0.5)
             
-            try:
-                classification = json.loads(router_response)
-                intent = classification.get("intent", "SUPPORT")
-                confidence = classification.get("confidence", 0.5)
-                
-                logger.info(f"Intent classified: {intent} (confidence: {confidence})")
-                
-            except json.JSONDecodeError:
+            logger.info(f"Intent classified: {intent} (confidence: {confidence})")
+            
+        except (orjson.JSONDecodeError, AttributeError):
+            intent_match = _ROUTER_INTENT_RE.search(router_response)
+            if intent_match:
+                confidence_match = _ROUTER_CONFIDENCE_RE.search(router_response)
+                intent = intent_match.group(1)
+                confidence = float(confidence_match.group(1)) if confidence_match else 0.5
+                logger.info(f"Intent salvaged from non-JSON router response: {intent} (confidence: {confidence})")
+            else:
                 intent = "SUPPORT"
                 confidence = 0.3
                 logger.warning("Router response was not valid JSON, defaulting to SUPPORT")
+        
+        if intent == "EMERGENCY":
+            return 'emergency'
+        if confidence > 0.8:
+            if intent == "SALES":
+                return 'sales'
+            if intent == "SCHEDULE":
+                return 'schedule'
+        return 'support'
+    
+    def _known_route(self, question: str, key: str) -> Optional[str]:
+        """Agent resolved by keyword fast-path or route cache; None means ask the router"""
+        for agent_name, pattern in _FAST_INTENT_PATTERNS:
+            if pattern.search(question):
+                # Availability-only questions go straight to the availability agent
+                if agent_name == 'schedule' and self._is_just_availability_check(question):
+                    agent_name = 'availability'
+                logger.info(f"Intent from keywords: {agent_name}")
+                return agent_name
+        
+        with _route_cache_lock:
+            agent_name = _route_cache.get(key)
+        if agent_name is not None:
+            logger.info(f"Intent from cache: {agent_name}")
+        return agent_name
+    
+    def _select_agent(self, inputs) -> str:
+        """Keyword fast-path, route cache, then the router LLM"""
+        key = _question_key(inputs["question"])
+        agent_name = self._known_route(inputs["question"], key)
+        if agent_name is None:
+            router_response = _inflight.do(("router", key), lambda: self.agents['router'].invoke(inputs))
+            agent_name = self._route(router_response)
+            with _route_cache_lock:
+                _route_cache[key] = agent_name
+        return agent_name
+    
+    def _orchestrate(self, inputs):
+        """Orquestador principal que coordina los agentes"""
+        try:
+            agent_name = self._select_agent(inputs)
             
-            inputs["user_id"] = inputs.get("user_id", "default_user")
-            
-            if intent == "EMERGENCY" or confidence > 0.8:
-                if intent == "EMERGENCY":
-                    return self.agents['emergency'].invoke(inputs)
-                elif intent == "SALES":
-                    return self.agents['sales'].invoke(inputs)
-                elif intent == "SCHEDULE":
-                    return self.agents['schedule'].invoke(inputs)
-                else:
-                    return self.agents['support'].invoke(inputs)
-            else:
-                return self.agents['support'].invoke(inputs)
+            flight_key = (agent_name, inputs["user_id"], _question_key(inputs["question"]))
+            return _inflight.do(flight_key, lambda: self.agents[agent_name].invoke(inputs))
                 
         except Exception as e:
             logger.error(f"Error in orchestrator: {e}")
             return self.agents['support'].invoke(inputs)
     
-    def _extract_date_from_question(self, question, chat_history=None):
-        """Extract date from question or chat history"""
-        import re
-        
+    def _extract_date_from_question(self, question, history_text=""):
+        """Extract date from question or joined chat history"""
         date_str = self._find_date_in_text(question)
         if date_str:
             return date_str
         
-        if chat_history:
-            history_text = " ".join([
-                msg.content if hasattr(msg, 'content') else str(msg) 
-                for msg in chat_history
-            ])
+        if history_text:
             date_str = self._find_date_in_text(history_text)
             if date_str:
                 return date_str
@@ -680,78 +1008,71 @@ Para información específica, te conectaré con un especialista."""
     
     def _find_date_in_text(self, text):
         """Helper to find date in text"""
-        import re
-        from datetime import datetime, timedelta
-        
-        match = re.search(r'\b\d{1,2}[-/]\d{1,2}[-/]\d{4}\b', text)
+        match = _DATE_RE.search(text)
         if match:
             return match.group(0).replace('/', '-')
         
-        text_lower = text.lower()
+        day_words = _DAY_OFFSET_TOKENS.intersection(_WORD_RE.findall(text.lower()))
+        if not day_words:
+            return None
+        
         today = datetime.now()
         
-        if "hoy" in text_lower:
+        if "hoy" in day_words:
             return today.strftime("%d-%m-%Y")
-        elif "mañana" in text_lower:
-            tomorrow = today + timedelta(days=1)
-            return tomorrow.strftime("%d-%m-%Y")
-        elif "pasado mañana" in text_lower:
+        elif _DAY_AFTER_TOMORROW_RE.search(text):
             day_after = today + timedelta(days=2)
             return day_after.strftime("%d-%m-%Y")
-        
-        return None
+        else:
+            tomorrow = today + timedelta(days=1)
+            return tomorrow.strftime("%d-%m-%Y")
     
     def _extract_treatment_from_question(self, question):
         """Extraer tratamiento del mensaje"""
-        question_lower = question.lower()
-        
-        treatments_keywords = {
-            "limpieza facial": ["limpieza", "facial", "limpieza facial"],
-            "masaje": ["masaje", "masajes", "relajante"],
-            "microagujas": ["microagujas", "micro agujas", "microneedling"],
-            "botox": ["botox", "toxina"],
-            "rellenos": ["relleno", "rellenos", "ácido hialurónico"],
-            "peeling": ["peeling", "exfoliación"],
-            "radiofrecuencia": ["radiofrecuencia", "rf"],
-            "depilación": ["depilación", "láser"]
-        }
-        
-        for treatment, keywords in treatments_keywords.items():
-            if any(keyword in question_lower for keyword in keywords):
+        for treatment, pattern in _TREATMENT_PATTERNS:
+            if pattern.search(question):
                 return treatment
         
         return "tratamiento general"
     
+    def _treatment_duration_in_context(self, app, treatment):
+        """_get_treatment_duration for a pool thread (needs its own app context)"""
+        with app.app_context():
+            return self._get_treatment_duration(treatment)
+    
     def _get_treatment_duration(self, treatment):
-        """Obtener duración del tratamiento desde RAG o configuración por defecto"""
+        """Obtener duración del tratamiento desde RAG o configuración por defecto (cacheada)"""
+        key = (get_index_generation(), treatment.strip().lower())
+        with _treatment_duration_lock:
+            duration = _treatment_duration_cache.get(key)
+        if duration is not None:
+            return duration
+        
+        # Concurrent first lookups of the same treatment share one RAG round-trip
+        duration = _inflight.do(("duration",) + key, lambda: self._lookup_treatment_duration(treatment))
+        if duration is None:
+            return 60
+        with _treatment_duration_lock:
+            _treatment_duration_cache[key] = duration
+        return duration
+    
+    def _lookup_treatment_duration(self, treatment):
+        """Resolver la duración del tratamiento contra el RAG; None si el RAG falla"""
         try:
-            docs = self.retriever.invoke(f"duración tiempo {treatment}")
+            # Few distinct treatments, so the query embedding is nearly always a cache hit
+            docs = self.vectorstore_service.similarity_search_batched(f"duración tiempo {treatment}")
             
-            for doc in docs:
-                content = doc.page_content.lower()
-                if "duración" in content or "tiempo" in content:
-                    import re
-                    duration_match = re.search(r'(\d+)\s*(?:minutos?|min)', content)
-                    if duration_match:
-                        return int(duration_match.group(1))
+            # One duration search over the docs that mention it ("\0" keeps matches from spanning docs)
+            hinted = "\0".join(doc.page_content for doc in docs if _DURATION_HINT_RE.search(doc.page_content))
+            duration_match = _DURATION_RE.search(hinted)
+            if duration_match:
+                return int(duration_match.group(1))
             
-            default_durations = {
-                "limpieza facial": 60,
-                "masaje": 60,
-                "microagujas": 90,
-                "botox": 30,
-                "rellenos": 45,
-                "peeling": 45,
-                "radiofrecuencia": 60,
-                "depilación": 30,
-                "tratamiento general": 60
-            }
-           
-            return default_durations.get(treatment, 60)
+            return _DEFAULT_TREATMENT_DURATIONS.get(treatment, 60)
            
         except Exception as e:
             logger.error(f"Error obteniendo duración del tratamiento: {e}")
-            return 60
+            return None
     
     def _call_check_availability(self, date):
         """Llamar al endpoint de disponibilidad con la misma lógica que schedule_agent"""
@@ -760,9 +1081,14 @@ Para información específica, te conectaré con un especialista."""
                 logger.warning("Servicio Selenium no disponible para availability check")
                 return None
             
+            cached = _cached_availability(date)
+            if cached is not None:
+                logger.info(f"Disponibilidad para {date} desde cache")
+                return cached
+            
             logger.info(f"Consultando disponibilidad en: {self.schedule_service_url}/check-availability para fecha: {date}")
             
-            response = requests.post(
+            response = _schedule_session.post(
                 f"{self.schedule_service_url}/check-availability",
                 json={"date": date},
                 headers={"Content-Type": "application/json"},
@@ -774,7 +1100,9 @@ Para información específica, te conectaré con un especialista."""
             if response.status_code == 200:
                 result = response.json()
                 logger.info(f"Datos de disponibilidad obtenidos exitosamente: {result.get('success', False)}")
-                return result.get("data", {})
+                data = result.get("data", {})
+                _store_availability(date, data)
+                return data
             else:
                 logger.warning(f"Endpoint de disponibilidad retornó código {response.status_code}")
                 logger.warning(f"Respuesta: {response.text}")
@@ -819,10 +1147,13 @@ Para información específica, te conectaré con un especialista."""
             if required_slots == 1:
                 return [f"{time} - {self._add_minutes_to_time(time, required_duration)}" for time in times]
             
-            for i in range(len(times) - required_slots + 1):
-                consecutive_times = times[i:i + required_slots]
-                if self._are_consecutive_times(consecutive_times):
-                    start_time = consecutive_times[0]
+            # One sweep over pre-parsed minutes: run = length of the current 30-min chain ending at i
+            minutes = [self._time_to_minutes(time) for time in times]
+            run = 1
+            for i in range(1, len(minutes)):
+                run = run + 1 if minutes[i] - minutes[i - 1] == 30 else 1
+                if run >= required_slots:
+                    start_time = times[i - required_slots + 1]
                     end_time = self._add_minutes_to_time(start_time, required_duration)
                     filtered.append(f"{start_time} - {end_time}")
             
@@ -832,17 +1163,13 @@ Para información específica, te conectaré con un especialista."""
             logger.error(f"Error filtrando slots: {e}")
             return []
     
-    def _are_consecutive_times(self, times):
-        """Verificar si los horarios son consecutivos (diferencia de 30 min)"""
-        for i in range(len(times) - 1):
-            current_minutes = self._time_to_minutes(times[i])
-            next_minutes = self._time_to_minutes(times[i + 1])
-            if next_minutes - current_minutes != 30:
-                return False
-        return True
-    
     def _time_to_minutes(self, time_str):
         """Convertir hora a minutos desde medianoche"""
+        minutes = _HHMM_TO_MINUTES.get(time_str)
+        if minutes is not None:
+            return minutes
+        
+        # Slow path for anything that isn't canonical HH:MM (e.g. "9:00", padded strings)
         try:
             time_clean = time_str.strip()
             if ':' in time_clean:
@@ -857,10 +1184,7 @@ Para información específica, te conectaré con un especialista."""
     def _add_minutes_to_time(self, time_str, minutes_to_add):
         """Sumar minutos a una hora y retornar en formato HH:MM"""
         try:
-            total_minutes = self._time_to_minutes(time_str) + minutes_to_add
-            hours = (total_minutes // 60) % 24
-            minutes = total_minutes % 60
-            return f"{hours:02d}:{minutes:02d}"
+            return _HHMM[(self._time_to_minutes(time_str) + minutes_to_add) % 1440]
         except:
             return time_str
     
@@ -877,9 +1201,9 @@ Para información específica, te conectaré con un especialista."""
         try:
             logger.info(f"Llamando a microservicio local en: {self.schedule_service_url}")
             
-            response = requests.post(
+            response = _schedule_session.post(
                 f"{self.schedule_service_url}/schedule-request",
-                json={
+                data=orjson.dumps({
                     "message": question,
                     "user_id": user_id,
                     "chat_history": [
@@ -888,14 +1212,16 @@ Para información específica, te conectaré con un especialista."""
                             "type": getattr(msg, 'type', 'user')
                         } for msg in chat_history
                     ]
-                },
+                }),
+                headers={"Content-Type": "application/json"},
                 timeout=self.selenium_timeout
             )
             
             if response.status_code == 200:
-                result = response.json()
+                result = orjson.loads(response.content)
                 
                 if result.get('success') and result.get('appointment_data'):
+                    _invalidate_availability(result.get('appointment_data'))
                     self._notify_appointment_success(user_id, result.get('appointment_data'))
                 
                 logger.info(f"Respuesta exitosa del microservicio local: {result.get('success', False)}")
@@ -923,117 +1249,102 @@ Para información específica, te conectaré con un especialista."""
     
     def _contains_schedule_intent(self, question: str) -> bool:
         """Detectar si la pregunta contiene intención de agendamiento"""
-        schedule_keywords = [
-            "agendar", "reservar", "programar", "cita", "appointment",
-            "agenda", "disponibilidad", "horario", "fecha", "hora",
-            "procede", "proceder", "confirmar cita"
-        ]
-        return any(keyword in question.lower() for keyword in schedule_keywords)
+        return _SCHEDULE_INTENT_RE.search(question) is not None
     
     def _has_available_slots_confirmation(self, availability_response: str) -> bool:
         """Verificar si la respuesta de disponibilidad contiene slots válidos"""
-        if not availability_response:
+        if not availability_response or _SLOTS_NEGATIVE_RE.search(availability_response):
             return False
         
-        availability_lower = availability_response.lower()
-        
-        text_indicators = [
-            "horarios disponibles",
-            "disponible para"
-        ]
-        
-        has_text_indicators = any(indicator in availability_lower for indicator in text_indicators)
-        has_list_format = "- " in availability_response
-        has_time_format = ":" in availability_response and "-" in availability_response
-        
-        negative_indicators = [
-            "no hay horarios disponibles",
-            "no hay disponibilidad", 
-            "error consultando disponibilidad"
-        ]
-        
-        has_negative = any(indicator in availability_lower for indicator in negative_indicators)
-        has_positive = has_text_indicators or has_list_format or has_time_format
-        
-        return has_positive and not has_negative
+        # Text indicators and list bullets in one pass; "HH:MM - HH:MM" ranges need both characters
+        return (
+            _SLOTS_POSITIVE_RE.search(availability_response) is not None
+            or (":" in availability_response and "-" in availability_response)
+        )
     
     def _is_just_availability_check(self, question: str) -> bool:
         """Determinar si solo se está consultando disponibilidad sin agendar"""
-        availability_only_keywords = [
-            "disponibilidad para", "horarios disponibles", "qué horarios",
-            "cuándo hay", "hay disponibilidad", "ver horarios"
-        ]
-        
-        schedule_confirmation_keywords = [
-            "agendar", "reservar", "procede", "proceder", "confirmar",
-            "quiero la cita", "agenda la cita"
-        ]
-        
-        has_availability_check = any(keyword in question.lower() for keyword in availability_only_keywords)
-        has_schedule_confirmation = any(keyword in question.lower() for keyword in schedule_confirmation_keywords)
-        
-        return has_availability_check and not has_schedule_confirmation
+        return (
+            _AVAILABILITY_ONLY_RE.search(question) is not None
+            and _SCHEDULE_CONFIRM_RE.search(question) is None
+        )
     
     def _should_use_selenium(self, question: str, chat_history: list) -> bool:
         """Determinar si se debe usar el microservicio de Selenium"""
-        question_lower = question.lower()
-        
-        schedule_keywords = [
-            "agendar", "reservar", "programar", "cita", "appointment",
-            "agenda", "disponibilidad", "horario", "fecha", "hora"
-        ]
-        
-        has_schedule_intent = any(keyword in question_lower for keyword in schedule_keywords)
-        has_patient_info = self._extract_patient_info_from_history(chat_history)
+        if _SCHEDULE_KW_RE.search(question) is None:
+            return False
         
-        return has_schedule_intent and (has_patient_info or self._has_complete_info_in_message(question))
+        return (self._extract_patient_info_from_history(chat_history)
+                or self._has_complete_info_in_message(question))
     
     def _extract_patient_info_from_history(self, chat_history: list) -> bool:
-        """Extraer información del paciente del historial"""
-        history_text = " ".join([msg.content if hasattr(msg, 'content') else str(msg) for msg in chat_history])
+        """Extraer información del paciente del historial (más reciente primero, sale al completar)"""
+        if len(chat_history) < 2:
+            return False
         
-        has_name = any(word in history_text.lower() for word in ["nombre", "llamo", "soy"])
-        has_phone = any(char.isdigit() for char in history_text) and len([c for c in history_text if c.isdigit()]) >= 7
-        has_date = any(word in history_text.lower() for word in ["fecha", "día", "mañana", "hoy"])
+        has_name = has_date = False
+        phone_digits = 0
+        for msg in reversed(chat_history):
+            text = msg.content if hasattr(msg, 'content') else str(msg)
+            has_name = has_name or _NAME_KW_RE.search(text) is not None
+            has_date = has_date or _DATE_KW_RE.search(text) is not None
+            phone_digits += _digit_count(text)
+            if has_name and (phone_digits >= 7 or has_date):
+                return True
         
-        return has_name and (has_phone or has_date)
+        return False
     
     def _has_complete_info_in_message(self, message: str) -> bool:
         """Verificar si el mensaje tiene información completa"""
-        message_lower = message.lower()
-        
-        has_name_indicator = any(word in message_lower for word in ["nombre", "llamo", "soy"])
-        has_phone_indicator = any(char.isdigit() for char in message) and len([c for c in message if c.isdigit()]) >= 7
-        has_date_indicator = any(word in message_lower for word in ["fecha", "día", "mañana", "hoy"])
+        has_name_indicator = _NAME_KW_RE.search(message) is not None
+        has_phone_indicator = _digit_count(message) >= 7
+        has_date_indicator = _DATE_KW_RE.search(message) is not None
         
         return has_name_indicator and has_phone_indicator and has_date_indicator
     
     def _notify_appointment_success(self, user_id: str, appointment_data: Dict[str, Any]):
-        """Notificar al sistema principal sobre cita exitosa"""
+        """Notificar al sistema principal sobre cita exitosa (en segundo plano)"""
+        main_system_url = os.getenv('MAIN_SYSTEM_URL')
+        if main_system_url:
+            _notify_pool.submit(self._do_notify, main_system_url, user_id, appointment_data)
+    
+    def _do_notify(self, main_system_url: str, user_id: str, appointment_data: Dict[str, Any]):
         try:
-            main_system_url = os.getenv('MAIN_SYSTEM_URL')
-            if main_system_url:
-                requests.post(
-                    f"{main_system_url}/appointment-notification",
-                    json={
-                        "user_id": user_id,
-                        "event": "appointment_scheduled",
-                        "data": appointment_data
-                    },
-                    timeout=5
-                )
-                logger.info(f"Notificación enviada al sistema principal para usuario {user_id}")
+            _schedule_session.post(
+                f"{main_system_url}/appointment-notification",
+                data=orjson.dumps({
+                    "user_id": user_id,
+                    "event": "appointment_scheduled",
+                    "data": appointment_data
+                }),
+                headers={"Content-Type": "application/json"},
+                timeout=5
+            )
+            logger.info(f"Notificación enviada al sistema principal para usuario {user_id}")
         except Exception as e:
             logger.error(f"Error notificando cita exitosa: {e}")
     
     def _might_need_rag(self, question: str) -> bool:
         """Determina si una consulta podría necesitar RAG basado en keywords"""
-        rag_keywords = [
-            "precio", "costo", "inversión", "duración", "tiempo", 
-            "tratamiento", "procedimiento", "servicio", "beneficio",
-            "horario", "disponibilidad", "agendar", "cita", "información"
-        ]
-        return any(keyword in question.lower() for keyword in rag_keywords)
+        return _RAG_KW_RE.search(question) is not None
+    
+    def _rag_context(self, question: str) -> str:
+        """Contexto RAG unido; se reutiliza mientras el índice no cambie"""
+        key = (get_index_generation(), _question_key(question))
+        with _rag_context_lock:
+            context = _rag_context_cache.get(key)
+        if context is not None:
+            return context
+        
+        self._log_retriever_usage(question, [])
+        docs = self.vectorstore_service.similarity_search_batched(question)
+        self._log_retriever_usage(question, docs)
+        
+        context = "\n\n".join(doc.page_content for doc in docs)
+        if context:
+            with _rag_context_lock:
+                _rag_context_cache[key] = context
+        return context
     
     def _log_retriever_usage(self, question: str, docs: List) -> None:
         """Log detallado del uso del retriever"""
@@ -1058,22 +1369,13 @@ Para información específica, te conectaré con un especialista."""
     
     def _determine_agent_used(self, response: str) -> str:
         """Determinar qué agente se utilizó basado en la respuesta"""
-        if "Escalando tu caso de emergencia" in response:
-            return "emergency"
-        elif "¿Te gustaría agendar tu cita?" in response:
-            return "sales"
-        elif "Procesando tu solicitud de agenda" in response:
-            return "schedule"
-        elif "Te conectaré con un especialista" in response:
-            return "support"
-        else:
-            return "support"
+        best = min((m.lastindex for m in _AGENT_SIGNATURE_RE.finditer(response)), default=None)
+        return _AGENT_SIGNATURE_LABELS[best - 1] if best else "support"
 
     def search_documents(self, query: str, k: int = 3):
         """Search documents using vectorstore - compatibility method"""
         try:
-            docs = self.retriever.invoke(query)
-            return docs
+            return self.vectorstore_service.similarity_search_batched(query)
         except Exception as e:
             logger.error(f"Error searching documents: {e}")
             return []
@@ -1,35 +1,48 @@
 # app/services/multimedia_service.py
 
-import os
-import tempfile
 import requests
+from requests.adapters import HTTPAdapter
 import base64
 from io import BytesIO
-from openai import OpenAI
+from app.services.openai_service import get_openai_service
+from app.utils.helpers import audio_upload_extension
 from typing import Optional
-from flask import current_app
 import logging
 
 # FIXED: Remove app.core imports that don't exist in modular structure
 logger = logging.getLogger(__name__)
 
+# Keep-alive session for media downloads (shared across requests)
+_download_session = requests.Session()
+_download_adapter = HTTPAdapter(pool_connections=10, pool_maxsize=50)
+_download_session.mount('http://', _download_adapter)
+_download_session.mount('https://', _download_adapter)
+
 
 class MultimediaService:
     def __init__(self):
-        # FIXED: Use current_app.config instead of app.core.config
-        self.client = OpenAI(api_key=current_app.config['OPENAI_API_KEY'])
+        # Reuse the app-wide OpenAI client (and its keep-alive pool) instead of building one per instance
+        self.client = get_openai_service().client
     
-    def transcribe_audio(self, audio_path: str) -> str:
-        """Transcribe audio to text using Whisper with Spanish language (EXACTLY like monolith)"""
+    def transcribe_audio(self, audio_path) -> str:
+        """Transcribe audio to text using Whisper with Spanish language (file path or named file-like object)"""
         try:
-            with open(audio_path, "rb") as audio_file:
-                # FIXED: Add language="es" like in monolith
+            if hasattr(audio_path, 'read'):
                 transcript = self.client.audio.transcriptions.create(
                     model="whisper-1",
-                    file=audio_file,
-                    language="es",  # MISSING in modular - NOW ADDED
+                    file=audio_path,
+                    language="es",
                     response_format="text"
                 )
+            else:
+                with open(audio_path, "rb") as audio_file:
+                    # FIXED: Add language="es" like in monolith
+                    transcript = self.client.audio.transcriptions.create(
+                        model="whisper-1",
+                        file=audio_file,
+                        language="es",  # MISSING in modular - NOW ADDED
+                        response_format="text"
+                    )
             
             return transcript.text if hasattr(transcript, 'text') else str(transcript)
             
@@ -46,7 +59,7 @@ class MultimediaService:
                 'Accept': 'audio/*,*/*;q=0.9'
             }
             
-            response = requests.get(audio_url, headers=headers, timeout=60, stream=True)
+            response = _download_session.get(audio_url, headers=headers, timeout=60)
             response.raise_for_status()
             
             # Verify content-type if available
@@ -54,34 +67,16 @@ class MultimediaService:
             logger.info(f"Audio content-type: {content_type}")
             
             # Determine extension based on content-type or URL
-            extension = '.ogg'  # Default for Chatwoot
-            if 'mp3' in content_type or audio_url.endswith('.mp3'):
-                extension = '.mp3'
-            elif 'wav' in content_type or audio_url.endswith('.wav'):
-                extension = '.wav'
-            elif 'm4a' in content_type or audio_url.endswith('.m4a'):
-                extension = '.m4a'
-            
-            # Create temporary file with correct extension
-            with tempfile.NamedTemporaryFile(delete=False, suffix=extension) as temp_file:
-                for chunk in response.iter_content(chunk_size=8192):
-                    temp_file.write(chunk)
-                temp_path = temp_file.name
-            
-            logger.info(f"Audio saved to temp file: {temp_path} (size: {os.path.getsize(temp_path)} bytes)")
-            
-            try:
-                result = self.transcribe_audio(temp_path)
-                logger.info(f"Transcription successful: {len(result)} characters")
-                return result
-                
-            finally:
-                # Clean up temporary file
-                try:
-                    os.unlink(temp_path)
-                    logger.info(f"Temporary file deleted: {temp_path}")
-                except Exception as cleanup_error:
-                    logger.warning(f"Could not delete temp file {temp_path}: {cleanup_error}")
+            extension = audio_upload_extension(content_type, audio_url)
+            
+            # Upload straight from memory; the name only tells Whisper the format
+            audio_file = BytesIO(response.content)
+            audio_file.name = f"audio{extension}"
+            logger.info(f"Audio downloaded ({len(response.content)} bytes)")
+            
+            result = self.transcribe_audio(audio_file)
+            logger.info(f"Transcription successful: {len(result)} characters")
+            return result
             
         except requests.exceptions.RequestException as e:
             logger.error(f"Error downloading audio: {e}")
@@ -93,8 +88,9 @@ class MultimediaService:
     def analyze_image(self, image_file) -> str:
         """Analyze image using GPT-4 Vision (EXACTLY like monolith)"""
         try:
-            # Convert image to base64
-            image_data = base64.b64encode(image_file.read()).decode('utf-8')
+            # Convert image to base64 (raw bytes are used as-is, no extra copy)
+            raw = image_file if isinstance(image_file, (bytes, bytearray, memoryview)) else image_file.read()
+            image_data = base64.b64encode(raw).decode('ascii')
             
             # Use correct v1.x syntax
             response = self.client.chat.completions.create(
@@ -134,7 +130,7 @@ class MultimediaService:
             headers = {
                 'User-Agent': 'Mozilla/5.0 (compatible; ChatbotImageAnalyzer/1.0)'
             }
-            response = requests.get(image_url, headers=headers, timeout=30)
+            response = _download_session.get(image_url, headers=headers, timeout=30)
             response.raise_for_status()
             
             # Verify it's an image
@@ -142,11 +138,8 @@ class MultimediaService:
             if not any(img_type in content_type for img_type in ['image/', 'jpeg', 'png', 'gif', 'webp']):
                 logger.warning(f"Content type might not be image: {content_type}")
             
-            # Create file in memory
-            image_file = BytesIO(response.content)
-            
-            # Analyze using existing function
-            return self.analyze_image(image_file)
+            # Analyze the downloaded bytes directly
+            return self.analyze_image(response.content)
             
         except requests.exceptions.RequestException as e:
             logger.error(f"Error downloading image: {e}")
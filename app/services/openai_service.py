@@ -1,16 +1,149 @@
-from openai import OpenAI
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from openai import OpenAI, AsyncOpenAI
+import httpx
+import asyncio
+import weakref
+from langchain_core.embeddings import Embeddings
 from flask import current_app
+from app.services.redis_service import get_redis_client
+from app.utils.helpers import extract_file_extension
 import requests
-import tempfile
+from requests.adapters import HTTPAdapter
 import os
 import logging
-from typing import Optional, Dict, Any
-from PIL import Image
+from typing import Optional, Dict, Any, List
 import io
+import base64
+import hashlib
+from array import array
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 logger = logging.getLogger(__name__)
 
+# Keep-alive session for media downloads (shared across requests)
+_download_session = requests.Session()
+_download_adapter = HTTPAdapter(pool_connections=10, pool_maxsize=50)
+_download_session.mount('http://', _download_adapter)
+_download_session.mount('https://', _download_adapter)
+
+IMAGE_PROMPT = "Describe esta imagen en detalle en español, enfocándote en aspectos relevantes para un centro estético."
+
+# Largest side worth sending to the vision model; bigger photos only cost upload time
+VISION_MAX_SIDE = 1024
+
+
+def _shrink_image(image_data: bytes):
+    """Downscale to VISION_MAX_SIDE and re-encode as JPEG q85; returns (bytes, max side, MIME type).
+    Images already within VISION_MAX_SIDE are returned untouched."""
+    try:
+        from PIL import Image  # only image requests pay for Pillow
+        
+        img = Image.open(io.BytesIO(image_data))
+        original_size = img.size
+        img.thumbnail((VISION_MAX_SIDE, VISION_MAX_SIDE), Image.LANCZOS)
+        if img.size == original_size:
+            return image_data, max(img.size), Image.MIME.get(img.format, "image/jpeg")
+        
+        if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+            # JPEG has no alpha: flatten onto white so transparent areas don't turn black
+            img = img.convert('RGBA')
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel('A'))
+            img = background
+        out = io.BytesIO()
+        img.convert('RGB').save(out, 'JPEG', quality=85, optimize=True)
+        return out.getvalue(), max(img.size), "image/jpeg"
+    except Exception as e:
+        logger.warning(f"Could not downscale image, sending original: {e}")
+        return image_data, None, "image/jpeg"
+
+
+def _read_bytes(source):
+    """Raw bytes from bytes, a file-like object or a path (bytes are used as-is, no extra copy)"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return source
+    if hasattr(source, 'read'):
+        return source.read()
+    with open(source, 'rb') as f:
+        return f.read()
+
+
+def _image_data_url(image_data) -> tuple:
+    """Shrink and base64-encode image bytes; returns (data URL, vision detail level)"""
+    # Shrink before encoding: base64 of a raw phone photo dominates the request
+    image_data, max_side, mime_type = _shrink_image(image_data)
+    detail = "low" if max_side is not None and max_side <= 512 else "auto"
+    return f"data:{mime_type};base64," + base64.b64encode(image_data).decode('ascii'), detail
+
+
+def _vision_messages(image_url: str, detail: Optional[str] = None) -> list:
+    image = {"url": image_url}
+    if detail:
+        image["detail"] = detail
+    return [
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": IMAGE_PROMPT},
+                {"type": "image_url", "image_url": image}
+            ]
+        }
+    ]
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that keeps document vectors in Redis, keyed by model and text.
+    Queries are never cached (embed_query passes through), so user traffic can't grow the cache.
+    Entries are a float32 copy next to the indexed vector, so the TTL only spans an ingest and its retries."""
+    
+    def __init__(self, embeddings: Embeddings, redis_client, model: str, ttl: int):
+        self.embeddings = embeddings
+        self.redis_client = redis_client
+        self.model = model
+        self.ttl = ttl
+    
+    def _key(self, text: str) -> str:
+        digest = hashlib.sha256((self.model + text).encode("utf-8")).hexdigest()
+        return f"emb64:{self.model}:{digest}"
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        
+        keys = [self._key(text) for text in texts]
+        try:
+            cached = self.redis_client.mget(keys)
+        except Exception as e:
+            logger.warning(f"Embedding cache unavailable, embedding without it: {e}")
+            return self.embeddings.embed_documents(texts)
+        
+        vectors = [array('f', base64.b64decode(raw)).tolist() if raw else None for raw in cached]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if not missing:
+            return vectors
+        
+        # Repeated texts in one call go to the API once
+        unique = list(dict.fromkeys(texts[i] for i in missing))
+        fresh = dict(zip(unique, self.embeddings.embed_documents(unique)))
+        for i in missing:
+            vectors[i] = fresh[texts[i]]
+        
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for text, vector in fresh.items():
+                # float32 bytes, base64'd for the shared decode_responses client
+                pipe.setex(self._key(text), self.ttl, base64.b64encode(array('f', vector).tobytes()).decode('ascii'))
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Could not store embeddings in cache: {e}")
+        
+        return vectors
+    
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+
 def init_openai(app):
     """Initialize OpenAI configuration"""
     try:
@@ -18,17 +151,27 @@ def init_openai(app):
         if not api_key:
             raise ValueError("OPENAI_API_KEY not found in configuration")
         
-        # Test connection
-        client = OpenAI(api_key=api_key)
-        # Simple test call
-        client.models.list()
+        # Shared service (and its pooled HTTP client) for the whole app
+        service = OpenAIService()
+        
+        # Test connection over the same client the app will use
+        service.client.models.list()
         
         logger.info("✅ OpenAI connection successful")
+        
+        app.extensions['openai_service'] = service
         return True
     except Exception as e:
         logger.error(f"❌ OpenAI initialization failed: {e}")
         raise
 
+def get_openai_service() -> "OpenAIService":
+    """Get the app-wide OpenAIService, creating it on first use"""
+    service = current_app.extensions.get('openai_service')
+    if service is None:
+        service = current_app.extensions['openai_service'] = OpenAIService()
+    return service
+
 class OpenAIService:
     """Service for OpenAI API interactions"""
     
@@ -36,30 +179,146 @@ class OpenAIService:
         self.api_key = current_app.config['OPENAI_API_KEY']
         self.model_name = current_app.config.get('MODEL_NAME', 'gpt-4.1-mini-2025-04-14')
         self.embedding_model = current_app.config.get('EMBEDDING_MODEL', 'text-embedding-3-small')
+        self.embedding_batch_size = current_app.config.get('EMBEDDING_BATCH_SIZE', 512)
+        self.embedding_cache_ttl = current_app.config.get('EMBEDDING_CACHE_TTL', 3600)
+        self.redis_url = current_app.config.get('REDIS_URL')
         self.max_tokens = current_app.config.get('MAX_TOKENS', 1500)
         self.temperature = current_app.config.get('TEMPERATURE', 0.7)
         
-        self.client = OpenAI(api_key=self.api_key)
+        # One keep-alive HTTP/2 pool shared by the raw SDK client and the LangChain models:
+        # concurrent completions multiplex over a few TLS connections instead of opening new ones
+        self._http_client = httpx.Client(
+            http2=True,
+            timeout=60,
+            limits=httpx.Limits(max_keepalive_connections=100, max_connections=200)
+        )
+        self.client = OpenAI(api_key=self.api_key, http_client=self._http_client)
+        # httpx async pools are bound to the loop that opened them: one async client per event loop
+        self._async_http = weakref.WeakKeyDictionary()
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._chat_model = None
+        self._embeddings = None
+        self._query_embeddings = None
         
         # Voice and image enabled flags
         self.voice_enabled = current_app.config.get('VOICE_ENABLED', False)
         self.image_enabled = current_app.config.get('IMAGE_ENABLED', False)
     
+    def _get_async_http(self) -> httpx.AsyncClient:
+        """Keep-alive AsyncClient for the running event loop (backs async_client)"""
+        loop = asyncio.get_running_loop()
+        http = self._async_http.get(loop)
+        if http is None:
+            http = self._async_http[loop] = httpx.AsyncClient(
+                http2=True,
+                follow_redirects=True,
+                limits=httpx.Limits(max_keepalive_connections=20, max_connections=100)
+            )
+        return http
+    
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        """AsyncOpenAI client for the running event loop (call from inside the loop)"""
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = self._async_clients[loop] = AsyncOpenAI(
+                api_key=self.api_key,
+                http_client=self._get_async_http()
+            )
+        return client
+    
     def get_chat_model(self):
-        """Get LangChain ChatOpenAI model"""
-        return ChatOpenAI(
-            api_key=self.api_key,
-            model=self.model_name,
-            max_tokens=self.max_tokens,
-            temperature=self.temperature
-        )
+        """Get LangChain ChatOpenAI model (built once per service)"""
+        if self._chat_model is None:
+            from langchain_openai import ChatOpenAI
+            
+            self._chat_model = ChatOpenAI(
+                api_key=self.api_key,
+                model=self.model_name,
+                max_tokens=self.max_tokens,
+                temperature=self.temperature,
+                http_client=self._http_client
+            )
+        return self._chat_model
     
     def get_embeddings(self):
-        """Get LangChain OpenAI embeddings"""
-        return OpenAIEmbeddings(
-            api_key=self.api_key,
-            model=self.embedding_model
-        )
+        """Get LangChain OpenAI embeddings, document vectors Redis-cached per text (built once per service)"""
+        if self._embeddings is None:
+            from langchain_openai import OpenAIEmbeddings
+            
+            embeddings = OpenAIEmbeddings(
+                api_key=self.api_key,
+                model=self.embedding_model,
+                chunk_size=self.embedding_batch_size,
+                max_retries=3,
+                request_timeout=30,
+                http_client=self._http_client
+            )
+            self._query_embeddings = embeddings
+            if self.redis_url:
+                embeddings = CachedEmbeddings(
+                    embeddings,
+                    get_redis_client(),
+                    self.embedding_model,
+                    self.embedding_cache_ttl
+                )
+            self._embeddings = embeddings
+        return self._embeddings
+    
+    def get_query_embeddings(self):
+        """Uncached embeddings for search queries (same model and HTTP pool as get_embeddings)"""
+        self.get_embeddings()
+        return self._query_embeddings
+    
+    def embed_documents_batched(self, texts: list, batch_size: Optional[int] = None) -> list:
+        """Embed many texts through LangChain, one request per batch_size texts"""
+        batch_size = batch_size or self.embedding_batch_size
+        embeddings = self.get_embeddings()
+        vectors = []
+        for start in range(0, len(texts), batch_size):
+            vectors.extend(embeddings.embed_documents(texts[start:start + batch_size]))
+        return vectors
+    
+    def embed_concurrent(self, texts: list, batch_size: Optional[int] = None, max_inflight: int = 5) -> list:
+        """Embed many texts with up to max_inflight batch requests in flight; order is preserved"""
+        results = [None] * len(texts)
+        for offset, vectors, error in self.iter_embed_concurrent(texts, batch_size, max_inflight):
+            if error is not None:
+                raise error
+            results[offset:offset + len(vectors)] = vectors
+        return results
+    
+    def iter_embed_concurrent(self, texts: list, batch_size: Optional[int] = None, max_inflight: int = 5):
+        """Like embed_concurrent, but yield (offset, vectors, error) for each batch as it completes,
+        so the caller can use a batch while later ones are still in flight"""
+        if not texts:
+            return
+        batch_size = batch_size or self.embedding_batch_size
+        if len(texts) <= batch_size:
+            try:
+                vectors = self.embed_documents_batched(texts, batch_size)
+            except Exception as e:
+                yield 0, None, e
+            else:
+                yield 0, vectors, None
+            return
+        
+        embeddings = self.get_embeddings()
+        
+        def embed_batch(batch):
+            # Small jitter so the first wave of batches doesn't hit the rate limiter at once
+            time.sleep(random.uniform(0, 0.05))
+            return embeddings.embed_documents(batch)
+        
+        with ThreadPoolExecutor(max_workers=max_inflight, thread_name_prefix="embed") as executor:
+            futures = {
+                executor.submit(embed_batch, texts[offset:offset + batch_size]): offset
+                for offset in range(0, len(texts), batch_size)
+            }
+            for future in as_completed(futures):
+                error = future.exception()
+                yield futures[future], (None if error else future.result()), error
     
     def test_connection(self):
         """Test OpenAI connection"""
@@ -101,18 +360,25 @@ class OpenAIService:
             logger.error(f"Error generating OpenAI response: {e}")
             raise
     
-    def transcribe_audio(self, audio_file_path: str) -> str:
-        """Transcribe audio file to text"""
+    def transcribe_audio(self, audio_file) -> str:
+        """Transcribe audio to text (file path or named file-like object)"""
         if not self.voice_enabled:
             raise ValueError("Voice processing is not enabled")
         
         try:
-            with open(audio_file_path, "rb") as audio_file:
+            if hasattr(audio_file, 'read'):
                 response = self.client.audio.transcriptions.create(
                     model="whisper-1",
                     file=audio_file,
                     language="es"
                 )
+            else:
+                with open(audio_file, "rb") as f:
+                    response = self.client.audio.transcriptions.create(
+                        model="whisper-1",
+                        file=f,
+                        language="es"
+                    )
             
             logger.info(f"Audio transcribed successfully: {len(response.text)} chars")
             return response.text
@@ -126,33 +392,19 @@ class OpenAIService:
         if not self.voice_enabled:
             raise ValueError("Voice processing is not enabled")
         
-        temp_path = None
         try:
             # Download audio file
-            response = requests.get(audio_url, timeout=30)
+            response = _download_session.get(audio_url, timeout=30)
             response.raise_for_status()
             
-            # Save to temporary file
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.mp3') as temp_file:
-                temp_file.write(response.content)
-                temp_path = temp_file.name
-            
-            # Transcribe
-            result = self.transcribe_audio(temp_path)
-            return result
+            # Transcribe straight from memory
+            audio_file = io.BytesIO(response.content)
+            audio_file.name = "audio.mp3"
+            return self.transcribe_audio(audio_file)
             
         except Exception as e:
             logger.error(f"Error transcribing audio from URL: {e}")
             raise
-        
-        finally:
-            # Cleanup temp file
-            if temp_path and os.path.exists(temp_path):
-                try:
-                    os.unlink(temp_path)
-                except Exception as cleanup_error:
-                    logger.warning(f"Could not cleanup temp file: {cleanup_error}")
-                
     
     def analyze_image(self, image_file) -> str:
         """Analyze image using OpenAI Vision API"""
@@ -160,36 +412,12 @@ class OpenAIService:
             raise ValueError("Image processing is not enabled")
         
         try:
-            # Read image data
-            if hasattr(image_file, 'read'):
-                image_data = image_file.read()
-            else:
-                with open(image_file, 'rb') as f:
-                    image_data = f.read()
-            
-            # Convert to base64
-            import base64
-            base64_image = base64.b64encode(image_data).decode('utf-8')
+            # Only the data URL is kept; the image bytes aren't held through the API call
+            image_url, detail = _image_data_url(_read_bytes(image_file))
             
             response = self.client.chat.completions.create(
                 model="gpt-4.1-mini-2025-04-14",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": "Describe esta imagen en detalle en español, enfocándote en aspectos relevantes para un centro estético."
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}"
-                                }
-                            }
-                        ]
-                    }
-                ],
+                messages=_vision_messages(image_url, detail),
                 max_tokens=300
             )
             
@@ -207,23 +435,7 @@ class OpenAIService:
         try:
             response = self.client.chat.completions.create(
                 model="gpt-4o-mini",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": "Describe esta imagen en detalle en español, enfocándote en aspectos relevantes para un centro estético."
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": image_url
-                                }
-                            }
-                        ]
-                    }
-                ],
+                messages=_vision_messages(image_url),
                 max_tokens=300
             )
             
@@ -233,8 +445,52 @@ class OpenAIService:
             logger.error(f"Error analyzing image from URL: {e}")
             raise
     
-    def text_to_speech(self, text: str) -> str:
-        """Convert text to speech and return file path"""
+    async def atranscribe_audio(self, audio_file) -> str:
+        """Async transcribe_audio (named file-like object, or path read off-loop)"""
+        if not self.voice_enabled:
+            raise ValueError("Voice processing is not enabled")
+        
+        try:
+            if not hasattr(audio_file, 'read'):
+                path = audio_file
+                audio_file = io.BytesIO(await asyncio.to_thread(_read_bytes, path))
+                audio_file.name = os.path.basename(path)
+            
+            response = await self.async_client.audio.transcriptions.create(
+                model="whisper-1",
+                file=audio_file,
+                language="es"
+            )
+            
+            logger.info(f"Audio transcribed successfully: {len(response.text)} chars")
+            return response.text
+            
+        except Exception as e:
+            logger.error(f"Error transcribing audio: {e}")
+            raise
+    
+    async def aanalyze_image(self, image_file) -> str:
+        """Async analyze_image; decoding/resizing runs in a worker thread"""
+        if not self.image_enabled:
+            raise ValueError("Image processing is not enabled")
+        
+        try:
+            image_url, detail = await asyncio.to_thread(lambda: _image_data_url(_read_bytes(image_file)))
+            
+            response = await self.async_client.chat.completions.create(
+                model="gpt-4.1-mini-2025-04-14",
+                messages=_vision_messages(image_url, detail),
+                max_tokens=300
+            )
+            
+            return response.choices[0].message.content
+            
+        except Exception as e:
+            logger.error(f"Error analyzing image: {e}")
+            raise
+    
+    def text_to_speech_bytes(self, text: str) -> bytes:
+        """Convert text to speech and return the MP3 bytes"""
         if not self.voice_enabled:
             raise ValueError("Voice processing is not enabled")
         
@@ -245,47 +501,29 @@ class OpenAIService:
                 input=text[:1000]  # Limit text length
             )
             
-            # Save to temporary file
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.mp3')
-            temp_file.write(response.content)
-            temp_file.close()
-            
-            logger.info(f"Text-to-speech generated: {temp_file.name}")
-            return temp_file.name
+            return response.content
             
         except Exception as e:
             logger.error(f"Error generating speech: {e}")
             raise
+    
+    def text_to_speech(self, text: str) -> str:
+        """Convert text to speech and return file path (caller removes the file)"""
+        import tempfile
+        
+        audio = self.text_to_speech_bytes(text)
+        
+        with tempfile.NamedTemporaryFile(delete=False, suffix='.mp3') as temp_file:
+            temp_file.write(audio)
+        
+        logger.info(f"Text-to-speech generated: {temp_file.name}")
+        return temp_file.name
 
 
 
     def extract_file_extension(self, url: str, content_type: str = "") -> str:
         """Extract file extension from URL or content type"""
-        content_type_lower = content_type.lower()
-        
-        if 'mp3' in content_type_lower or url.endswith('.mp3'):
-            return '.mp3'
-        elif 'wav' in content_type_lower or url.endswith('.wav'):
-            return '.wav'
-        elif 'm4a' in content_type_lower or url.endswith('.m4a'):
-            return '.m4a'
-        elif 'ogg' in content_type_lower or url.endswith('.ogg'):
-            return '.ogg'
-        elif 'jpeg' in content_type_lower or 'jpg' in content_type_lower:
-            return '.jpg'
-        elif 'png' in content_type_lower or url.endswith('.png'):
-            return '.png'
-        elif 'gif' in content_type_lower or url.endswith('.gif'):
-            return '.gif'
-        elif 'webp' in content_type_lower or url.endswith('.webp'):
-            return '.webp'
-        
-        if 'audio' in content_type_lower:
-            return '.mp3'
-        elif 'image' in content_type_lower:
-            return '.jpg'
-        
-        return ''
+        return extract_file_extension(url, content_type)
     
     def format_file_size(self, size_bytes: int) -> str:
         """Format file size in human readable format"""
@@ -297,16 +535,23 @@ class OpenAIService:
     
     def create_embedding(self, text: str) -> list:
         """Create embedding for text"""
+        return self.create_embeddings([text])[0]
+    
+    def create_embeddings(self, texts: list, batch_size: int = 256) -> list:
+        """Create embeddings for many texts, one API call per batch_size inputs"""
         try:
-            response = self.client.embeddings.create(
-                model=self.embedding_model,
-                input=text
-            )
+            embeddings = []
+            for start in range(0, len(texts), batch_size):
+                response = self.client.embeddings.create(
+                    model=self.embedding_model,
+                    input=texts[start:start + batch_size]
+                )
+                embeddings.extend(d.embedding for d in response.data)
             
-            return response.data[0].embedding
+            return embeddings
             
         except Exception as e:
-            logger.error(f"Error creating embedding: {e}")
+            logger.error(f"Error creating embeddings: {e}")
             raise
 
         
@@ -1,22 +1,40 @@
 import redis
-from flask import current_app, g
+from flask import current_app
 import logging
+import threading
 
 logger = logging.getLogger(__name__)
 
+# One connection pool per process; the client is thread-safe and shared by every request
+_pool = None
+_client = None
+_client_lock = threading.Lock()
+
+def _create_client(app):
+    """Build the shared pool and client from the app config"""
+    global _pool, _client
+    _pool = redis.BlockingConnectionPool.from_url(
+        app.config['REDIS_URL'],
+        max_connections=app.config.get('REDIS_MAX_CONNECTIONS', 50),
+        decode_responses=True,
+        socket_keepalive=True
+    )
+    _client = redis.StrictRedis(connection_pool=_pool)
+    return _client
+
 def get_redis_client():
-    """Get Redis client from Flask g object or create new one"""
-    if 'redis_client' not in g:
-        g.redis_client = redis.from_url(
-            current_app.config['REDIS_URL'], 
-            decode_responses=True
-        )
-    return g.redis_client
+    """Get the shared Redis client (created on first use if init_redis didn't run)"""
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _create_client(current_app)
+    return _client
 
 def init_redis(app):
     """Initialize Redis connection"""
     try:
-        client = redis.from_url(app.config['REDIS_URL'], decode_responses=True)
+        with _client_lock:
+            client = _create_client(app)
         client.ping()
         logger.info("✅ Redis connection successful")
         return client
@@ -25,7 +43,10 @@ def init_redis(app):
         raise
 
 def close_redis(e=None):
-    """Close Redis connection"""
-    client = g.pop('redis_client', None)
-    if client is not None:
-        client.close()
+    """Disconnect the shared pool (process shutdown only; not a per-request teardown)"""
+    global _pool, _client
+    with _client_lock:
+        if _pool is not None:
+            _pool.disconnect()
+        _pool = None
+        _client = None
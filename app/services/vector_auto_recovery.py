@@ -1,8 +1,9 @@
 from app.services.redis_service import get_redis_client
-from app.services.vectorstore_service import VectorstoreService
+from app.services.vectorstore_service import VectorstoreService, reset_index_schema_cache
 from flask import current_app
+from redis.commands.search.query import Query
 import logging
-import json
+import orjson
 import time
 import threading
 from datetime import datetime
@@ -20,6 +21,7 @@ class RedisVectorAutoRecovery:
         self.index_name = index_name
         self.metadata_key = f"__recovery_metadata__{index_name}"
         self.backup_key = f"__backup_docs__{index_name}"
+        self.health_cache_key = f"__health_cache__{index_name}"
         self.documents_pattern = f"{index_name}:*"
         self.health_cache = {"last_check": 0, "status": None}
         self._recovery_lock = threading.Lock()
@@ -29,22 +31,42 @@ class RedisVectorAutoRecovery:
         self.recovery_timeout = current_app.config.get('VECTORSTORE_RECOVERY_TIMEOUT', 60)
         self.auto_recovery_enabled = current_app.config.get('VECTORSTORE_AUTO_RECOVERY', True)
         
+    def is_known_healthy(self) -> bool:
+        """True when the in-process health result is fresh and healthy (no Redis round-trip)"""
+        status = self.health_cache["status"]
+        return (
+            status is not None
+            and status.get("healthy", False)
+            and (time.time() - self.health_cache["last_check"]) < self.health_check_interval
+        )
+    
     def verify_index_health(self) -> Dict[str, Any]:
         """Verificar estado del índice con cache inteligente"""
         current_time = time.time()
         
-        # Cache for health_check_interval seconds
+        # Cache for health_check_interval seconds: process memory first, then Redis (shared by all workers)
         if (current_time - self.health_cache["last_check"]) < self.health_check_interval and self.health_cache["status"]:
             return self.health_cache["status"]
         
         try:
-            # Verificar índice
-            info = self.redis_client.ft(self.index_name).info()
-            doc_count = info.get('num_docs', 0)
+            cached = self.redis_client.get(self.health_cache_key)
+            if cached:
+                health_status = orjson.loads(cached)
+                self.health_cache = {"last_check": health_status.get("timestamp", current_time), "status": health_status}
+                return health_status
+        except Exception as e:
+            logger.warning(f"Could not read shared health cache: {e}")
+        
+        try:
+            # Verificar índice: solo el total de documentos (sin esquema ni estadísticas de FT.INFO)
+            doc_count = self.redis_client.ft(self.index_name).search(Query("*").paging(0, 0)).total
             
-            # Contar documentos almacenados
-            stored_keys = list(self.redis_client.scan_iter(match=self.documents_pattern))
-            stored_count = len(stored_keys)
+            # Contar documentos almacenados: con el índice poblado, el total ya cuenta las claves indexadas;
+            # solo un índice vacío necesita recorrer el keyspace (COUNT alto = pocas vueltas)
+            if doc_count > 0:
+                stored_count = doc_count
+            else:
+                stored_count = sum(1 for _ in self.redis_client.scan_iter(match=self.documents_pattern, count=10000))
             
             health_status = {
                 "index_exists": True,
@@ -56,23 +78,44 @@ class RedisVectorAutoRecovery:
                 "timestamp": current_time
             }
             
-            self.health_cache = {"last_check": current_time, "status": health_status}
+            self._store_health(health_status, current_time)
             return health_status
             
         except Exception as e:
             logger.error(f"Error checking index health: {e}")
+            # Un índice caído con documentos guardados debe poder recuperarse: contarlos
+            stored_count = self._count_stored_documents()
             health_status = {
                 "index_exists": False,
                 "index_functional": False,
-                "stored_documents": 0,
+                "stored_documents": stored_count,
                 "needs_recovery": True,
                 "healthy": False,
                 "error": str(e),
                 "timestamp": current_time
             }
-            self.health_cache = {"last_check": current_time, "status": health_status}
+            # Solo cache local: un error no debe bloquear la recuperación en los demás workers
+            self._store_health(health_status, current_time, shared=False)
             return health_status
     
+    def _store_health(self, health_status: Dict[str, Any], current_time: float, shared: bool = True):
+        """Guardar el estado en el cache local y (si shared) en Redis"""
+        self.health_cache = {"last_check": current_time, "status": health_status}
+        if not shared:
+            return
+        try:
+            self.redis_client.setex(self.health_cache_key, self.health_check_interval, orjson.dumps(health_status))
+        except Exception as e:
+            logger.warning(f"Could not write shared health cache: {e}")
+    
+    def clear_health_cache(self):
+        """Invalidar el cache de salud local y compartido"""
+        self.health_cache = {"last_check": 0, "status": None}
+        try:
+            self.redis_client.delete(self.health_cache_key)
+        except Exception as e:
+            logger.warning(f"Could not clear shared health cache: {e}")
+    
     def reconstruct_index_from_stored_data(self) -> bool:
         """Reconstruir índice desde datos almacenados"""
         if not self.auto_recovery_enabled:
@@ -83,9 +126,10 @@ class RedisVectorAutoRecovery:
             try:
                 logger.info("Starting index reconstruction...")
                 
-                # Obtener documentos almacenados
-                stored_docs = self._get_stored_documents()
-                if not stored_docs:
+                # Contar documentos almacenados (la reconstrucción solo necesita saber cuántos hay;
+                # el índice se recrea sobre los mismos hashes, sin leer su contenido)
+                stored_count = self._count_stored_documents()
+                if not stored_count:
                     logger.warning("No stored documents found")
                     return False
                 
@@ -95,6 +139,7 @@ class RedisVectorAutoRecovery:
                     logger.info("Dropped corrupted index")
                 except:
                     pass
+                reset_index_schema_cache()
                 
                 time.sleep(1)
                 
@@ -104,9 +149,9 @@ class RedisVectorAutoRecovery:
                     vectorstore_service._initialize_vectorstore()
                     
                     # Limpiar cache
-                    self.health_cache = {"last_check": 0, "status": None}
+                    self.clear_health_cache()
                     
-                    logger.info(f"Index reconstructed: {len(stored_docs)} docs available")
+                    logger.info(f"Index reconstructed: {stored_count} docs available")
                     return True
                     
                 except Exception as e:
@@ -117,34 +162,20 @@ class RedisVectorAutoRecovery:
                 logger.error(f"Error in reconstruction: {e}")
                 return False
     
-    def _get_stored_documents(self) -> List[Dict]:
-        """Obtener documentos almacenados"""
+    def _count_stored_documents(self) -> int:
+        """Contar claves de documentos sin cargar sus campos"""
         try:
-            docs = []
-            keys = list(self.redis_client.scan_iter(match=self.documents_pattern))
-            
-            for key in keys:
-                try:
-                    doc_data = self.redis_client.hgetall(key)
-                    if doc_data:
-                        doc = {}
-                        for k, v in doc_data.items():
-                            key_str = k.decode() if isinstance(k, bytes) else k
-                            val_str = v.decode() if isinstance(v, bytes) else v
-                            doc[key_str] = val_str
-                        docs.append(doc)
-                except Exception as e:
-                    logger.warning(f"Error processing document {key}: {e}")
-                    continue
-            
-            return docs
-            
+            return sum(1 for _ in self.redis_client.scan_iter(match=self.documents_pattern, count=10000))
         except Exception as e:
-            logger.error(f"Error getting stored documents: {e}")
-            return []
+            logger.error(f"Error counting stored documents: {e}")
+            return 0
     
     def ensure_index_healthy(self) -> bool:
         """Método principal de recuperación"""
+        # Último chequeo reciente y sano: nada que recuperar, sin tocar Redis
+        if self.is_known_healthy():
+            return True
+        
         try:
             health = self.verify_index_health()
             
@@ -192,8 +223,8 @@ class VectorstoreProtectionMiddleware:
                 
                 def protected_add_texts(texts, metadatas=None, **kwargs):
                     try:
-                        # Verificar salud antes de agregar
-                        if self.auto_recovery.auto_recovery_enabled:
+                        # Verificar salud antes de agregar (salvo que el último chequeo reciente fuera sano)
+                        if self.auto_recovery.auto_recovery_enabled and not self.auto_recovery.is_known_healthy():
                             self.auto_recovery.ensure_index_healthy()
                         
                         result = original_add_texts(texts, metadatas, **kwargs)
@@ -224,8 +255,8 @@ class VectorstoreProtectionMiddleware:
                     
                     def protected_retriever_invoke(input_query, config=None, **kwargs):
                         try:
-                            # Verificar salud antes de buscar
-                            if self.auto_recovery.auto_recovery_enabled:
+                            # Verificar salud antes de buscar; un chequeo reciente y sano se reutiliza tal cual
+                            if self.auto_recovery.auto_recovery_enabled and not self.auto_recovery.is_known_healthy():
                                 health = self.auto_recovery.verify_index_health()
                                 if not health["healthy"] and health["stored_documents"] > 0:
                                     self.auto_recovery.ensure_index_healthy()
@@ -1,16 +1,44 @@
 from langchain_redis import RedisVectorStore
 from langchain.text_splitter import RecursiveCharacterTextSplitter, MarkdownHeaderTextSplitter
+from langchain_core.embeddings import Embeddings
 from app.services.redis_service import get_redis_client
-from app.services.openai_service import OpenAIService
+from app.services.openai_service import get_openai_service
 from flask import current_app
+import atexit
 import logging
-import json
+import multiprocessing
+import orjson
+import os
+import re
 import hashlib
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from dataclasses import dataclass
+from cachetools import TTLCache
 from datetime import datetime
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Tuple, Iterator, Iterable, Optional
+from redis.commands.search.query import Query
+from redis.exceptions import ResponseError
 
 logger = logging.getLogger(__name__)
 
+# Section keywords used to tag chunk metadata (sections are lowercased first);
+# one alternation, the group index is the category and the lowest one present wins
+_SECTION_TYPE_RE = re.compile(r"(funciona|beneficio|detalle)|(precio|oferta|horario)|(contraindicación|cuidado)")
+_SECTION_TYPES = ("general", "específico", "cuidados")
+
+# Text normalization: every whitespace char except \n maps to a space (one C-level translate pass),
+# then runs of spaces, and line breaks with the blank space around them, are collapsed
+_INLINE_WS_TABLE = str.maketrans(dict.fromkeys(
+    "\t\x0b\x0c\r\x1c\x1d\x1e\x1f\x85\xa0\u1680\u2000\u2001\u2002\u2003\u2004\u2005"
+    "\u2006\u2007\u2008\u2009\u200a\u2028\u2029\u202f\u205f\u3000",
+    " "
+))
+_SPACE_RUN_RE = re.compile(r"  +")
+_LINE_BREAK_RE = re.compile(r" ?\n[ \n]*")
+
 def init_vectorstore(app):
     """Initialize vectorstore configuration"""
     try:
@@ -25,31 +53,334 @@ def init_vectorstore(app):
         logger.error(f"❌ Vectorstore initialization failed: {e}")
         raise
 
+# Result handed to a waiting caller to make it the next leader
+_TAKE_LEAD = object()
+
+
+class _EmbeddingBatcher:
+    """Coalesce query embeddings from concurrent requests into one embeddings API call.
+    The leader flushes a single batch that includes its own query, then hands leadership to the
+    oldest waiting caller, so nobody waits on more than the batch in flight plus their own."""
+    
+    def __init__(self, max_wait: float = 0.01, max_batch: int = 16):
+        self.max_wait = max_wait
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._pending: List[Tuple[str, Future]] = []
+        self._leader_active = False
+    
+    def embed(self, embeddings, query: str) -> List[float]:
+        with self._lock:
+            lead = not self._leader_active
+            if lead:
+                self._leader_active = True
+            else:
+                future = Future()
+                self._pending.append((query, future))
+        
+        if lead:
+            # First caller waits briefly for company
+            time.sleep(self.max_wait)
+        else:
+            result = future.result()
+            if result is not _TAKE_LEAD:
+                return result
+        return self._flush(embeddings, query)
+    
+    def _flush(self, embeddings, query: str) -> List[float]:
+        with self._lock:
+            batch = self._pending[:self.max_batch - 1]
+            self._pending = self._pending[self.max_batch - 1:]
+        
+        try:
+            vectors = embeddings.embed_documents([query] + [pending for pending, _ in batch])
+        except Exception as e:
+            self._hand_off()
+            for _, future in batch:
+                future.set_exception(e)
+            raise
+        
+        self._hand_off()
+        for (_, future), vector in zip(batch, vectors[1:]):
+            future.set_result(vector)
+        return vectors[0]
+    
+    def _hand_off(self):
+        with self._lock:
+            if not self._pending:
+                self._leader_active = False
+                return
+            _, successor = self._pending.pop(0)
+        successor.set_result(_TAKE_LEAD)
+
+
+_embedding_batcher = _EmbeddingBatcher()
+
+
+class _PrecomputedEmbeddings(Embeddings):
+    """Embeddings the vectorstore writes through: inside serving(), texts already embedded by the
+    calling thread are answered from memory; everything else goes to the wrapped embeddings"""
+    
+    def __init__(self, embeddings: Embeddings):
+        self.embeddings = embeddings
+        self._local = threading.local()
+    
+    @contextmanager
+    def serving(self, vectors: Dict[str, List[float]]):
+        self._local.vectors = vectors
+        try:
+            yield
+        finally:
+            self._local.vectors = None
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = getattr(self._local, "vectors", None)
+        if not vectors:
+            return self.embeddings.embed_documents(texts)
+        missing = [text for text in texts if text not in vectors]
+        if missing:
+            vectors = {**vectors, **dict(zip(missing, self.embeddings.embed_documents(missing)))}
+        return [vectors[text] for text in texts]
+    
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+# Query embeddings keyed by (model, sha256 of normalized text); repeated questions skip the API
+_query_embedding_cache = TTLCache(maxsize=4096, ttl=3600)
+_query_embedding_lock = threading.Lock()
+
+
+# TAG query syntax characters that must be backslash-escaped in values
+_TAG_ESCAPE_RE = re.compile(r"([,.<>{}\[\]\"':;!@#$%^&*()\-+=~|/\\ ])")
+
+# Field definitions read from the live index via FT.INFO (None until detected)
+_index_attributes = None
+
+# Hash field holding the vector blob (langchain-redis default) and bytes per component by datatype
+_VECTOR_FIELD = "embedding"
+_DATATYPE_BY_WIDTH = {2: "FLOAT16", 4: "FLOAT32", 8: "FLOAT64"}
+
+
+def reset_index_schema_cache():
+    """Forget the cached FT.INFO schema; call whenever the index is dropped or recreated"""
+    global _index_attributes
+    _index_attributes = None
+
+# Keys per UNLINK when deleting vectors
+DELETE_BATCH_SIZE = 512
+
+
+# Bumped on every write so callers can key derived caches on the index contents. It lives in
+# Redis (same key as DocumentChangeTracker's version) so a write in one worker invalidates all of
+# them; each process re-reads it at most every INDEX_GENERATION_TTL seconds.
+INDEX_GENERATION_KEY = "vectorstore_version"
+INDEX_GENERATION_TTL = 2.0
+_index_generation = 0
+_index_generation_read_at = 0.0
+_index_generation_lock = threading.Lock()
+
+
+def get_index_generation() -> int:
+    global _index_generation, _index_generation_read_at
+    now = time.monotonic()
+    if now - _index_generation_read_at < INDEX_GENERATION_TTL:
+        return _index_generation
+    try:
+        value = get_redis_client().get(INDEX_GENERATION_KEY)
+    except Exception as e:
+        logger.warning(f"Could not read index generation: {e}")
+        return _index_generation
+    with _index_generation_lock:
+        _index_generation = int(value) if value else 0
+        _index_generation_read_at = now
+    return _index_generation
+
+
+def _bump_index_generation():
+    global _index_generation, _index_generation_read_at
+    try:
+        generation = get_redis_client().incr(INDEX_GENERATION_KEY)
+    except Exception as e:
+        logger.warning(f"Could not bump index generation: {e}")
+        return
+    with _index_generation_lock:
+        # This process sees its own write immediately
+        _index_generation = generation
+        _index_generation_read_at = time.monotonic()
+
+
+@dataclass(slots=True)
+class _Chunk:
+    """Plain chunk for the fallback splitter (same shape as a langchain Document)"""
+    page_content: str
+    metadata: Dict[str, Any]
+
+
+# Splitting is pure-Python CPU work, so large bulk ingests use processes rather than threads.
+# Below CHUNK_POOL_MIN_CHARS the IPC costs more than it saves.
+CHUNK_POOL_MIN_CHARS = 200_000
+_chunk_pool = None
+_chunk_pool_lock = threading.Lock()
+_worker_chunker = None
+
+
+def _get_chunk_pool() -> ProcessPoolExecutor:
+    global _chunk_pool
+    if _chunk_pool is None:
+        with _chunk_pool_lock:
+            if _chunk_pool is None:
+                # spawn: forking a process that already runs request threads can copy held locks
+                _chunk_pool = ProcessPoolExecutor(
+                    max_workers=min(4, os.cpu_count() or 1),
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+                atexit.register(_chunk_pool.shutdown, wait=False, cancel_futures=True)
+    return _chunk_pool
+
+
+def _chunk_worker(text: str) -> Tuple[List[str], List[Dict[str, Any]]]:
+    # Runs in a pool process: splitters are built on the first call and reused after
+    global _worker_chunker
+    if _worker_chunker is None:
+        _worker_chunker = VectorstoreService._chunker()
+    return _worker_chunker.create_chunks(text)
+
+
+def _doc_index_key(doc_id: str) -> str:
+    # Outside the index prefix so SCANs over vector keys never see it
+    return f"doc_vectors:{doc_id}"
+
+
+def _keys_by_doc(keys: List[str], metadatas: List[Dict[str, Any]]) -> Dict[str, List[str]]:
+    by_doc = {}
+    for key, metadata in zip(keys, metadatas):
+        doc_id = (metadata or {}).get('doc_id')
+        if doc_id:
+            by_doc.setdefault(doc_id, []).append(key)
+    return by_doc
+
+
+def _query_embedding_key(model: str, query: str) -> Tuple[str, str]:
+    return model, hashlib.sha256(query.strip().lower().encode()).hexdigest()
+
 class VectorstoreService:
     """Service for managing vector storage and retrieval"""
     
     def __init__(self):
         self.redis_client = get_redis_client()
-        self.openai_service = OpenAIService()
+        self.openai_service = get_openai_service()
         self.embeddings = self.openai_service.get_embeddings()
+        # Writes go through this so add_texts_batched can hand over vectors it already computed
+        self.write_embeddings = _PrecomputedEmbeddings(self.embeddings)
+        # Search queries skip the document embedding cache
+        self.query_embeddings = self.openai_service.get_query_embeddings()
         self.index_name = "benova_documents"
         self.vector_dim = 1536
+        self._init_splitters()
         self._initialize_vectorstore()
     
+    def _init_splitters(self):
+        """Splitters are stateless across split_text calls; build them once per service"""
+        self._md_splitter = MarkdownHeaderTextSplitter(
+            headers_to_split_on=[
+                ("##", "treatment"),
+                ("###", "detail"),
+            ],
+            strip_headers=False,
+            return_each_line=False
+        )
+        self._fallback_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=1000,
+            chunk_overlap=200,
+            separators=["\n\n", "\n", ". ", " ", ""],
+            length_function=len
+        )
+    
+    @classmethod
+    def _chunker(cls) -> "VectorstoreService":
+        """Instance with only the splitters set up (no Redis/OpenAI), for chunking in worker processes"""
+        service = cls.__new__(cls)
+        service._init_splitters()
+        return service
+    
     def _initialize_vectorstore(self):
         """Initialize the vectorstore"""
         try:
+            # HNSW: approximate KNN in ~O(log N) per query instead of FLAT's full O(N·d) scan.
+            # Only applies when the index is created; an existing FLAT index is reused until rebuilt.
             self.vectorstore = RedisVectorStore(
-                self.embeddings,
+                self.write_embeddings,
                 redis_url=current_app.config['REDIS_URL'],
                 index_name=self.index_name,
-                vector_dim=self.vector_dim
+                vector_dim=self.vector_dim,
+                indexing_algorithm=current_app.config.get('VECTOR_INDEX_ALGORITHM', 'HNSW'),
+                distance_metric="COSINE",
+                vector_datatype=self._vector_datatype(),
+                # doc_id as a TAG lets per-document lookups use the index instead of a keyspace scan
+                metadata_schema=[{"name": "doc_id", "type": "tag"}]
             )
             logger.info("Vectorstore initialized successfully")
         except Exception as e:
             logger.error(f"Error initializing vectorstore: {e}")
             raise
     
+    def _index_attributes(self) -> Optional[Dict[str, Dict[str, Any]]]:
+        """Schema of the live index from FT.INFO (None if the index doesn't exist); read once per process"""
+        global _index_attributes
+        if _index_attributes is not None:
+            return _index_attributes
+        
+        try:
+            info = self.redis_client.ft(self.index_name).info()
+        except ResponseError as e:
+            if "unknown index" in str(e).lower() or "no such index" in str(e).lower():
+                return None
+            raise
+        
+        attributes = {}
+        for attribute in info.get('attributes', []):
+            fields = dict(zip(attribute[::2], attribute[1::2]))
+            attributes[str(fields.get('attribute', fields.get('identifier', '')))] = fields
+        _index_attributes = attributes
+        return attributes
+    
+    def _vector_datatype(self) -> str:
+        """Datatype vectors must be written with.
+        
+        Writes must match the stored width, so an existing index (or stored vectors an index is being
+        rebuilt over) keeps its type. The configured type (FLOAT16 halves vector memory) is only used
+        when there is neither an index nor stored vectors; anything undeterminable is FLOAT32.
+        """
+        try:
+            attributes = self._index_attributes()
+            if attributes is None:
+                return self._stored_vector_datatype() or current_app.config.get('VECTOR_DATATYPE', 'FLOAT16')
+        except Exception as e:
+            logger.warning(f"Could not read index schema, assuming FLOAT32: {e}")
+            return "FLOAT32"
+        
+        for fields in attributes.values():
+            if str(fields.get('type', '')).upper() == 'VECTOR':
+                return str(fields.get('data_type') or 'FLOAT32').upper()
+        return "FLOAT32"
+    
+    def _stored_vector_datatype(self) -> Optional[str]:
+        """Datatype of vectors already stored under the index prefix (from the blob length), if any"""
+        for key in self.redis_client.scan_iter(match=f"{self.index_name}:*", count=1000):
+            # HSTRLEN: byte length without transferring (or decoding) the blob
+            width, remainder = divmod(self.redis_client.hstrlen(key, _VECTOR_FIELD), self.vector_dim)
+            if width and not remainder:
+                return _DATATYPE_BY_WIDTH.get(width, "FLOAT32")
+        return None
+    
+    def _doc_id_indexed(self) -> bool:
+        """True when doc_id is a TAG field of the index (indexes created before it fall back to SCAN)"""
+        try:
+            fields = (self._index_attributes() or {}).get('doc_id')
+        except Exception:
+            return False
+        return bool(fields) and str(fields.get('type', '')).upper() == 'TAG'
+    
     def get_retriever(self, k: int = 3):
         """Get retriever with specified k"""
         return self.vectorstore.as_retriever(search_kwargs={"k": k})
@@ -67,85 +398,157 @@ class VectorstoreService:
         """Search for similar documents"""
         try:
             docs = self.vectorstore.similarity_search(query, k=k)
+            return self._format_results(docs)
+            
+        except Exception as e:
+            logger.error(f"Error searching documents: {e}")
+            raise
+    
+    def batch_search(self, queries: List[str], k: int = 3, max_inflight: int = 8) -> List[List[Dict[str, Any]]]:
+        """Search several queries: one embedding request for all of them, then concurrent KNN lookups"""
+        if not queries:
+            return []
+        try:
+            model = self.openai_service.embedding_model
+            keys = [_query_embedding_key(model, query) for query in queries]
+            with _query_embedding_lock:
+                vectors = [_query_embedding_cache.get(key) for key in keys]
             
-            results = []
-            for doc in docs:
-                results.append({
-                    "content": doc.page_content,
-                    "metadata": getattr(doc, 'metadata', {}),
-                    "score": getattr(doc, 'score', None)
-                })
+            missing = [i for i, vector in enumerate(vectors) if vector is None]
+            if missing:
+                fresh = self.query_embeddings.embed_documents([queries[i] for i in missing])
+                with _query_embedding_lock:
+                    for i, vector in zip(missing, fresh):
+                        vectors[i] = vector
+                        _query_embedding_cache[keys[i]] = vector
             
-            return results
+            if len(vectors) == 1:
+                return [self._format_results(self.vectorstore.similarity_search_by_vector(vectors[0], k=k))]
+            
+            with ThreadPoolExecutor(max_workers=min(max_inflight, len(vectors)), thread_name_prefix="search") as executor:
+                futures = [executor.submit(self.vectorstore.similarity_search_by_vector, vector, k=k) for vector in vectors]
+                return [self._format_results(future.result()) for future in futures]
             
         except Exception as e:
-            logger.error(f"Error searching documents: {e}")
+            logger.error(f"Error in batch search: {e}")
             raise
     
+    @staticmethod
+    def _format_results(docs) -> List[Dict[str, Any]]:
+        return [
+            {
+                "content": doc.page_content,
+                "metadata": getattr(doc, 'metadata', {}),
+                "score": getattr(doc, 'score', None)
+            }
+            for doc in docs
+        ]
+    
+    def similarity_search_batched(self, query: str, k: int = 3):
+        """Retriever-equivalent search whose query embedding is batched with concurrent callers"""
+        key = _query_embedding_key(self.openai_service.embedding_model, query)
+        with _query_embedding_lock:
+            vector = _query_embedding_cache.get(key)
+        
+        if vector is None:
+            vector = _embedding_batcher.embed(self.query_embeddings, query)
+            with _query_embedding_lock:
+                _query_embedding_cache[key] = vector
+        
+        return self.vectorstore.similarity_search_by_vector(vector, k=k)
+    
     def add_texts(self, texts: List[str], metadatas: List[Dict[str, Any]] = None):
         """Add texts to vectorstore"""
         try:
-            self.vectorstore.add_texts(texts, metadatas=metadatas)
+            keys = self.vectorstore.add_texts(texts, metadatas=metadatas)
+            self._index_doc_keys(keys, metadatas)
+            _bump_index_generation()
             logger.info(f"Added {len(texts)} texts to vectorstore")
         except Exception as e:
             logger.error(f"Error adding texts: {e}")
             raise
     
+    def add_texts_batched(self, texts: List[str], metadatas: List[Dict[str, Any]] = None,
+                          batch_size: int = 128, max_inflight: int = 4) -> List[Optional[str]]:
+        """Add many texts, one embedding request per batch_size texts (repeated texts are embedded once).
+        Up to max_inflight embedding batches run concurrently; each batch is written to Redis and
+        reverse-indexed as soon as its vectors land, while later batches are still being embedded.
+        A failed batch doesn't stop the others: returns the vector key of each text, None where its
+        batch could not be stored."""
+        if metadatas is None:
+            metadatas = [{} for _ in texts]
+        keys = [None] * len(texts)
+        for start, vectors, error in self.openai_service.iter_embed_concurrent(texts, batch_size, max_inflight):
+            end = min(start + batch_size, len(texts))
+            batch_keys = []
+            try:
+                if error is not None:
+                    raise error
+                batch = texts[start:end]
+                # The write takes these vectors from memory instead of embedding again
+                with self.write_embeddings.serving(dict(zip(batch, vectors))):
+                    batch_keys = self.vectorstore.add_texts(batch, metadatas=metadatas[start:end]) or []
+                self._index_doc_keys(batch_keys, metadatas[start:end])
+                keys[start:start + len(batch_keys)] = batch_keys
+            except Exception as e:
+                logger.error(f"Error adding texts {start}-{end}: {e}")
+                if batch_keys:
+                    # Written but not reverse-indexed: don't leave vectors no document can find
+                    self.discard_texts(batch_keys, metadatas[start:end])
+        
+        added = sum(key is not None for key in keys)
+        if added:
+            _bump_index_generation()
+        logger.info(f"Added {added}/{len(texts)} texts to vectorstore in batches of {batch_size}")
+        return keys
+    
+    def discard_texts(self, keys: List[str], metadatas: List[Dict[str, Any]]):
+        """Undo part of an add: delete these vectors and drop them from their documents' reverse index"""
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for doc_id, doc_keys in _keys_by_doc(keys, metadatas).items():
+                pipe.srem(_doc_index_key(doc_id), *doc_keys)
+            pipe.execute()
+            self.delete_vectors(keys)
+        except Exception as e:
+            logger.error(f"Error discarding {len(keys)} vectors: {e}")
+    
+    def _index_doc_keys(self, keys: List[str], metadatas: List[Dict[str, Any]] = None):
+        """Record each new vector key in its document's reverse-index set (doc_vectors:{doc_id})"""
+        if not keys or not metadatas:
+            return
+        by_doc = _keys_by_doc(keys, metadatas)
+        if by_doc:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for doc_id, doc_keys in by_doc.items():
+                pipe.sadd(_doc_index_key(doc_id), *doc_keys)
+            pipe.execute()
+    
     def create_chunks(self, text: str) -> Tuple[List[str], List[Dict[str, Any]]]:
         """Create chunks from text with advanced splitting"""
         try:
-            # Create splitters
-            markdown_splitter = MarkdownHeaderTextSplitter(
-                headers_to_split_on=[
-                    ("##", "treatment"),
-                    ("###", "detail"),
-                ],
-                strip_headers=False,
-                return_each_line=False
-            )
-            
-            fallback_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=1000,
-                chunk_overlap=200,
-                separators=["\n\n", "\n", ". ", " ", ""],
-                length_function=len
-            )
-            
             # Normalize text
             normalized_text = self._normalize_text(text)
             
             # Try markdown splitting first
             try:
-                chunks = markdown_splitter.split_text(normalized_text)
+                chunks = self._md_splitter.split_text(normalized_text)
                 
                 if not chunks:
-                    text_chunks = fallback_splitter.split_text(normalized_text)
-                    chunks = [
-                        type('Chunk', (), {
-                            'page_content': chunk,
-                            'metadata': {'section': f'chunk_{i}', 'treatment': 'general'}
-                        })()
-                        for i, chunk in enumerate(text_chunks)
-                    ]
+                    chunks = self._fallback_chunks(normalized_text)
                     
             except Exception:
-                text_chunks = fallback_splitter.split_text(normalized_text)
-                chunks = [
-                    type('Chunk', (), {
-                        'page_content': chunk,
-                        'metadata': {'section': f'chunk_{i}', 'treatment': 'general'}
-                    })()
-                    for i, chunk in enumerate(text_chunks)
-                ]
+                chunks = self._fallback_chunks(normalized_text)
             
             # Process chunks and generate metadata
             processed_texts = []
             metadatas = []
+            processed_at = datetime.utcnow().isoformat()  # one timestamp for the whole document
             
             for chunk in chunks:
                 if chunk.page_content and chunk.page_content.strip():
                     processed_texts.append(chunk.page_content)
-                    metadata = self._classify_chunk_metadata(chunk)
+                    metadata = self._classify_chunk_metadata(chunk, processed_at)
                     metadatas.append(metadata)
             
             return processed_texts, metadatas
@@ -154,36 +557,39 @@ class VectorstoreService:
             logger.error(f"Error creating chunks: {e}")
             return [], []
     
+    def create_chunks_many(self, texts: List[str]) -> List[Tuple[List[str], List[Dict[str, Any]]]]:
+        """create_chunks for several documents; large batches are split in parallel worker processes"""
+        if len(texts) < 2 or sum(map(len, texts)) < CHUNK_POOL_MIN_CHARS:
+            return [self.create_chunks(text) for text in texts]
+        try:
+            return list(_get_chunk_pool().map(_chunk_worker, texts))
+        except Exception as e:
+            logger.warning(f"Chunk worker pool failed, splitting in-process: {e}")
+            return [self.create_chunks(text) for text in texts]
+    
+    def _fallback_chunks(self, normalized_text: str) -> List[_Chunk]:
+        """Split with the recursive splitter when markdown headers don't apply"""
+        return [
+            _Chunk(page_content=chunk, metadata={'section': f'chunk_{i}', 'treatment': 'general'})
+            for i, chunk in enumerate(self._fallback_splitter.split_text(normalized_text))
+        ]
+    
     def _normalize_text(self, text: str) -> str:
         """Normalize text preserving structure"""
         if not text or not text.strip():
             return ""
         
-        lines = text.split('\n')
-        normalized_lines = []
-        
-        for line in lines:
-            line = line.strip()
-            if line:
-                line = line.lower()
-                line = ' '.join(line.split())
-                normalized_lines.append(line)
-        
-        return '\n'.join(normalized_lines)
+        # Lowercase, collapse in-line whitespace, then trim lines and drop blank ones in one pass
+        text = _SPACE_RUN_RE.sub(" ", text.lower().translate(_INLINE_WS_TABLE))
+        return _LINE_BREAK_RE.sub("\n", text).strip(" \n")
     
-    def _classify_chunk_metadata(self, chunk) -> Dict[str, Any]:
+    def _classify_chunk_metadata(self, chunk, processed_at: str = None) -> Dict[str, Any]:
         """Classify chunk metadata"""
         section = chunk.metadata.get("section", "").lower()
         treatment = chunk.metadata.get("treatment", "general")
         
-        if any(word in section for word in ["funciona", "beneficio", "detalle"]):
-            metadata_type = "general"
-        elif any(word in section for word in ["precio", "oferta", "horario"]):
-            metadata_type = "específico"
-        elif any(word in section for word in ["contraindicación", "cuidado"]):
-            metadata_type = "cuidados"
-        else:
-            metadata_type = "otro"
+        best = min((m.lastindex for m in _SECTION_TYPE_RE.finditer(section)), default=None)
+        metadata_type = _SECTION_TYPES[best - 1] if best else "otro"
         
         return {
             "treatment": treatment,
@@ -191,54 +597,102 @@ class VectorstoreService:
             "section": section,
             "chunk_length": len(chunk.page_content),
             "has_headers": str(bool(chunk.metadata)).lower(),
-            "processed_at": datetime.utcnow().isoformat()
+            "processed_at": processed_at or datetime.utcnow().isoformat()
         }
     
-    def find_vectors_by_doc_id(self, doc_id: str) -> List[str]:
-        """Find all vectors for a document"""
-        pattern = f"{self.index_name}:*"
-        keys = self.redis_client.keys(pattern)
-        vectors_to_find = []
+    def iter_vector_fields(self, batch_size: int = 1000) -> Iterator[Tuple[str, Any, Any]]:
+        """Yield (key, doc_id, metadata) for every vector: cursor SCAN (never KEYS), one pipelined HMGET per batch"""
+        def flush(batch):
+            pipe = self.redis_client.pipeline(transaction=False)
+            for key in batch:
+                pipe.hmget(key, 'doc_id', 'metadata')
+            for key, fields in zip(batch, pipe.execute(raise_on_error=False)):
+                if isinstance(fields, Exception):
+                    logger.warning(f"Error checking vector {key}: {fields}")
+                    continue
+                yield key, fields[0], fields[1]
         
-        for key in keys:
+        batch = []
+        for key in self.redis_client.scan_iter(match=f"{self.index_name}:*", count=batch_size):
+            batch.append(key)
+            if len(batch) >= batch_size:
+                yield from flush(batch)
+                batch = []
+        if batch:
+            yield from flush(batch)
+    
+    def _find_doc_vector_fields(self, doc_id: str) -> List[Tuple[str, Any, Any]]:
+        """(key, doc_id, metadata) for every vector of a document"""
+        # Reverse-index set first; documents added before it existed fall through to the index or SCAN
+        members = self.redis_client.smembers(_doc_index_key(doc_id))
+        if members:
+            found = [
+                fields for fields in self._fetch_vector_fields(sorted(members))
+                if fields[1] is not None or fields[2] is not None
+            ]
+            if found:
+                return found
+        
+        if self._doc_id_indexed():
             try:
-                doc_id_direct = self.redis_client.hget(key, 'doc_id')
-                if doc_id_direct == doc_id:
-                    vectors_to_find.append(key)
-                    continue
-                
-                metadata_str = self.redis_client.hget(key, 'metadata')
-                if metadata_str:
-                    try:
-                        metadata = json.loads(metadata_str)
-                        if metadata.get('doc_id') == doc_id:
-                            vectors_to_find.append(key)
-                    except json.JSONDecodeError:
-                        continue
-                        
+                return self._search_doc_vector_fields(doc_id)
             except Exception as e:
-                logger.warning(f"Error checking vector {key}: {e}")
-                continue
+                logger.warning(f"doc_id index lookup failed, scanning instead: {e}")
+        
+        matches = []
+        
+        for key, doc_id_direct, metadata_str in self.iter_vector_fields():
+            if doc_id_direct == doc_id:
+                matches.append((key, doc_id_direct, metadata_str))
+            elif metadata_str:
+                try:
+                    if orjson.loads(metadata_str).get('doc_id') == doc_id:
+                        matches.append((key, doc_id_direct, metadata_str))
+                except (orjson.JSONDecodeError, AttributeError):
+                    continue
         
-        return vectors_to_find
+        return matches
     
-    def delete_vectors(self, vector_keys: List[str]) -> int:
-        """Delete specific vectors"""
+    def _search_doc_vector_fields(self, doc_id: str) -> List[Tuple[str, Any, Any]]:
+        """Index lookup on the doc_id TAG, then one pipelined HMGET for the matching keys"""
+        escaped = _TAG_ESCAPE_RE.sub(r"\\\1", doc_id)
+        query = Query(f"@doc_id:{{{escaped}}}").no_content().paging(0, 10000)
+        return self._fetch_vector_fields([doc.id for doc in self.redis_client.ft(self.index_name).search(query).docs])
+    
+    def _fetch_vector_fields(self, keys: List[str]) -> List[Tuple[str, Any, Any]]:
+        """(key, doc_id, metadata) for the given vector keys in one pipelined round trip"""
+        if not keys:
+            return []
+        pipe = self.redis_client.pipeline(transaction=False)
+        for key in keys:
+            pipe.hmget(key, 'doc_id', 'metadata')
+        return [(key, fields[0], fields[1]) for key, fields in zip(keys, pipe.execute())]
+    
+    def find_vectors_by_doc_id(self, doc_id: str) -> List[str]:
+        """Find all vectors for a document"""
+        return [key for key, _, _ in self._find_doc_vector_fields(doc_id)]
+    
+    def delete_vectors(self, vector_keys: List[str], doc_ids: Iterable[str] = ()) -> int:
+        """Delete specific vectors (and the reverse-index sets of doc_ids, whose vectors are all gone)"""
         if vector_keys:
-            self.redis_client.delete(*vector_keys)
+            # UNLINK frees memory in the background; chunks keep each command small
+            pipe = self.redis_client.pipeline(transaction=False)
+            for i in range(0, len(vector_keys), DELETE_BATCH_SIZE):
+                pipe.unlink(*vector_keys[i:i + DELETE_BATCH_SIZE])
+            for doc_id in doc_ids:
+                pipe.unlink(_doc_index_key(doc_id))
+            pipe.execute()
+            _bump_index_generation()
             return len(vector_keys)
         return 0
     
     def get_document_vectors(self, doc_id: str) -> List[Dict[str, Any]]:
         """Get detailed vector information for a document"""
-        vectors = self.find_vectors_by_doc_id(doc_id)
         vector_details = []
         
-        for vector_key in vectors:
+        # Fields come back with the lookup itself: no extra HGETs per vector
+        for vector_key, doc_id_direct, metadata_str in self._find_doc_vector_fields(doc_id):
             try:
-                metadata_str = self.redis_client.hget(vector_key, 'metadata')
-                doc_id_direct = self.redis_client.hget(vector_key, 'doc_id')
-                
                 vector_info = {
                     "vector_key": vector_key,
                     "doc_id_direct": doc_id_direct,
@@ -247,11 +701,11 @@ class VectorstoreService:
                 
                 if metadata_str:
                     try:
-                        metadata = json.loads(metadata_str)
+                        metadata = orjson.loads(metadata_str)
                         safe_metadata = {k: v for k, v in metadata.items() 
                                        if k not in ['embedding', 'vector']}
                         vector_info["metadata"] = safe_metadata
-                    except json.JSONDecodeError:
+                    except orjson.JSONDecodeError:
                         vector_info["metadata_error"] = "Invalid JSON"
                 
                 vector_details.append(vector_info)
@@ -267,11 +721,14 @@ class VectorstoreService:
         try:
             # Get index info
             info = self.redis_client.ft(self.index_name).info()
-            doc_count = info.get('num_docs', 0)
+            doc_count = int(info.get('num_docs', 0))
             
-            # Count stored documents
-            stored_keys = list(self.redis_client.scan_iter(match=f"{self.index_name}:*"))
-            stored_count = len(stored_keys)
+            # A populated index already counts its keys; only an empty one needs the keyspace
+            # scan to tell "no data" from "data the index lost"
+            if doc_count > 0:
+                stored_count = doc_count
+            else:
+                stored_count = sum(1 for _ in self.redis_client.scan_iter(match=f"{self.index_name}:*", count=10000))
             
             return {
                 "index_exists": True,
@@ -303,6 +760,7 @@ class VectorstoreService:
                 self.redis_client.ft(self.index_name).dropindex(delete_documents=False)
             except:
                 pass
+            reset_index_schema_cache()
             
             # Recreate vectorstore
             self._initialize_vectorstore()
@@ -4,6 +4,7 @@ from .validators import *
 from .decorators import *
 from .error_handlers import *
 from .helpers import *
+from .json_provider import register_json_provider
 
 __all__ = [
     'validate_webhook_data',
@@ -12,5 +13,6 @@ __all__ = [
     'require_api_key',
     'create_success_response',
     'create_error_response',
-    'register_error_handlers'
+    'register_error_handlers',
+    'register_json_provider'
 ]
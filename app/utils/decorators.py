@@ -36,22 +36,24 @@ def cache_result(timeout=300):
         @wraps(f)
         def decorated_function(*args, **kwargs):
             from app.services.redis_service import get_redis_client
-            import json
+            import hashlib
+            import orjson
             
-            # Create cache key
-            cache_key = f"cache:{f.__name__}:{str(args)}:{str(kwargs)}"
+            # Create cache key from a fixed-size digest of the arguments (not their repr)
+            payload = orjson.dumps((args, kwargs), default=repr, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+            cache_key = f"cache:{f.__name__}:{hashlib.blake2b(payload, digest_size=16).hexdigest()}"
             redis_client = get_redis_client()
             
             # Check cache
             cached = redis_client.get(cache_key)
             if cached:
-                return json.loads(cached)
+                return orjson.loads(cached)
             
             # Get fresh result
             result = f(*args, **kwargs)
             
             # Cache result
-            redis_client.setex(cache_key, timeout, json.dumps(result))
+            redis_client.setex(cache_key, timeout, orjson.dumps(result))
             
             return result
         return decorated_function
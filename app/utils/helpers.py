@@ -1,7 +1,10 @@
 from flask import jsonify
-from typing import Dict, Any
+from typing import Dict, Any, Union
 import hashlib
+import orjson
+import os
 import time
+from urllib.parse import urlparse
 from datetime import datetime
 
 def create_success_response(data: Dict[str, Any], status_code: int = 200):
@@ -12,9 +15,11 @@ def create_error_response(message: str, status_code: int = 400):
     """Create standardized error response"""
     return jsonify({"status": "error", "message": message}), status_code
 
-def generate_doc_id(content: str) -> str:
-    """Generate document ID from content"""
-    return hashlib.md5(content.encode()).hexdigest()
+def generate_doc_id(content: Union[str, bytes]) -> str:
+    """Generate document ID from content (MD5 kept: ids are persisted and content-addressed)"""
+    if isinstance(content, str):
+        content = content.encode()
+    return hashlib.md5(content, usedforsecurity=False).hexdigest()
 
 def get_timestamp() -> float:
     """Get current timestamp"""
@@ -30,27 +35,29 @@ def sanitize_user_id(user_id: str) -> str:
         return f"chatwoot_contact_{user_id}"
     return user_id
 
+# (content-type token, extension, also matched by URL suffix), in priority order
+_EXTENSION_RULES = (
+    ('mp3', '.mp3', True),
+    ('wav', '.wav', True),
+    ('m4a', '.m4a', True),
+    ('ogg', '.ogg', True),
+    ('jpeg', '.jpg', False),
+    ('jpg', '.jpg', False),
+    ('png', '.png', True),
+    ('gif', '.gif', True),
+    ('webp', '.webp', True),
+)
+
 def extract_file_extension(url: str, content_type: str = "") -> str:
     """Extract file extension from URL or content type"""
-    # Check content type first
     content_type_lower = content_type.lower()
+    # Read the URL suffix once instead of one endswith() per rule
+    dot = url.rfind('.')
+    url_ext = url[dot:] if dot != -1 else ''
     
-    if 'mp3' in content_type_lower or url.endswith('.mp3'):
-        return '.mp3'
-    elif 'wav' in content_type_lower or url.endswith('.wav'):
-        return '.wav'
-    elif 'm4a' in content_type_lower or url.endswith('.m4a'):
-        return '.m4a'
-    elif 'ogg' in content_type_lower or url.endswith('.ogg'):
-        return '.ogg'
-    elif 'jpeg' in content_type_lower or 'jpg' in content_type_lower:
-        return '.jpg'
-    elif 'png' in content_type_lower or url.endswith('.png'):
-        return '.png'
-    elif 'gif' in content_type_lower or url.endswith('.gif'):
-        return '.gif'
-    elif 'webp' in content_type_lower or url.endswith('.webp'):
-        return '.webp'
+    for token, extension, match_url in _EXTENSION_RULES:
+        if token in content_type_lower or (match_url and url_ext == extension):
+            return extension
     
     # Default based on content type category
     if 'audio' in content_type_lower:
@@ -60,6 +67,33 @@ def extract_file_extension(url: str, content_type: str = "") -> str:
     
     return ''
 
+# Audio MIME types -> upload extension Whisper recognizes
+AUDIO_EXTENSIONS_BY_TYPE = {
+    'audio/mpeg': '.mp3',
+    'audio/mp3': '.mp3',
+    'audio/wav': '.wav',
+    'audio/x-wav': '.wav',
+    'audio/wave': '.wav',
+    'audio/mp4': '.m4a',
+    'audio/m4a': '.m4a',
+    'audio/x-m4a': '.m4a',
+    'audio/ogg': '.ogg',
+    'audio/opus': '.ogg',
+    'audio/webm': '.webm',
+}
+WHISPER_AUDIO_EXTENSIONS = frozenset(
+    {'.flac', '.m4a', '.mp3', '.mp4', '.mpeg', '.mpga', '.oga', '.ogg', '.wav', '.webm'}
+)
+
+def audio_upload_extension(content_type: str, url: str) -> str:
+    """Upload extension for Whisper: content-type lookup, then the URL path, then .ogg (Chatwoot's default)"""
+    ext = AUDIO_EXTENSIONS_BY_TYPE.get(content_type.split(';', 1)[0].strip().lower())
+    if ext:
+        return ext
+    
+    ext = os.path.splitext(urlparse(url).path)[1].lower()
+    return ext if ext in WHISPER_AUDIO_EXTENSIONS else '.ogg'
+
 def format_file_size(size_bytes: int) -> str:
     """Format file size in human readable format"""
     for unit in ['B', 'KB', 'MB', 'GB']:
@@ -77,8 +111,7 @@ def truncate_text(text: str, max_length: int = 200) -> str:
 def safe_json_parse(json_str: str, default: Any = None) -> Any:
     """Safely parse JSON with default value"""
     try:
-        import json
-        return json.loads(json_str)
+        return orjson.loads(json_str)
     except:
         return default
 
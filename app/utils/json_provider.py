@@ -0,0 +1,31 @@
+from flask.json.provider import JSONProvider
+import decimal
+import orjson
+
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def _default(obj):
+    """Fallback for types orjson does not serialize natively"""
+    if isinstance(obj, decimal.Decimal):
+        return str(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if hasattr(obj, "__html__"):
+        return str(obj.__html__())
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson (used by jsonify and request.get_json)"""
+
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+def register_json_provider(app):
+    """Install the orjson provider on the Flask app"""
+    app.json = OrjsonProvider(app)